@@ -0,0 +1,77 @@
+"""
+Compares reading the full history of one pair from the Rate table (SQLite) with reading it from the Parquet archive,
+and one year of every pair (the archive only opens files of that year). Needs pyarrow.
+
+Usage (from "src" directory):
+    python -m benchmarks.bench_archive --rows 150000 --currencies 5
+"""
+import argparse
+import sys
+import tempfile
+import time
+from datetime import date
+from pathlib import Path
+
+from .data import CURRENCY_CODES, populate_rates
+from .utils import setup_django, benchmark_database, measure, summarize
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=150_000,
+                        help="Number of Rate rows to generate (daily rates, about 20 years per pair by default).")
+    parser.add_argument("--currencies", type=int, default=5)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--db", type=str, default=None, help="SQLite file for the generated data (in memory by default).")
+    args = parser.parse_args()
+
+    setup_django()
+    from django.db import connection
+    from django.test.utils import override_settings
+    from currencies.archive import ArchiveError, archive_pair_rates, import_pyarrow, iter_archived_rows, read_archive_frame
+    from currencies.models import Rate
+    from currencies.pagination import iter_rate_rows, order_rates
+    from currencies.timestamps import get_ts_range_filters, to_timestamp
+
+    try:
+        import_pyarrow()
+    except ArchiveError as error:
+        sys.exit(str(error))
+
+    codes = CURRENCY_CODES[:args.currencies]
+    with benchmark_database(args.db), tempfile.TemporaryDirectory() as archive_dir, \
+            override_settings(CURRENCY_ARCHIVE_DIR=archive_dir):
+        start = time.perf_counter()
+        inserted = populate_rates(connection, codes, args.rows)
+        print(f"Generated {inserted} rates for {len(codes)} currencies in {time.perf_counter()-start:.1f} s\n")
+
+        base, quote = codes[:2]
+        pair_qs = Rate.objects.filter(base_currency__code=base, quote_currency__code=quote)
+        last = Rate.objects.order_by("-ts").values_list("ts", flat=True).first()
+        year = get_ts_range_filters(date(last.year - 1, 1, 1), date(last.year - 1, 12, 31))
+        read_live = lambda qs: sum(1 for _ in iter_rate_rows(order_rates(qs, None), chunk_size=10_000))
+        read_archive = lambda **filters: sum(1 for _ in iter_archived_rows(**filters))
+
+        results = {}
+        results["pair history (SQLite)"] = measure(read_live, pair_qs, repeat=args.repeat)
+        results["year of pairs (SQLite)"] = measure(read_live, Rate.objects.filter(**year), repeat=args.repeat)
+
+        start = time.perf_counter()
+        pairs = Rate.objects.filter(ts__isnull=False).values_list("base_currency_id", "quote_currency_id",
+                                                                  "base_currency__code", "quote_currency__code").distinct()
+        archived = sum(archive_pair_rates(base_id, quote_id, f"{base_code}{quote_code}", to_timestamp(last.date()))
+                       for base_id, quote_id, base_code, quote_code in pairs)
+        size = sum(path.stat().st_size for path in Path(archive_dir).rglob("*.parquet"))
+        print(f"Archived {archived} rates ({size / 2**20:.1f} MiB of Parquet) in {time.perf_counter()-start:.1f} s\n")
+
+        results["pair history (archive)"] = measure(read_archive, base=base, quote=quote, repeat=args.repeat)
+        results["year of pairs (archive)"] = measure(read_archive, **year, repeat=args.repeat)
+        # columnar read used by triangulation and dated conversions (no row dictionaries)
+        all_pairs = [f"{base_code}{quote_code}" for _, _, base_code, quote_code in pairs]
+        results["year of pairs (frame)"] = measure(lambda: len(read_archive_frame(all_pairs, **year)), repeat=args.repeat)
+        for label, (timings, count) in results.items():
+            print(f"{summarize(label, timings)}   rows {count}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+"""
+Measures POST /api/currency/convert with large batches: latest rates, dated rates, a mix of both
+and instants ("at", every item a distinct second as in invoice reconciliation).
+Only legs against USD are stored, so most items are triangulated.
+
+Usage (from "src" directory):
+    python -m benchmarks.bench_convert --items 20000
+"""
+import argparse
+import json
+import random
+from datetime import date, datetime, time, timedelta, timezone
+
+from .data import CURRENCY_CODES
+from .utils import setup_django, benchmark_database, measure, summarize
+
+
+def populate_legs(currency_codes, days):
+    """Stores daily rates of every currency against USD (the default pivot) for `days` days, returns the first day."""
+    from currencies.models import Currency, LatestRate, Rate
+
+    for code in currency_codes:
+        Currency.objects.create(code=code)
+    ids = dict(Currency.objects.values_list("code", "id"))
+    start = date(2024, 1, 1)
+    rng = random.Random(0)
+    Rate.objects.bulk_create([Rate(base_currency_id=ids[code], quote_currency_id=ids["USD"],
+                                   exchange_rate=round(rng.uniform(0.5, 2.0), 3),
+                                   date=start + timedelta(days=day), time=None)
+                              for code in currency_codes if code != "USD" for day in range(days)],
+                             batch_size=5000)
+    LatestRate.refresh([(ids[code], ids["USD"]) for code in currency_codes if code != "USD"])
+    return start
+
+
+def make_items(currency_codes, count, start, dates, dated_share, instants=False):
+    rng = random.Random(1)
+    items = []
+    for _ in range(count):
+        item = {"amount": f"{rng.uniform(1, 1000):.2f}", "from": rng.choice(currency_codes), "to": rng.choice(currency_codes)}
+        if instants:
+            midnight = datetime.combine(start, time.min, tzinfo=timezone.utc)
+            item["at"] = (midnight + timedelta(seconds=rng.randrange(dates * 86400))).isoformat()
+        elif rng.random() < dated_share:
+            item["date"] = (start + timedelta(days=rng.randrange(dates))).isoformat()
+        items.append(item)
+    return json.dumps({"items": items})
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--items", type=int, default=20_000)
+    parser.add_argument("--currencies", type=int, default=20)
+    parser.add_argument("--days", type=int, default=365, help="Days of stored rates.")
+    parser.add_argument("--dates", type=int, default=30, help="Distinct dates of dated items (<= days).")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    setup_django()
+    from django.test import Client
+    from django.test.utils import setup_test_environment
+
+    setup_test_environment()
+    codes = ["USD", *[code for code in CURRENCY_CODES if code != "USD"]][:args.currencies]
+    with benchmark_database():
+        start = populate_legs(codes, args.days)
+        client = Client()
+        print(f"{args.items} items, {len(codes)} currencies, {args.days} days of rates, {args.dates} distinct item dates\n")
+        for label, dated_share, instants in (("latest", 0.0, False), ("dated", 1.0, False), ("mixed", 0.5, False),
+                                             ("instants", 1.0, True)):
+            body = make_items(codes, args.items, start, min(args.dates, args.days), dated_share, instants)
+            timings, response = measure(client.post, "/api/currency/convert", body, content_type="application/json",
+                                        repeat=args.repeat)
+            assert response.status_code == 200, response.content[:200]
+            print(summarize(label, timings))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+"""
+Compares the columnar ingestion path of fetch_data with the previous per-row (iterrows) path
+on a synthetic multi-ticker frame shaped like a yf.download() response.
+The same rows are then replayed from a CSV dump (ReplayProvider) and loaded into the database with fetch_data --replay,
+which measures the whole ingest pipeline offline.
+
+Usage (from "src" directory):
+    python -m benchmarks.bench_ingestion --currencies 20 --periods 2000
+"""
+import argparse
+import io
+import os
+import tempfile
+import time
+
+import pandas as pd
+
+from .data import CURRENCY_CODES, make_yfinance_frame
+from .utils import setup_django, benchmark_database, measure, summarize
+
+
+def parse_rowwise(command, response, exchange_tickers):
+    """Reference implementation: the per-row path fetch_data used before the columnar engine."""
+    from currencies.management.commands.fetch_data import get_existing_currencies_dict, get_currency_obj
+    from currencies.models import Rate
+
+    existing_currencies_dict = get_existing_currencies_dict()
+    timestamp_col_name = response.index.name
+    model_instances = []
+    for exchange_ticker in exchange_tickers:
+        ticker_df = response[exchange_ticker][["Open", "Close"]]
+        for timestamp, row in ticker_df.iterrows():
+            if not pd.isna(row["Close"]):
+                _exchange_rate_ = row["Close"]
+            elif not pd.isna(row["Open"]):
+                _exchange_rate_ = row["Open"]
+            else:
+                continue
+            _base_, existing_currencies_dict = get_currency_obj(command, exchange_ticker[:3], existing_currencies_dict)
+            _quote_, existing_currencies_dict = get_currency_obj(command, exchange_ticker[3:6], existing_currencies_dict)
+            timestamp = timestamp.to_pydatetime()
+            model_instances.append(Rate(date=timestamp.date(),
+                                        time=None if timestamp_col_name == "Date" else timestamp.time(),
+                                        base_currency=_base_,
+                                        quote_currency=_quote_,
+                                        exchange_rate=_exchange_rate_))
+    return model_instances
+
+
+def parse_columnar(command, provider, exchange_tickers):
+    """Columnar path of fetch_data: normalized provider batches turned into Rate instances."""
+    from currencies.ingestion import frame_to_rate_instances
+    from currencies.management.commands.fetch_data import iter_rate_batches
+
+    batches = provider.iter_batches(exchange_tickers, interval="1d")
+    return [rate for _, batch in iter_rate_batches(command, batches, None) for rate in frame_to_rate_instances(batch)]
+
+
+def write_replay_dump(response, exchange_tickers, path):
+    """Writes every valid cell of a yf.download() shaped frame as pair,timestamp,rate CSV rows."""
+    from currencies.ingestion import normalize_yfinance_response
+
+    frame, _ = normalize_yfinance_response(response, exchange_tickers)
+    timestamps = pd.to_datetime(frame["date"].astype(str))
+    pd.DataFrame({"pair": frame["base"] + frame["quote"], "timestamp": timestamps,
+                  "rate": frame["exchange_rate"]}).to_csv(path, index=False)
+    return len(frame)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--currencies", type=int, default=20, help="Number of currencies (tickers = N*(N-1)).")
+    parser.add_argument("--periods", type=int, default=500, help="Number of timestamps per ticker.")
+    parser.add_argument("--freq", type=str, default="1D", help="Pandas frequency of timestamps, e.g. 1D or 1h.")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    setup_django()
+    from django.core.management import call_command
+    from currencies.management.commands.fetch_data import Command
+    from django.db import models
+    from currencies.models import Rate
+    from currencies.providers import FrameProvider, ReplayProvider
+
+    response, tickers = make_yfinance_frame(CURRENCY_CODES[:args.currencies], args.periods, freq=args.freq)
+    print(f"{len(tickers)} tickers x {args.periods} timestamps = {len(tickers)*args.periods} cells\n")
+    with benchmark_database(), tempfile.TemporaryDirectory() as directory:
+        command = Command(stdout=io.StringIO(), stderr=io.StringIO())
+        rowwise_timings, rowwise = measure(parse_rowwise, command, response, tickers, repeat=args.repeat)
+        columnar_timings, columnar = measure(parse_columnar, command, FrameProvider(response), tickers, repeat=args.repeat)
+        dump = os.path.join(directory, "rates.csv")
+        write_replay_dump(response, tickers, dump)
+        replay_timings, replayed = measure(parse_columnar, command, ReplayProvider(dump), tickers, repeat=args.repeat)
+        start = time.perf_counter()
+        call_command("fetch_data", ",".join(CURRENCY_CODES[:args.currencies]), replay=dump, stdout=io.StringIO())
+        ingest_time = time.perf_counter() - start
+        stored = Rate.objects.exclude(base_currency_id=models.F("quote_currency_id")).count()
+    assert len(rowwise) == len(columnar) == len(replayed) == stored, (len(rowwise), len(columnar), len(replayed), stored)
+    print(summarize("rowwise (iterrows)", rowwise_timings))
+    print(summarize("columnar", columnar_timings))
+    print(summarize("replay CSV (parse)", replay_timings))
+    print(f"\nspeedup x{min(rowwise_timings)/min(columnar_timings):.1f} on {len(columnar)} rows")
+    print(f"fetch_data --replay stored {stored} rows in {ingest_time:.2f} s ({stored/ingest_time:,.0f} rows/s)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+"""
+Measures p50/p99 latency of the detail endpoint (/api/currency/{BASE}/{QUOTE}/) on a large SQLite rate table
+and shows the query plans of the joined (code) and id based latest-rate lookups.
+
+Usage (from "src" directory):
+    python -m benchmarks.bench_latest_rate --rows 10000000 --db /tmp/bench_rates.sqlite3
+"""
+import argparse
+import random
+import time
+
+import numpy as np
+
+from .data import CURRENCY_CODES, populate_rates
+from .utils import setup_django, benchmark_database
+
+
+def percentiles(latencies):
+    values = np.array(latencies) * 1000
+    return f"p50 {np.percentile(values, 50):8.3f} ms   p99 {np.percentile(values, 99):8.3f} ms   max {values.max():8.3f} ms"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=10_000_000, help="Number of Rate rows to generate.")
+    parser.add_argument("--currencies", type=int, default=20)
+    parser.add_argument("--requests", type=int, default=2000, help="Number of measured requests per scenario.")
+    parser.add_argument("--db", type=str, default=None, help="SQLite file for the generated data (in memory by default).")
+    args = parser.parse_args()
+
+    setup_django()
+    from django.db import connection
+    from django.test import Client
+    from django.test.utils import setup_test_environment
+    from currencies.models import Rate
+
+    setup_test_environment()
+    codes = CURRENCY_CODES[:args.currencies]
+    with benchmark_database(args.db):
+        start = time.perf_counter()
+        inserted = populate_rates(connection, codes, args.rows)
+        print(f"Generated {inserted} rates for {len(codes)} currencies in {time.perf_counter()-start:.1f} s\n")
+
+        rng = random.Random(0)
+        pairs = [rng.sample(codes, 2) for _ in range(args.requests)]
+        scenarios = {
+            "get_latest (code join)": lambda base, quote: Rate.get_latest(base_currency__code=base,
+                                                                          quote_currency__code=quote),
+            "get_latest_by_codes (ids)": lambda base, quote: Rate.get_latest_by_codes(base, quote),
+            "GET detail endpoint": lambda base, quote, client=Client(): client.get(f"/api/currency/{base}/{quote}/"),
+        }
+        for label, func in scenarios.items():
+            func(*pairs[0])  # warm up
+            latencies = []
+            for base, quote in pairs:
+                request_start = time.perf_counter()
+                func(base, quote)
+                latencies.append(time.perf_counter() - request_start)
+            print(f"{label:<28} {percentiles(latencies)}")
+
+        base_id, quote_id = Rate.objects.values_list("base_currency_id", "quote_currency_id").last()
+        print("\nQuery plans:")
+        for label, qs in (("code join", Rate.objects.filter(base_currency__code=codes[0], quote_currency__code=codes[1])),
+                          ("ids", Rate.objects.filter(base_currency_id=base_id, quote_currency_id=quote_id))):
+            print(f"  {label}: {qs.order_by('-ts')[:1].explain()}")
+
+
+if __name__ == "__main__":
+    main()
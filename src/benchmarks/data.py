@@ -0,0 +1,62 @@
+"""
+Synthetic data shared by the benchmarks: yf.download() shaped frames and rate tables of N currencies x M timestamps.
+"""
+from datetime import date, timedelta
+from itertools import permutations
+
+import numpy as np
+import pandas as pd
+
+CURRENCY_CODES = ["EUR", "USD", "JPY", "PLN", "GBP", "CHF", "CAD", "AUD", "NZD", "SEK",
+                  "NOK", "DKK", "CZK", "HUF", "CNY", "HKD", "SGD", "KRW", "INR", "MXN",
+                  "BRL", "ZAR", "TRY", "ILS", "THB"]
+
+
+def make_yfinance_frame(currency_codes, periods, freq="1D", nan_ratio=0.05, seed=0):
+    """
+    Builds a frame with the same layout as yf.download(..., group_by="ticker"):
+    (Ticker, Price) column MultiIndex and a "Date"/"Datetime" named index. Like yfinance, daily frames
+    get a naive "Date" index and intraday frames a tz-aware "Datetime" one.
+    """
+    rng = np.random.default_rng(seed)
+    tickers = [f"{base}{quote}=X" for base, quote in permutations(currency_codes, r=2)]
+    daily = freq == "1D"
+    index = pd.date_range("2000-01-01", periods=periods, freq=freq, tz=None if daily else "UTC",
+                          name="Date" if daily else "Datetime")
+    prices = ["Open", "High", "Low", "Close", "Adj Close", "Volume"]
+    columns = pd.MultiIndex.from_product([tickers, prices], names=["Ticker", "Price"])
+    values = rng.uniform(0.5, 2.0, size=(periods, len(columns)))
+    values[rng.random(values.shape) < nan_ratio] = np.nan
+    return pd.DataFrame(values, index=index, columns=columns), tickers
+
+
+def populate_rates(connection, currency_codes, rows, chunk_size=100_000):
+    """
+    Inserts currencies (with their self-exchange rates) and about `rows` daily rates spread evenly over every pair.
+    Rates are written with raw executemany, the ORM would dominate generation time.
+    """
+    from django.db import transaction
+    from currencies.fields import to_scaled
+    from currencies.models import Currency, LatestRate, Rate
+
+    for code in currency_codes:
+        Currency.objects.create(code=code)
+    ids = dict(Currency.objects.values_list("code", "id"))
+    pairs = [(ids[base], ids[quote]) for base, quote in permutations(currency_codes, r=2)]
+    per_pair = max(rows // len(pairs), 1)
+    start_date = date(1970, 1, 1)
+    table = Rate._meta.db_table
+    sql = (f"INSERT INTO {table} (base_currency_id, quote_currency_id, exchange_rate, ts, granularity) "
+           f"VALUES (%s, %s, %s, %s, 'daily')")
+    rng = np.random.default_rng(0)
+    with transaction.atomic(), connection.cursor() as cursor:
+        for base_id, quote_id in pairs:
+            for chunk_start in range(0, per_pair, chunk_size):
+                chunk = range(chunk_start, min(chunk_start + chunk_size, per_pair))
+                values = np.round(rng.uniform(0.5, 2.0, len(chunk)), 3).tolist()
+                cursor.executemany(sql, [(base_id, quote_id, to_scaled(value), f"{start_date + timedelta(days=day)} 00:00:00")
+                                         for day, value in zip(chunk, values)])
+        LatestRate.refresh(pairs) # raw inserts bypass Rate.save()
+    with connection.cursor() as cursor:
+        cursor.execute("ANALYZE")
+    return len(pairs) * per_pair
@@ -0,0 +1,164 @@
+"""
+HTTP load test of the API: N concurrent keep-alive connections hammer an endpoint for a fixed time,
+throughput (req/s) and p50/p99 latency are reported.
+Either points at an already running server (--url) or starts one itself:
+    wsgi - gunicorn with sync views (CURRENCY_API_ASYNC=False)
+    asgi - uvicorn with async views (CURRENCY_API_ASYNC=True)
+The started servers use the database configured in settings, populate it first (i.e.: rav run fetch_data).
+
+Usage (from "src" directory):
+    python -m benchmarks.load_test --server asgi --path /api/currency/EUR/USD/
+    python -m benchmarks.load_test --compare --connections 500 --duration 20
+    python -m benchmarks.load_test --url http://127.0.0.1:8000 --path /api/currency/
+"""
+import argparse
+import asyncio
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import time
+from urllib.parse import urlsplit
+
+import numpy as np
+
+SERVERS = {
+    "wsgi": {"executable": "gunicorn", "async_api": "False",
+             "command": lambda port, workers: ["gunicorn", "djangohome.wsgi:application", "--bind", f"127.0.0.1:{port}",
+                                               "--workers", str(workers), "--threads", "8", "--log-level", "warning"]},
+    "asgi": {"executable": "uvicorn", "async_api": "True",
+             "command": lambda port, workers: ["uvicorn", "djangohome.asgi:application", "--host", "127.0.0.1",
+                                               "--port", str(port), "--workers", str(workers), "--log-level", "warning"]},
+}
+
+
+async def read_response(reader):
+    """Reads one HTTP/1.1 response, returns its status code (body is discarded)."""
+    status_line = await reader.readline()
+    if not status_line:
+        raise ConnectionError("Connection closed by server.")
+    status = int(status_line.split()[1])
+    length, chunked = 0, False
+    while (line := await reader.readline()) not in (b"\r\n", b""):
+        name, _, value = line.decode("latin-1").partition(":")
+        name = name.strip().lower()
+        if name == "content-length":
+            length = int(value)
+        elif name == "transfer-encoding" and "chunked" in value.lower():
+            chunked = True
+    if chunked:
+        while (size := int((await reader.readline()).split(b";")[0], 16)):
+            await reader.readexactly(size + 2)
+        await reader.readline()
+    elif length:
+        await reader.readexactly(length)
+    return status
+
+
+async def connection_worker(host, port, request, deadline, latencies, errors):
+    """Sends requests over a single keep-alive connection until deadline, reconnecting after failures."""
+    writer = None
+    while time.perf_counter() < deadline:
+        try:
+            if writer is None:
+                reader, writer = await asyncio.open_connection(host, port)
+            start = time.perf_counter()
+            writer.write(request)
+            await writer.drain()
+            status = await read_response(reader)
+            latencies.append(time.perf_counter() - start)
+            if status >= 400:
+                errors[status] = errors.get(status, 0) + 1
+        except (OSError, ConnectionError, asyncio.IncompleteReadError, ValueError, IndexError) as error:
+            errors[type(error).__name__] = errors.get(type(error).__name__, 0) + 1
+            if writer is not None:
+                writer.close()
+            writer = None
+            await asyncio.sleep(0.01)
+    if writer is not None:
+        writer.close()
+
+
+async def run_load(url, path, connections, duration):
+    """
+    Returns:
+        result (dict): in format of {"requests": ..., "rps": ..., "p50_ms": ..., "p99_ms": ..., "errors": {...}}
+    """
+    parts = urlsplit(url)
+    host, port = parts.hostname, parts.port or 80
+    request = f"GET {path} HTTP/1.1\r\nHost: {host}:{port}\r\nConnection: keep-alive\r\n\r\n".encode()
+    latencies, errors = [], {}
+    start = time.perf_counter()
+    deadline = start + duration
+    await asyncio.gather(*(connection_worker(host, port, request, deadline, latencies, errors)
+                           for _ in range(connections)))
+    elapsed = time.perf_counter() - start
+    values = np.array(latencies or [0.0]) * 1000
+    return {"requests": len(latencies),
+            "rps": len(latencies) / elapsed,
+            "p50_ms": float(np.percentile(values, 50)),
+            "p99_ms": float(np.percentile(values, 99)),
+            "errors": errors}
+
+
+def start_server(kind, port, workers):
+    """Starts gunicorn/uvicorn in the background and waits until it accepts connections."""
+    server = SERVERS[kind]
+    if shutil.which(server["executable"]) is None:
+        sys.exit(f"'{server['executable']}' is not installed, run: pip install {server['executable']}")
+    env = {**os.environ, "CURRENCY_API_ASYNC": server["async_api"], "DEBUG": "False"}
+    process = subprocess.Popen(server["command"](port, workers), env=env)
+    for _ in range(100):
+        try:
+            with socket.create_connection(("127.0.0.1", port), timeout=1):
+                return process
+        except OSError:
+            time.sleep(0.1)
+    process.terminate()
+    sys.exit(f"{kind} server did not start on port {port}.")
+
+
+def stop_server(process):
+    process.terminate()
+    try:
+        process.wait(timeout=10)
+    except subprocess.TimeoutExpired:
+        process.kill()
+
+
+def print_result(label, result):
+    errors = ", ".join(f"{name}: {count}" for name, count in result["errors"].items()) or "none"
+    print(f"{label:<6} {result['rps']:10.1f} req/s   p50 {result['p50_ms']:8.2f} ms   "
+          f"p99 {result['p99_ms']:8.2f} ms   requests {result['requests']}   errors {errors}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    target = parser.add_mutually_exclusive_group()
+    target.add_argument("--url", type=str, default=None, help="Base URL of an already running server.")
+    target.add_argument("--server", choices=SERVERS.keys(), default=None, help="Start this server for the test.")
+    target.add_argument("--compare", action="store_true", help="Run the test against wsgi and then asgi server.")
+    parser.add_argument("--path", type=str, default="/api/currency/EUR/USD/")
+    parser.add_argument("--connections", type=int, default=500)
+    parser.add_argument("--duration", type=float, default=10.0, help="Seconds of load per server.")
+    parser.add_argument("--workers", type=int, default=1, help="Worker processes of started servers.")
+    parser.add_argument("--port", type=int, default=8765, help="Port of started servers.")
+    args = parser.parse_args()
+
+    if args.url:
+        print_result("url", asyncio.run(run_load(args.url, args.path, args.connections, args.duration)))
+        return
+    kinds = list(SERVERS) if (args.compare or args.server is None) else [args.server]
+    print(f"{args.connections} connections, {args.duration:.0f} s per server, GET {args.path}\n")
+    for kind in kinds:
+        process = start_server(kind, args.port, args.workers)
+        try:
+            result = asyncio.run(run_load(f"http://127.0.0.1:{args.port}", args.path, args.connections, args.duration))
+        finally:
+            stop_server(process)
+        print_result(kind, result)
+
+
+if __name__ == "__main__":
+    main()
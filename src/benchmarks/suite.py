@@ -0,0 +1,211 @@
+"""
+Offline benchmark suite of the API and ingestion hot paths, results are saved as JSON so runs can be compared.
+N currencies x M daily timestamps are synthesized into a throw-away SQLite database (every pair stored), then:
+    micro - Rate.get_latest lookups, list_rate page and CSV export serialization,
+            normalize_yfinance_response on a yf.download() shaped frame
+    api   - requests per second of the main endpoints through the Django test client (whole request cycle, no server)
+
+Usage (from "src" directory):
+    python -m benchmarks.suite --currencies 10 --timestamps 2000 --output before.json
+    python -m benchmarks.suite --currencies 10 --timestamps 2000 --compare before.json --max-regression 0.2
+"""
+import argparse
+import io
+import json
+import platform
+import random
+import statistics
+import subprocess
+import sys
+from datetime import date, datetime, timedelta, timezone
+from itertools import permutations
+
+from .data import CURRENCY_CODES, make_yfinance_frame, populate_rates
+from .utils import setup_django, benchmark_database, measure
+
+
+def get_environment():
+    import django
+    import numpy as np
+    import pandas as pd
+
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                                check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {"python": platform.python_version(), "django": django.__version__, "numpy": np.__version__,
+            "pandas": pd.__version__, "platform": platform.platform(), "commit": commit}
+
+
+def get_micro_benchmarks(codes, timestamps, lookups):
+    """
+    Returns:
+        benchmarks (dict): in format of {name: (func, operations per call)}
+    """
+    from ninja.responses import NinjaJSONEncoder
+    from currencies.ingestion import normalize_yfinance_response
+    from currencies.models import Rate
+    from currencies.pagination import iter_rate_rows, order_rates, paginate_rates
+    from currencies.schemas import RatePageSchema
+    from currencies.streaming import iter_csv
+
+    rng = random.Random(0)
+    pairs = [rng.sample(codes, 2) for _ in range(lookups)]
+    page = paginate_rates(Rate.objects.filter(base_currency__code=codes[0], quote_currency__code=codes[1]), None, 1000)
+    export = list(iter_rate_rows(order_rates(Rate.objects.filter(base_currency__code=codes[0])), chunk_size=2000))
+    response, tickers = make_yfinance_frame(codes, timestamps)
+
+    def get_latest():
+        for base, quote in pairs:
+            Rate.get_latest(base_currency__code=base, quote_currency__code=quote)
+
+    def get_latest_by_codes():
+        for base, quote in pairs:
+            Rate.get_latest_by_codes(base, quote)
+
+    def serialize_page():
+        # same steps as ninja takes for the list_rate response: schema validation, dump, JSON encoding
+        return json.dumps(RatePageSchema.model_validate(page).model_dump(), cls=NinjaJSONEncoder)
+
+    def serialize_export():
+        return "".join(iter_csv(export))
+
+    return {
+        "Rate.get_latest": (get_latest, lookups),
+        "Rate.get_latest_by_codes": (get_latest_by_codes, lookups),
+        "list_rate page serialization": (serialize_page, len(page["items"])),
+        "CSV export serialization": (serialize_export, len(export)),
+        "normalize_yfinance_response": (lambda: normalize_yfinance_response(response, tickers), len(tickers)*timestamps),
+    }
+
+
+def get_api_benchmarks(codes, timestamps, requests):
+    """
+    Returns:
+        benchmarks (dict): in format of {name: (func, requests per call)}, every response is checked for status 200
+    """
+    from django.test import Client
+
+    client = Client()
+    rng = random.Random(1)
+    pairs = [rng.sample(codes, 2) for _ in range(requests)]
+    base, quote = codes[:2]
+    middle = date(1970, 1, 1) + timedelta(days=timestamps // 2) # populate_rates() starts on 1970-01-01
+    convert_body = json.dumps({"items": [{"amount": "10.5", "from": rng.choice(codes), "to": rng.choice(codes)}
+                                         for _ in range(1000)]})
+
+    def get(paths):
+        def func():
+            for path in paths:
+                response = client.get(path)
+                assert response.status_code == 200, (path, response.status_code)
+                if response.streaming:
+                    b"".join(response.streaming_content)
+        return func, len(paths)
+
+    def post_convert():
+        for _ in range(requests):
+            response = client.post("/api/currency/convert", convert_body, content_type="application/json")
+            assert response.status_code == 200, response.content[:200]
+
+    return {
+        "GET currencies": get(["/api/currency/"] * requests),
+        "GET latest rate": get([f"/api/currency/{base}/{quote}/" for base, quote in pairs]),
+        "GET rate as of instant": get([f"/api/currency/{base}/{quote}/?at={middle}T12:00:{index % 60:02}Z"
+                                       for index, (base, quote) in enumerate(pairs)]),
+        "GET rates page": get([f"/api/currency/rates/?base={base}&quote={quote}&limit=100"] * requests),
+        "GET rates weekly buckets": get([f"/api/currency/rates/?base={base}&quote={quote}&interval=1wk"] * requests),
+        "GET rates CSV export": get([f"/api/currency/rates/?base={base}&quote={quote}&format=csv"] * max(requests // 10, 1)),
+        "POST convert 1000 items": (post_convert, requests),
+    }
+
+
+def run_benchmarks(benchmarks, group, repeat):
+    results = {}
+    for name, (func, operations) in benchmarks.items():
+        func() # warm up (caches, connections, imports)
+        timings, _ = measure(func, repeat=repeat)
+        median = statistics.median(timings)
+        results[name] = {"group": group, "operations": operations, "timings": timings, "best": min(timings),
+                         "median": median, "operations_per_second": operations / median}
+        print(f"{group:<6}{name:<32} median {median*1000:10.2f} ms   {operations / median:14,.0f} ops/s")
+    return results
+
+
+def compare(results, baseline, max_regression=None):
+    """
+    Prints the change of median time of every benchmark present in both runs.
+    Returns:
+        regressions (list): names of benchmarks slower than baseline by more than max_regression (a ratio, i.e. 0.2)
+    """
+    if results["parameters"] != baseline["parameters"]:
+        print(f"\nWarning: parameters differ from the baseline ({baseline['parameters']}), timings are not comparable.")
+    print(f"\nCompared with {baseline['created']} (commit {baseline['environment'].get('commit')}):")
+    regressions = []
+    for name, result in results["benchmarks"].items():
+        if name not in baseline["benchmarks"]:
+            continue
+        before = baseline["benchmarks"][name]["median"]
+        change = result["median"] / before - 1
+        flag = ""
+        if (max_regression is not None) and (change > max_regression):
+            regressions.append(name)
+            flag = "   REGRESSION"
+        print(f"{name:<38} {before*1000:10.2f} ms -> {result['median']*1000:10.2f} ms   {change:+8.1%}{flag}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--currencies", type=int, default=10, help="Number of currencies (pairs = N*(N-1)).")
+    parser.add_argument("--timestamps", type=int, default=2000, help="Number of daily rates per pair.")
+    parser.add_argument("--lookups", type=int, default=500, help="Lookups per run of the Rate.get_latest benchmarks.")
+    parser.add_argument("--requests", type=int, default=200, help="Requests per run of the api benchmarks.")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--group", choices=["micro", "api"], default=None, help="Run only one group of benchmarks.")
+    parser.add_argument("--output", type=str, default=None, help="Write results to this JSON file.")
+    parser.add_argument("--compare", type=str, default=None, help="JSON results of a previous run to compare with.")
+    parser.add_argument("--max-regression", type=float, default=None,
+                        help="Exit with status 1 when a median is slower than in --compare by more than this ratio (i.e. 0.2).")
+    args = parser.parse_args()
+
+    setup_django()
+    from django.core.management import call_command
+    from django.db import connection
+    from django.test.utils import setup_test_environment
+
+    setup_test_environment()
+    codes = CURRENCY_CODES[:args.currencies]
+    pairs = len(list(permutations(codes, r=2)))
+    results = {
+        "created": datetime.now(timezone.utc).isoformat(),
+        "environment": get_environment(),
+        "parameters": {"currencies": args.currencies, "timestamps": args.timestamps, "lookups": args.lookups,
+                       "requests": args.requests, "repeat": args.repeat},
+        "benchmarks": {},
+    }
+    with benchmark_database():
+        populate_rates(connection, codes, pairs * args.timestamps)
+        call_command("rebuild_rollups", stdout=io.StringIO()) # raw inserts bypass rollups
+        print(f"{pairs} pairs x {args.timestamps} timestamps\n")
+        if args.group in (None, "micro"):
+            micro = get_micro_benchmarks(codes, args.timestamps, args.lookups)
+            results["benchmarks"].update(run_benchmarks(micro, "micro", args.repeat))
+        if args.group in (None, "api"):
+            api = get_api_benchmarks(codes, args.timestamps, args.requests)
+            results["benchmarks"].update(run_benchmarks(api, "api", args.repeat))
+
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(results, file, indent=2)
+        print(f"\nResults written to {args.output}")
+    if args.compare:
+        with open(args.compare) as file:
+            baseline = json.load(file)
+        if compare(results, baseline, args.max_regression):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
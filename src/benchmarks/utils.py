@@ -0,0 +1,53 @@
+"""
+Shared helpers for offline benchmarks.
+Run every benchmark from the "src" directory, i.e.: python -m benchmarks.bench_ingestion
+"""
+import os
+import statistics
+import time
+from contextlib import contextmanager
+
+import django
+
+
+def setup_django():
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", "djangohome.settings")
+    django.setup()
+
+
+@contextmanager
+def benchmark_database(name=None):
+    """
+    Creates a throw-away database (in memory unless a file name is passed) and destroys it afterwards.
+    """
+    from django.db import connection
+
+    if name:
+        connection.settings_dict["TEST"]["NAME"] = name
+    old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+    try:
+        yield connection
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+
+
+def measure(func, *args, repeat=5, **kwargs):
+    """
+    Calls func repeat times.
+    Returns:
+        timings (list): wall-clock time of each call in seconds
+        result: return value of the last call
+    """
+    timings = []
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func(*args, **kwargs)
+        timings.append(time.perf_counter() - start)
+    return timings, result
+
+
+def summarize(label, timings):
+    return (f"{label:<28} best {min(timings)*1000:10.2f} ms   "
+            f"median {statistics.median(timings)*1000:10.2f} ms   "
+            f"runs {len(timings)}")
@@ -1,35 +1,167 @@
 from django.contrib import admin
+from django.core.paginator import Paginator
+from django.db import connection, models
+from django.utils import timezone
+from django.utils.functional import cached_property
+
+from datetime import timedelta
 
 from .models import (
     Currency,
+    LatestRate,
     Rate,
+    RateRollup,
 )
 
-# Register your models here.
-class NoneValueFilter(admin.SimpleListFilter):
-    title = ('Exchange rates period')
-    parameter_name = 'time'
+# counting more rows than this for a filtered changelist is not worth it, the count is capped instead
+admin_count_limit = 10_000
+
+
+def get_estimated_row_count(table: str):
+    """Row count of a table from planner statistics (None if the database has none, i.e. SQLite before ANALYZE)."""
+    with connection.cursor() as cursor:
+        if connection.vendor == "postgresql":
+            # a partitioned table (see currencies.partitioning) has no statistics of its own, its partitions have
+            cursor.execute("SELECT CASE WHEN parent.relkind = 'p' THEN ("
+                           "    SELECT CASE WHEN MIN(child.reltuples) < 0 THEN -1 ELSE SUM(child.reltuples) END "
+                           "    FROM pg_inherits JOIN pg_class child ON child.oid = pg_inherits.inhrelid "
+                           "    WHERE pg_inherits.inhparent = parent.oid"
+                           ") ELSE parent.reltuples END::bigint FROM pg_class parent WHERE parent.relname = %s", [table])
+        elif connection.vendor == "sqlite":
+            cursor.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND name = 'sqlite_stat1'")
+            if cursor.fetchone() is None:
+                return None
+            cursor.execute("SELECT stat FROM sqlite_stat1 WHERE tbl = %s AND idx IS NULL", [table])
+        else:
+            return None
+        row = cursor.fetchone()
+    if (row is None) or (row[0] is None):
+        return None
+    count = int(str(row[0]).split()[0])
+    return count if count >= 0 else None # never analyzed PostgreSQL tables report -1
+
+
+class ApproximateCountPaginator(Paginator):
+    """
+    Paginator of large tables which never runs a full COUNT(*):
+    unfiltered lists use planner statistics, filtered ones count at most admin_count_limit rows.
+    """
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        if not queryset.query.where:
+            estimate = get_estimated_row_count(queryset.model._meta.db_table)
+            if estimate is not None:
+                return estimate
+        return queryset.order_by()[:admin_count_limit].count()
+
+
+class IndexedDatesQuerySet(models.QuerySet):
+    """
+    datetimes() (used by the admin date hierarchy) with an index seek per returned period instead of a full scan:
+    each next year/month/day is found as MIN(ts) after the end of the previous one.
+    """
+    def datetimes(self, field_name, kind, order="ASC", tzinfo=None):
+        tzinfo = tzinfo or timezone.get_current_timezone()
+        qs = self.order_by()
+        periods = []
+        start = qs.aggregate(first=models.Min(field_name))["first"]
+        while start is not None:
+            period = truncate_datetime(start.astimezone(tzinfo), kind)
+            periods.append(period)
+            start = qs.filter(**{f"{field_name}__gte": next_period(period, kind)}).aggregate(first=models.Min(field_name))["first"]
+        return periods if order == "ASC" else periods[::-1]
+
+
+def truncate_datetime(value, kind: str):
+    value = value.replace(hour=0, minute=0, second=0, microsecond=0)
+    if kind == "year":
+        return value.replace(month=1, day=1)
+    if kind == "month":
+        return value.replace(day=1)
+    return value
+
+
+def next_period(period, kind: str):
+    """Start of the period following a truncated one (aware, in the time zone of period)."""
+    if kind == "year":
+        following = period.replace(year=period.year + 1)
+    elif kind == "month":
+        following = (period.replace(tzinfo=None) + timedelta(days=32)).replace(day=1)
+    else:
+        following = period.replace(tzinfo=None) + timedelta(days=1)
+    return timezone.make_aware(following.replace(tzinfo=None), period.tzinfo)
+
+
+class CurrencyFilter(admin.SimpleListFilter):
+    """Currency filter with choices from Currency table (not DISTINCT over the joined rates), filters by indexed FK id."""
+    field_name = None
 
     def lookups(self, request, model_admin):
-        return (
-            ('daily', ('Day')),
-            ('hourly', ('Hour')),
-        )
+        return list(Currency.objects.order_by("code").values_list("id", "code"))
 
     def queryset(self, request, queryset):
-        value = self.value()
-        if value == 'daily':
-            return queryset.filter(time__isnull=True)  # daily values with null time
-        elif value == 'hourly':
-            return queryset.filter(time__isnull=False)  # hourly values without null time
-        return queryset  # unfiltered queryset by default
+        if self.value():
+            return queryset.filter(**{f"{self.field_name}_id": self.value()})
+        return queryset
+
+class BaseCurrencyFilter(CurrencyFilter):
+    title = "base currency"
+    parameter_name = "base_currency"
+    field_name = "base_currency"
+
+class QuoteCurrencyFilter(CurrencyFilter):
+    title = "quote currency"
+    parameter_name = "quote_currency"
+    field_name = "quote_currency"
+
+
+class LargeTableAdmin(admin.ModelAdmin):
+    """
+    Changelist of multi-million row tables with base_currency, quote_currency and ts fields:
+    joined currencies in the list query, approximate counts, exact code search on indexed ids
+    and date hierarchy (ts) choices found with index seeks.
+    """
+    list_select_related = ['base_currency', 'quote_currency']
+    list_filter = [BaseCurrencyFilter, QuoteCurrencyFilter]
+    search_fields = ['=base_currency__code'] # shows the search box, see get_search_results()
+    search_help_text = "Exact currency code (EUR) or pair (EURUSD)."
+    date_hierarchy = 'ts'
+    ordering = ['-ts']
+    paginator = ApproximateCountPaginator
+    show_full_result_count = False
+
+    def get_queryset(self, request):
+        qs = super().get_queryset(request)
+        return IndexedDatesQuerySet(model=qs.model, query=qs.query, using=qs.db)
+
+    def get_search_results(self, request, queryset, search_term):
+        term = search_term.strip().upper()
+        if not term:
+            return queryset, False
+        ids = dict(Currency.objects.filter(code__in=[term[:3], term[3:]]).values_list("code", "id"))
+        if (len(term) == 6) and (term[:3] in ids) and (term[3:] in ids):
+            return queryset.filter(base_currency_id=ids[term[:3]], quote_currency_id=ids[term[3:]]), False
+        if (len(term) == 3) and (term in ids):
+            return queryset.filter(models.Q(base_currency_id=ids[term]) | models.Q(quote_currency_id=ids[term])), False
+        return queryset.none(), False
+
+
+# Register your models here.
+class RateAdmin(LargeTableAdmin):
+    list_display = ['base_currency', 'quote_currency', 'exchange_rate', 'ts', 'granularity']
+    list_filter = [*LargeTableAdmin.list_filter, 'granularity']
+
+class LatestRateAdmin(admin.ModelAdmin):
+    list_display = ['pair', 'exchange_rate', 'ts', 'granularity']
+    search_fields = ['pair']
 
-class RateAdmin(admin.ModelAdmin):
-    list_display = ['base_currency', 'quote_currency', 'exchange_rate', 'date', 'time']
-    search_fields = ['base_currency__code']
-    list_filter = ['base_currency__code', 'quote_currency__code', NoneValueFilter]
-    ordering = ['-date', '-time']
+class RateRollupAdmin(LargeTableAdmin):
+    list_display = ['base_currency', 'quote_currency', 'interval', 'ts', 'open', 'high', 'low', 'close', 'count']
+    list_filter = ['interval', *LargeTableAdmin.list_filter]
 
 
 admin.site.register(Currency)
 admin.site.register(Rate, RateAdmin)
+admin.site.register(LatestRate, LatestRateAdmin)
+admin.site.register(RateRollup, RateRollupAdmin)
@@ -1,33 +1,93 @@
 from ninja import Router, Query, FilterSchema, Field
+from ninja.decorators import decorate_view
 from ninja.errors import HttpError
+from django.db.models import Q
+from django.http import HttpResponse
 
-from typing import List
+from datetime import date, datetime
+from itertools import chain
+from typing import List, Union
 
 from pydantic import model_validator
 
-from .models import Currency, Rate
-from .schemas import CurrencyListSchema, RateDetailSchema
+from . import cache
+from .archive import iter_archived_rows
+from .asof import get_cross_rate_as_of, to_instant
+from .conditional import conditional_get
+from .conversion import convert_amounts, parse_convert_items, serialize_results
+from .models import Currency, LatestRate, Rate, RateRollup
+from .pagination import (
+    decode_cursor,
+    default_page_size,
+    iter_rate_rows,
+    max_page_size,
+    merge_rows,
+    order_rates,
+    order_rows,
+    paginate_rates,
+    paginate_rows,
+)
+from .resampling import INTERVAL_RULES, resample_rates
+from .rollups import can_use_rollups, rollup_rows
+from .schemas import (
+    CacheStatsSchema,
+    ConvertResponseSchema,
+    CurrencyListSchema,
+    RateBucketListSchema,
+    RateDetailSchema,
+    RatePageSchema,
+    get_convert_openapi,
+)
+from .streaming import CONTENT_TYPES, export_chunk_size, stream_rates
+from .timestamps import get_ts_range_filters
+from .triangulation import get_cross_rate_series, get_latest_cross_rate
 
 router = Router()
 
 # /api/currency/
 @router.get("", response=List[CurrencyListSchema])
+@decorate_view(*conditional_get)
 def list_currencies(request):
-    qs = Currency.objects.all()
-    return qs
+    return cache.get_or_compute("currencies", lambda: list(Currency.objects.values("code")))
 
 # /api/currency/EUR/USD/
+# /api/currency/EUR/USD/?at=2024-01-02T15:30:00Z returns the rate in effect at that instant (UTC unless specified)
 @router.get("/{BASE}/{QUOTE}/", response=RateDetailSchema)
-def detail_rate(request, BASE:str, QUOTE:str):
-    obj = Rate.get_latest(base_currency__code=BASE.upper(),
-                          quote_currency__code=QUOTE.upper())
-    if obj:
-        return obj
+@decorate_view(*conditional_get)
+def detail_rate(request, BASE:str, QUOTE:str, at: datetime=None):
+    pair = f"{BASE.upper()}{QUOTE.upper()}"
+    data = None
+    if is_valid_pair(pair) and at: # only valid codes get to the cache & database
+        at = to_instant(at)
+        data = cache.get_or_compute(f"asof:{pair}:{at.isoformat()}", lambda: get_rate_data_as_of(pair, at))
+    elif is_valid_pair(pair):
+        data = cache.get_or_compute(f"latest:{pair}", lambda: get_latest_rate_data(pair))
+    if data:
+        return data
     raise HttpError(404, f"Exchange rate for currencies '{BASE}' and '{QUOTE}' not found.")
 
+def is_valid_pair(pair: str) -> bool:
+    return (len(pair) == 6) and pair.isalnum()
+
+def get_latest_rate_data(pair: str):
+    """Returns cacheable detail of the pair, stored or triangulated through the pivot (False when not found)."""
+    exchange_rate = get_latest_cross_rate(pair[:3], pair[3:])
+    if exchange_rate is not None:
+        return {"currency_pair": pair, "exchange_rate": exchange_rate}
+    return False
+
+def get_rate_data_as_of(pair: str, at: datetime):
+    """Same as get_latest_rate_data(), with the rate in effect at the instant."""
+    exchange_rate = get_cross_rate_as_of(pair[:3], pair[3:], at)
+    if exchange_rate is not None:
+        return {"currency_pair": pair, "exchange_rate": exchange_rate}
+    return False
+
 class RateFilter(FilterSchema):
     base: str = Field(None, q='base_currency__code')
     quote: str = Field(None, q='quote_currency__code')
+    start: date = None
+    end: date = None
 
     @model_validator(mode='before')
     def validate_and_preprocess(cls, values):
@@ -38,9 +98,89 @@ class RateFilter(FilterSchema):
         if quote: setattr(values, "quote", quote.upper())
         return values
 
-# /api/currency/rates?base=EUR&quote=USD
-@router.get("rates/", response=List[RateDetailSchema])
-def list_rate(request, filters: RateFilter=Query()):
+    # dates are ranges of the ts column (end inclusive)
+    def filter_start(self, value: date) -> Q:
+        return Q(**get_ts_range_filters(start=value))
+
+    def filter_end(self, value: date) -> Q:
+        return Q(**get_ts_range_filters(end=value))
+
+# /api/currency/rates?base=EUR&quote=USD&limit=100&cursor=...
+# /api/currency/rates?base=EUR&quote=USD&format=ndjson (or csv) streams every row
+# /api/currency/rates?base=EUR&quote=USD&start=2024-01-01&end=2024-12-31&interval=1wk returns OHLC buckets
+@router.get("rates/", response=Union[RatePageSchema, RateBucketListSchema])
+@decorate_view(*conditional_get)
+def list_rate(request, filters: RateFilter=Query(), cursor: str=None, limit: int=default_page_size, format: str=None,
+              interval: str=None):
+    after = validate_list_arguments(cursor, limit, format, interval)
     qs = Rate.objects.all()
     qs = filters.filter(qs)
-    return qs
+    if filters.base and filters.quote and not LatestRate.objects.filter(pk=f"{filters.base}{filters.quote}").exists():
+        # pair not stored directly, derive it from pivot legs
+        rows = get_cross_rate_series(filters.base, filters.quote, **get_date_filters(filters))
+        if interval:
+            return {"interval": interval, "buckets": resample_rates(rows, interval)}
+        if format:
+            return stream_rates(order_rows(rows, after), format)
+        return paginate_rows(rows, after, limit)
+    if interval and can_use_rollups(interval, filters.start, filters.end):
+        # whole buckets of stored pairs are precomputed
+        return {"interval": interval, "buckets": rollup_rows(filters.filter(RateRollup.objects.filter(interval=interval)))}
+    if interval:
+        validate_resampled_filters(filters)
+    # rates moved to the archive tier are merged back in (ordered by the same keyset)
+    archived = iter_archived_rows(after=after, **get_archive_filters(filters))
+    if interval:
+        rows = chain(archived, iter_rate_rows(qs, chunk_size=export_chunk_size))
+        return {"interval": interval, "buckets": resample_rates(rows, interval)}
+    if format:
+        return stream_rates(merge_rows(archived, iter_rate_rows(order_rates(qs, after), chunk_size=export_chunk_size)), format)
+    return paginate_rates(qs, after, limit, archived=archived)
+
+def validate_list_arguments(cursor: str, limit: int, format: str, interval: str):
+    """Raises HttpError 400 for invalid list_rate arguments, returns decoded cursor."""
+    if not (0 < limit <= max_page_size):
+        raise HttpError(400, f"Limit must be between 1 and {max_page_size}.")
+    if format and (format not in CONTENT_TYPES):
+        raise HttpError(400, f"Invalid format '{format}'. Valid formats are: {list(CONTENT_TYPES)}.")
+    if interval and (interval not in INTERVAL_RULES):
+        raise HttpError(400, f"Invalid interval '{interval}'. Valid intervals are: {list(INTERVAL_RULES)}.")
+    if interval and (format or cursor):
+        raise HttpError(400, "Interval can not be combined with format or cursor.")
+    try:
+        return decode_cursor(cursor) if cursor else None
+    except ValueError as error:
+        raise HttpError(400, str(error))
+
+def validate_resampled_filters(filters: RateFilter):
+    """
+    Raises HttpError 400 unless a single pair is filtered. Raw rates are resampled in memory,
+    unfiltered ones would load the whole table (whole buckets of every pair are read from rollups instead).
+    """
+    if not (filters.base and filters.quote):
+        raise HttpError(400, "Interval without base and quote is available only for whole 1d, 1wk and 1mo buckets "
+                             "(start and end at bucket bounds).")
+
+def get_date_filters(filters: RateFilter) -> dict:
+    """Rate.objects.filter() arguments of the filters date range."""
+    return get_ts_range_filters(filters.start, filters.end)
+
+def get_archive_filters(filters: RateFilter) -> dict:
+    """archive.iter_archived_rows() arguments of the filters."""
+    return {"base": filters.base, "quote": filters.quote, **get_date_filters(filters)}
+
+# /api/currency/convert
+# body: {"items": [{"amount": "10.50", "from": "EUR", "to": "PLN", "date": "2024-01-02"}, ...]} (date is optional)
+# the body is parsed by hand (see conversion.parse_convert_items), the schemas only document it
+@router.post("convert", response=ConvertResponseSchema, openapi_extra=get_convert_openapi())
+def convert(request):
+    try:
+        items = parse_convert_items(request.body)
+    except ValueError as error:
+        raise HttpError(400, str(error))
+    return HttpResponse(serialize_results(convert_amounts(items)), content_type="application/json")
+
+# /api/currency/cache/
+@router.get("cache/", response=CacheStatsSchema)
+def cache_stats(request):
+    return cache.get_stats()
@@ -0,0 +1,153 @@
+"""
+Async versions of currencies.api endpoints (same paths, parameters and responses), using Django's async ORM.
+Mounted instead of the sync router when settings.CURRENCY_API_ASYNC is on, meant to be served by an ASGI server.
+"""
+from ninja import Router, Query
+from ninja.decorators import decorate_view
+from ninja.errors import HttpError
+
+from asgiref.sync import sync_to_async
+from django.http import HttpResponse
+from datetime import datetime
+from typing import List, Union
+
+from . import cache
+from .api import (
+    RateFilter,
+    get_archive_filters,
+    get_date_filters,
+    get_rate_data_as_of,
+    is_valid_pair,
+    validate_list_arguments,
+    validate_resampled_filters,
+)
+from .archive import has_archive, iter_archived_rows
+from .asof import to_instant
+from .broadcast import get_broadcaster, rate_message
+from .conditional import conditional_get
+from .conversion import convert_amounts, parse_convert_items, serialize_results
+from .models import Currency, LatestRate, Rate, RateRollup
+from .pagination import (
+    aiter_rate_rows,
+    aiterate,
+    amerge_rows,
+    apaginate_rates,
+    default_page_size,
+    order_rates,
+    order_rows,
+    paginate_rows,
+)
+from .resampling import resample_rates
+from .rollups import can_use_rollups, rollup_rows
+from .schemas import (
+    CacheStatsSchema,
+    ConvertResponseSchema,
+    CurrencyListSchema,
+    RateBucketListSchema,
+    RateDetailSchema,
+    RatePageSchema,
+    get_convert_openapi,
+)
+from .streaming import export_chunk_size, stream_events, stream_rates
+from .triangulation import aget_latest_cross_rate, get_cross_rate_series
+
+router = Router()
+max_stream_pairs = 50
+
+# /api/currency/
+@router.get("", response=List[CurrencyListSchema])
+@decorate_view(*conditional_get)
+async def list_currencies(request):
+    async def compute():
+        return [row async for row in Currency.objects.values("code")]
+    return await cache.aget_or_compute("currencies", compute)
+
+# /api/currency/EUR/USD/
+@router.get("/{BASE}/{QUOTE}/", response=RateDetailSchema)
+@decorate_view(*conditional_get)
+async def detail_rate(request, BASE:str, QUOTE:str, at: datetime=None):
+    pair = f"{BASE.upper()}{QUOTE.upper()}"
+    data = None
+    if is_valid_pair(pair) and at: # only valid codes get to the cache & database
+        at = to_instant(at)
+        # a few indexed queries, not worth splitting into async ones
+        data = await cache.aget_or_compute(f"asof:{pair}:{at.isoformat()}",
+                                           lambda: sync_to_async(get_rate_data_as_of)(pair, at))
+    elif is_valid_pair(pair):
+        data = await cache.aget_or_compute(f"latest:{pair}", lambda: aget_latest_rate_data(pair))
+    if data:
+        return data
+    raise HttpError(404, f"Exchange rate for currencies '{BASE}' and '{QUOTE}' not found.")
+
+async def aget_latest_rate_data(pair: str):
+    """Async version of api.get_latest_rate_data()."""
+    exchange_rate = await aget_latest_cross_rate(pair[:3], pair[3:])
+    if exchange_rate is not None:
+        return {"currency_pair": pair, "exchange_rate": exchange_rate}
+    return False
+
+# /api/currency/rates?base=EUR&quote=USD&limit=100&cursor=...
+@router.get("rates/", response=Union[RatePageSchema, RateBucketListSchema])
+@decorate_view(*conditional_get)
+async def list_rate(request, filters: RateFilter=Query(), cursor: str=None, limit: int=default_page_size, format: str=None,
+                    interval: str=None):
+    after = validate_list_arguments(cursor, limit, format, interval)
+    qs = Rate.objects.all()
+    qs = filters.filter(qs)
+    if filters.base and filters.quote and not await LatestRate.objects.filter(pk=f"{filters.base}{filters.quote}").aexists():
+        # pair not stored directly, derive it from pivot legs (pandas work, runs in a thread)
+        rows = await sync_to_async(get_cross_rate_series)(filters.base, filters.quote, **get_date_filters(filters))
+        if interval:
+            return {"interval": interval, "buckets": resample_rates(rows, interval)}
+        if format:
+            return stream_rates(order_rows(rows, after), format)
+        return paginate_rows(rows, after, limit)
+    if interval and can_use_rollups(interval, filters.start, filters.end):
+        rows = await sync_to_async(rollup_rows)(filters.filter(RateRollup.objects.filter(interval=interval)))
+        return {"interval": interval, "buckets": rows}
+    if interval:
+        validate_resampled_filters(filters)
+    # archive files are read in a thread, chunk by chunk (see api.list_rate)
+    archived = None
+    if has_archive():
+        archived = aiterate(iter_archived_rows(after=after, **get_archive_filters(filters)), export_chunk_size)
+    if interval:
+        rows = [row async for row in aiter_rate_rows(qs, chunk_size=export_chunk_size)]
+        if archived is not None:
+            rows.extend([row async for row in archived])
+        return {"interval": interval, "buckets": resample_rates(rows, interval)}
+    if format:
+        rows = aiter_rate_rows(order_rates(qs, after), chunk_size=export_chunk_size)
+        return stream_rates(rows if archived is None else amerge_rows(archived, rows), format)
+    return await apaginate_rates(qs, after, limit, archived=archived)
+
+# /api/currency/stream/?pairs=EURUSD,USDPLN
+# Server-Sent Events: latest rates of the pairs right away, then each new one (stored pairs only, not triangulated)
+@router.get("stream/")
+async def stream_latest_rates(request, pairs: str):
+    selected = sorted({pair.strip().upper() for pair in pairs.split(",")})
+    if not all(is_valid_pair(pair) for pair in selected):
+        raise HttpError(400, "Pairs have to be 6 letter codes separated by comas, i.e. EURUSD,USDPLN.")
+    if len(selected) > max_stream_pairs:
+        raise HttpError(400, f"At most {max_stream_pairs} pairs can be subscribed at once.")
+    broadcaster = get_broadcaster()
+    # subscribed before reading the snapshot, rates stored in between are pushed too
+    subscription = broadcaster.subscribe(selected)
+    snapshot = [rate_message(obj) async for obj in LatestRate.objects.filter(pair__in=selected, ts__isnull=False)]
+    return stream_events(broadcaster, subscription, snapshot)
+
+# /api/currency/convert
+@router.post("convert", response=ConvertResponseSchema, openapi_extra=get_convert_openapi())
+async def convert(request):
+    try:
+        items = parse_convert_items(request.body)
+    except ValueError as error:
+        raise HttpError(400, str(error))
+    # two set-based queries and CPU work, not worth splitting into async queries
+    results = await sync_to_async(convert_amounts)(items)
+    return HttpResponse(serialize_results(results), content_type="application/json")
+
+# /api/currency/cache/
+@router.get("cache/", response=CacheStatsSchema)
+async def cache_stats(request):
+    return cache.get_stats()
@@ -1,6 +1,13 @@
 from django.apps import AppConfig
+from django.conf import settings
 
 
 class CurrenciesConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "currencies"
+
+    def ready(self):
+        if getattr(settings, "CURRENCY_METRICS", False):
+            # before any connection is opened, every one of them gets the query recorder (see currencies.metrics)
+            from .metrics import enable_query_recording
+            enable_query_recording()
@@ -0,0 +1,257 @@
+"""
+Archive tier of historical rates: Parquet files per pair and year (i.e.: <CURRENCY_ARCHIVE_DIR>/EURUSD/2023.parquet),
+written by the archive_rates command and read through memory mapping.
+Archived rates keep their ids, so together with live rates they still form a single (ts, id) ordered history.
+The newest rate of every pair always stays in the database (it backs LatestRate), and rates at or before the archive
+boundary of a pair (manifest.json) are not ingested again.
+Needs pyarrow (optional dependency), without an archive directory nothing is read and pyarrow is never imported.
+"""
+import heapq
+import json
+import os
+
+from datetime import date, datetime, timezone
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from django.conf import settings
+from django.db import transaction
+
+from .fields import RATE_SCALE, scaled
+from .models import Currency, Rate
+from .pagination import keyset_key
+from .timestamps import Granularity, to_timestamp
+
+# exchange_rate is the scaled integer of FixedPointField
+ARCHIVE_COLUMNS = ["id", "ts", "granularity", "exchange_rate"]
+MANIFEST_NAME = "manifest.json"
+archive_batch_size = 10_000
+archive_row_group_size = 100_000
+
+
+class ArchiveError(Exception):
+    """Archive can't be read or written (i.e.: pyarrow is not installed)."""
+
+
+def import_pyarrow():
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise ArchiveError("Rate archive requires pyarrow, install it with: pip install pyarrow")
+    return pa, pq
+
+
+def get_archive_root() -> Path:
+    return Path(settings.CURRENCY_ARCHIVE_DIR)
+
+
+def has_archive(root: Optional[Path] = None) -> bool:
+    return (root or get_archive_root()).is_dir()
+
+
+def get_boundaries(root: Optional[Path] = None) -> Dict[str, datetime]:
+    """Archive boundary of every archived pair: its rates up to this ts (inclusive) are only kept in the archive."""
+    path = (root or get_archive_root()) / MANIFEST_NAME
+    if not path.exists():
+        return {}
+    return {pair: datetime.fromisoformat(ts) for pair, ts in json.loads(path.read_text()).items()}
+
+
+def save_boundaries(boundaries: Dict[str, datetime], root: Path):
+    path = root / MANIFEST_NAME
+    temporary = path.with_name(f"{MANIFEST_NAME}.tmp")
+    temporary.write_text(json.dumps({pair: ts.isoformat() for pair, ts in sorted(boundaries.items())}, indent=2))
+    os.replace(temporary, path)
+
+
+def get_archive_files(root: Path, base: Optional[str] = None, quote: Optional[str] = None,
+                      ts__gte: Optional[datetime] = None, ts__lt: Optional[datetime] = None) -> List[Tuple[str, Path]]:
+    """Returns (pair, path) of archive files of matching pairs whose year overlaps [ts__gte, ts__lt)."""
+    if not root.is_dir():
+        return []
+    files = []
+    for pair_dir in sorted(root.iterdir()):
+        pair = pair_dir.name
+        if (not pair_dir.is_dir()) or (base and pair[:3] != base) or (quote and pair[3:] != quote):
+            continue
+        for path in sorted(pair_dir.glob("*.parquet")):
+            year_start = datetime(int(path.stem), 1, 1, tzinfo=timezone.utc)
+            if (ts__lt is not None) and (year_start >= ts__lt):
+                continue
+            if (ts__gte is not None) and (year_start.replace(year=year_start.year+1) <= ts__gte):
+                continue
+            files.append((pair, path))
+    return files
+
+
+def iter_file_frames(path: Path, ts__gte: Optional[datetime] = None,
+                     ts__lt: Optional[datetime] = None) -> Iterator[pd.DataFrame]:
+    """Yields rows of an archive file within [ts__gte, ts__lt) in (ts, id) order, batch by batch."""
+    _, pq = import_pyarrow()
+    parquet = pq.ParquetFile(path, memory_map=True)
+    for batch in parquet.iter_batches(batch_size=archive_batch_size, columns=ARCHIVE_COLUMNS):
+        frame = batch.to_pandas()
+        mask = np.ones(len(frame), dtype=bool)
+        if ts__gte is not None:
+            mask &= (frame["ts"] >= ts__gte).to_numpy()
+        if ts__lt is not None:
+            mask &= (frame["ts"] < ts__lt).to_numpy()
+        if mask.any():
+            yield frame[mask]
+
+
+def read_archive_frame(pairs: Iterable[str], ts__gte: Optional[datetime] = None,
+                       ts__lt: Optional[datetime] = None) -> pd.DataFrame:
+    """
+    Reads archived rates of the passed pairs at once (i.e.: pivot legs of a triangulated history).
+    Returns:
+        frame (pd.DataFrame): with columns ["pair", *ARCHIVE_COLUMNS], exchange_rate as scaled integer
+    """
+    pairs = set(pairs)
+    frames = [frame.assign(pair=pair)
+              for pair, path in get_archive_files(get_archive_root(), ts__gte=ts__gte, ts__lt=ts__lt) if pair in pairs
+              for frame in iter_file_frames(path, ts__gte, ts__lt)]
+    if not frames:
+        return pd.DataFrame(columns=["pair", *ARCHIVE_COLUMNS])
+    return pd.concat(frames, ignore_index=True)[["pair", *ARCHIVE_COLUMNS]]
+
+
+def iter_file_rows(pair: str, path: Path, after: Optional[Tuple], ts__gte: Optional[datetime],
+                   ts__lt: Optional[datetime]) -> Iterator[dict]:
+    for frame in iter_file_frames(path, ts__gte, ts__lt):
+        if (after is not None) and (after[0] is not None):
+            after_ts, after_id = after
+            frame = frame[((frame["ts"] > after_ts) | ((frame["ts"] == after_ts) & (frame["id"] > after_id))).to_numpy()]
+        # whole columns are converted at once, python datetimes are far cheaper per row than pd.Timestamp
+        timestamps = pd.DatetimeIndex(frame["ts"]).to_pydatetime().tolist()
+        rates = (frame["exchange_rate"].to_numpy(dtype="float64") / RATE_SCALE).tolist()
+        for _id_, ts, granularity, _exchange_rate_ in zip(frame["id"].tolist(), timestamps,
+                                                          frame["granularity"].tolist(), rates):
+            yield {"id": _id_,
+                   "currency_pair": pair,
+                   "ts": ts,
+                   "date": ts.date(),
+                   "time": None if granularity == Granularity.DAILY else ts.time(),
+                   "exchange_rate": _exchange_rate_}
+
+
+def iter_archived_rows(base: Optional[str] = None, quote: Optional[str] = None, after: Optional[Tuple] = None,
+                       ts__gte: Optional[datetime] = None, ts__lt: Optional[datetime] = None) -> Iterator[dict]:
+    """
+    Yields archived rates in format of pagination.iter_rate_rows(), ordered by (ts, id) across every matching file.
+    Files are opened lazily, nothing is read before the first row is requested.
+    Parameters:
+        base, quote (str): (optional) currency codes of pairs
+        after (tuple): (optional) decoded cursor, only rows ordered after it are yielded
+        ts__gte, ts__lt: (optional) ts range, see timestamps.get_ts_range_filters()
+    """
+    if (after is not None) and (after[0] is not None):
+        ts__gte = max(ts__gte, after[0]) if ts__gte else after[0]
+    files = get_archive_files(get_archive_root(), base, quote, ts__gte, ts__lt)
+    yield from heapq.merge(*(iter_file_rows(pair, path, after, ts__gte, ts__lt) for pair, path in files), key=keyset_key)
+
+
+def write_archive(pair: str, frame: pd.DataFrame, root: Path) -> None:
+    """
+    Adds rows (ARCHIVE_COLUMNS, ts as UTC datetimes) to the yearly files of the pair, each file is rewritten sorted
+    by (ts, id) and replaced atomically. A rate archived again (same granularity and ts) replaces the older copy.
+    """
+    pa, pq = import_pyarrow()
+    schema = pa.schema([("id", pa.int64()),
+                        ("ts", pa.timestamp("us", tz="UTC")),
+                        ("granularity", pa.dictionary(pa.int8(), pa.string())),
+                        ("exchange_rate", pa.int64())])
+    for year, rows in frame.groupby(frame["ts"].dt.year):
+        path = root / pair / f"{year}.parquet"
+        path.parent.mkdir(parents=True, exist_ok=True)
+        if path.exists():
+            stored = pq.read_table(path, memory_map=True).to_pandas()
+            stored["granularity"] = stored["granularity"].astype(str)
+            rows = pd.concat([stored, rows], ignore_index=True)
+        rows = rows.drop_duplicates(["granularity", "ts"], keep="last").sort_values(["ts", "id"])
+        table = pa.Table.from_pandas(rows[ARCHIVE_COLUMNS], schema=schema, preserve_index=False)
+        temporary = path.with_name(f"{path.name}.tmp")
+        pq.write_table(table, temporary, row_group_size=archive_row_group_size, compression="zstd")
+        os.replace(temporary, path)
+
+
+def get_stored_pairs(pairs: Optional[str] = None) -> List[Tuple[int, int, str]]:
+    """
+    Returns (base_currency_id, quote_currency_id, pair) of passed pairs (i.e. "EURUSD,USDPLN", --pairs argument
+    of archive_rates and rebuild_rollups), every pair stored in Rate table by default.
+    Pairs with every rate archived still have their newest rate in Rate table. Raises ValueError for an unknown pair.
+    """
+    ids = dict(Currency.objects.values_list("code", "id"))
+    if pairs:
+        selected = []
+        for pair in pairs.upper().split(","):
+            if (pair[:3] not in ids) or (pair[3:] not in ids):
+                raise ValueError(f"Unknown currency pair '{pair}'.")
+            selected.append((ids[pair[:3]], ids[pair[3:]], pair))
+        return selected
+    codes = {currency_id: code for code, currency_id in ids.items()}
+    stored = (Rate.objects.filter(ts__isnull=False).values_list("base_currency_id", "quote_currency_id")
+              .distinct().order_by("base_currency_id", "quote_currency_id"))
+    return [(base_id, quote_id, f"{codes[base_id]}{codes[quote_id]}") for base_id, quote_id in stored]
+
+
+def get_archivable_rates(base_id: int, quote_id: int, before: datetime):
+    """Rates of a pair older than `before` without the newest rate of the pair (it always stays in the database)."""
+    latest = Rate.get_latest(base_currency_id=base_id, quote_currency_id=quote_id)
+    if (latest is None) or (latest.ts is None):
+        return Rate.objects.none()
+    return Rate.objects.filter(base_currency_id=base_id, quote_currency_id=quote_id, ts__lt=min(before, latest.ts))
+
+
+def archive_pair_rates(base_id: int, quote_id: int, pair: str, before: datetime, root: Optional[Path] = None) -> int:
+    """
+    Moves rates of a pair older than `before` to the archive, year by year. The newest rate of the pair is never moved.
+    Each year is written to its file first and deleted from the database afterwards, in its own transaction.
+    Returns:
+        archived (int): number of moved rates
+    """
+    root = root or get_archive_root()
+    qs = get_archivable_rates(base_id, quote_id, before)
+    first = qs.order_by("ts").values_list("ts", flat=True).first()
+    if first is None:
+        return 0
+    archived = 0
+    last = qs.order_by("-ts").values_list("ts", flat=True).first()
+    for year in range(first.year, last.year + 1):
+        year_qs = qs.filter(ts__gte=to_timestamp(date(year, 1, 1)), ts__lt=to_timestamp(date(year + 1, 1, 1)))
+        with transaction.atomic():
+            rows = list(year_qs.order_by("ts", "id").values_list("id", "ts", "granularity", scaled("exchange_rate")))
+            if not rows:
+                continue
+            frame = pd.DataFrame.from_records(rows, columns=ARCHIVE_COLUMNS)
+            frame["ts"] = pd.to_datetime(frame["ts"], utc=True)
+            write_archive(pair, frame, root)
+            # rows inserted meanwhile have higher ids and stay in the database, moved rows are still read by the API
+            # and rollups, and the newest rate of the pair stays, so LatestRate and rollups need no refresh
+            year_qs.filter(id__lte=int(frame["id"].max())).delete(refresh=False)
+            boundaries = get_boundaries(root)
+            newest = frame["ts"].max().to_pydatetime()
+            boundaries[pair] = max(boundaries.get(pair, newest), newest)
+            save_boundaries(boundaries, root)
+        archived += len(frame)
+    return archived
+
+
+def drop_archived_rows(frame: pd.DataFrame, boundaries: Dict[str, datetime]) -> pd.DataFrame:
+    """Drops rows of a normalized batch at or before the archive boundary of their pair (archived history is final)."""
+    if (not boundaries) or frame.empty:
+        return frame
+    limits = pd.to_datetime((frame["base"] + frame["quote"]).map(boundaries), utc=True)
+    if limits.isna().all():
+        return frame
+    timestamps = pd.to_datetime(frame["date"], utc=True) # midnight, time of day (None for daily rows) is added on whole columns
+    if frame["time"].notna().any():
+        # a batch repeats a few distinct times of day (across tickers and days), only those are parsed
+        codes, times = pd.factorize(frame["time"])
+        offsets = pd.to_timedelta(pd.Index(times).astype(str)).to_numpy()
+        timestamps = timestamps + np.where(codes >= 0, offsets[codes], np.timedelta64(0, "ns"))
+    return frame[~(timestamps <= limits)] # NaT limits (pairs never archived) compare False
@@ -0,0 +1,142 @@
+"""
+Point-in-time ("as of") lookups: the rate in effect at a past instant is the last one at or before it,
+at most lookback_days older (weekends, holidays). A date stands for its end, the last rate of that day.
+Single lookups seek rate_pair_latest_idx (ORDER BY ts DESC LIMIT 1 per pair), batches load the series
+of each pair once and resolve every instant of it with numpy.searchsorted().
+"""
+from datetime import date, datetime, timedelta, timezone
+from decimal import Decimal
+from typing import Dict, Iterable, List, Optional, Tuple, Union
+
+import numpy as np
+import pandas as pd
+
+from .archive import has_archive, read_archive_frame
+from .fields import from_scaled, scaled
+from .models import Currency, Rate
+from .timestamps import to_timestamp
+from .triangulation import get_leg_pairs, get_leg_value, get_pivot_code
+
+lookback_days = 7
+
+Point = Union[date, datetime]
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+
+def to_instant(at: datetime) -> datetime:
+    """Aware UTC datetime of at, naive ones are UTC already."""
+    return at.replace(tzinfo=timezone.utc) if at.tzinfo is None else at.astimezone(timezone.utc)
+
+
+def get_as_of_bounds(point: Point) -> Tuple[datetime, datetime]:
+    """[first, end) ts range of rates which can be in effect at point (a datetime, or a date meaning its end)."""
+    if isinstance(point, datetime):
+        at = to_instant(point)
+        return (at - timedelta(days=lookback_days), at + timedelta(microseconds=1))
+    return (to_timestamp(point - timedelta(days=lookback_days)), to_timestamp(point + timedelta(days=1)))
+
+
+def get_stored_rate_as_of(base_id: int, quote_id: int, pair: str, point: Point) -> Optional[Decimal]:
+    """Rate of a stored pair in effect at point, archived rates included (None if there is none)."""
+    first, end = get_as_of_bounds(point)
+    latest = (Rate.objects.filter(base_currency_id=base_id, quote_currency_id=quote_id, ts__lt=end)
+              .order_by("-ts").values_list("ts", "exchange_rate").first())
+    if latest is not None:
+        return latest[1] if latest[0] >= first else None
+    if has_archive():
+        # archived rates are older than stored ones
+        archived = read_archive_frame([pair], ts__gte=first, ts__lt=end)
+        if len(archived):
+            return from_scaled(archived.sort_values("ts", kind="stable")["exchange_rate"].tolist()[-1])
+    return None
+
+
+def get_cross_rate_as_of(base: str, quote: str, point: Point) -> Optional[Decimal]:
+    """
+    Rate of base/quote in effect at point, stored directly or triangulated through the pivot with legs
+    as of the same point (None if impossible). Needs a query per looked up pair, at most five.
+    """
+    if base == quote:
+        return Decimal(1) if Currency.objects.filter(code=base).exists() else None
+    pivot = get_pivot_code()
+    ids = dict(Currency.objects.filter(code__in=[base, quote, pivot]).values_list("code", "id"))
+
+    def lookup(pair: str) -> Optional[Decimal]:
+        if (pair[:3] not in ids) or (pair[3:] not in ids):
+            return None
+        return get_stored_rate_as_of(ids[pair[:3]], ids[pair[3:]], pair, point)
+
+    exchange_rate = lookup(f"{base}{quote}")
+    if exchange_rate is not None:
+        return exchange_rate
+    values = []
+    for code in (base, quote):
+        rates = {}
+        if code != pivot:
+            for pair in get_leg_pairs(code, pivot):
+                exchange_rate = lookup(pair)
+                if exchange_rate is not None: # direct leg first, the inverse one only without it
+                    rates[pair] = exchange_rate
+                    break
+        values.append(get_leg_value(code, pivot, rates))
+    base_value, quote_value = values
+    if (base_value is None) or (not quote_value):
+        return None
+    return base_value / quote_value
+
+
+def load_history(pairs: Iterable[str], first: datetime, end: datetime) -> Dict[str, Tuple[np.ndarray, np.ndarray]]:
+    """
+    Stored and archived rates of pairs within [first, end) with a single Rate query.
+    Returns:
+        history (dict): pair to (timestamps, rates), int64 UTC nanoseconds ascending and scaled int64 rates
+    """
+    pairs = set(pairs)
+    codes = {pair[:3] for pair in pairs} | {pair[3:] for pair in pairs}
+    # codes__in on both sides is a superset of the pairs, cheaper than OR-ing every pair
+    rows = (Rate.objects.filter(base_currency__code__in=codes, quote_currency__code__in=codes, ts__gte=first, ts__lt=end)
+            .values_list("base_currency__code", "quote_currency__code", "ts", scaled("exchange_rate")))
+    frame = pd.DataFrame.from_records(list(rows), columns=["base", "quote", "ts", "exchange_rate"])
+    frame = pd.DataFrame({"pair": frame["base"] + frame["quote"],
+                          "ts": pd.to_datetime(frame["ts"], utc=True),
+                          "exchange_rate": frame["exchange_rate"]})
+    if has_archive():
+        archived = read_archive_frame(pairs, ts__gte=first, ts__lt=end)[["pair", "ts", "exchange_rate"]]
+        frame = pd.concat([archived.assign(ts=pd.to_datetime(archived["ts"], utc=True)), frame], ignore_index=True)
+    frame = frame[frame["pair"].isin(pairs)].sort_values(["pair", "ts"], kind="stable")
+    timestamps = pd.DatetimeIndex(frame["ts"]).as_unit("ns").asi8
+    rates = frame["exchange_rate"].to_numpy(dtype="int64")
+    starts = np.flatnonzero(np.r_[True, frame["pair"].to_numpy()[1:] != frame["pair"].to_numpy()[:-1]]) if len(frame) else []
+    ends = [*starts[1:], len(frame)]
+    names = frame["pair"].tolist()
+    return {names[start]: (timestamps[start:end], rates[start:end]) for start, end in zip(starts, ends)}
+
+
+def to_nanoseconds(ts: datetime) -> int:
+    return (ts - EPOCH) // timedelta(microseconds=1) * 1000
+
+
+def from_nanoseconds(value: int) -> datetime:
+    return EPOCH + timedelta(microseconds=int(value) // 1000)
+
+
+def get_bounds_array(points: List[Point]) -> np.ndarray:
+    """get_as_of_bounds() of every point as an array of shape (len(points), 2), int64 UTC nanoseconds."""
+    day = 86400 * 10**9
+    dated = np.array([not isinstance(point, datetime) for point in points], dtype=bool)
+    starts = np.array([to_nanoseconds(to_timestamp(point) if is_date else to_instant(point))
+                       for point, is_date in zip(points, dated.tolist())], dtype="int64")
+    ends = np.where(dated, starts + day, starts + 1000)
+    return np.stack([starts - lookback_days * day, ends], axis=1).reshape(-1, 2)
+
+
+def search_as_of(timestamps: np.ndarray, bounds: np.ndarray) -> np.ndarray:
+    """
+    Positions of rates in effect at points of get_bounds_array() within one pair series (see load_history()),
+    vectorized. Position is -1 for points without a rate.
+    """
+    # last rate before the end of each point
+    indices = np.searchsorted(timestamps, bounds[:, 1], side="left") - 1
+    valid = indices >= 0
+    valid[valid] = timestamps[indices[valid]] >= bounds[valid, 0]
+    return np.where(valid, indices, -1)
@@ -0,0 +1,152 @@
+"""
+Push of latest rate changes to subscribed clients (Server-Sent Events endpoint of currencies.api_async).
+LatestRate.refresh() publishes pairs whose latest rate changed once the transaction commits,
+every connection subscribed to one of them gets the new rate from its queue.
+The backend is chosen by settings.CURRENCY_BROADCAST_BACKEND:
+    LocalBroadcaster: within the process only, rates stored by other processes (i.e. fetch_data) are not pushed
+    CacheBroadcaster: through the cache (settings.CACHES), shared by every process and node with Redis, Memcached
+                      or database backends. Each serving process polls it once per poll_interval, not per client.
+"""
+import asyncio
+import threading
+import time
+
+from collections import defaultdict
+from functools import lru_cache
+from typing import Iterable, List, Optional
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+from .cache import get_cache, is_in_process
+
+PUSHED_KEY = "currencies:pushed:" # + pair, the last published message
+PUSHED_VERSION_KEY = "currencies:pushed:version"
+subscriber_queue_size = 100
+
+
+def rate_message(obj) -> dict:
+    """Pushed message of a LatestRate (same fields as rates list items)."""
+    return {"currency_pair": obj.pair,
+            "exchange_rate": float(obj.exchange_rate),
+            "date": obj.date.isoformat(),
+            "time": obj.time.isoformat() if obj.time else None}
+
+
+class Subscription:
+    """Messages of subscribed pairs for a single connection, created within its event loop."""
+    def __init__(self, pairs: Iterable[str]):
+        self.pairs = frozenset(pairs)
+        self.loop = asyncio.get_running_loop()
+        self.queue = asyncio.Queue(maxsize=subscriber_queue_size)
+
+    def deliver(self, message: dict):
+        """Thread-safe, called by publishing code of any thread."""
+        self.loop.call_soon_threadsafe(self._put, message)
+
+    def _put(self, message: dict):
+        if self.queue.full(): # slow client, older rates are not worth keeping
+            self.queue.get_nowait()
+        self.queue.put_nowait(message)
+
+    async def get(self, timeout: float) -> Optional[dict]:
+        """Next message, None after timeout seconds without one."""
+        try:
+            return await asyncio.wait_for(self.queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+
+class LocalBroadcaster:
+    """Delivers published messages to subscriptions of this process."""
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.subscriptions = defaultdict(set) # pair: {Subscription, ...}
+
+    def subscribe(self, pairs: Iterable[str]) -> Subscription:
+        subscription = Subscription(pairs)
+        with self.lock:
+            for pair in subscription.pairs:
+                self.subscriptions[pair].add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription):
+        with self.lock:
+            for pair in subscription.pairs:
+                self.subscriptions[pair].discard(subscription)
+                if not self.subscriptions[pair]:
+                    del self.subscriptions[pair]
+
+    def get_subscribed_pairs(self) -> List[str]:
+        with self.lock:
+            return list(self.subscriptions)
+
+    def publish(self, messages: List[dict]):
+        self.deliver(messages)
+
+    def deliver(self, messages: List[dict]):
+        with self.lock:
+            targets = [(subscription, message) for message in messages
+                       for subscription in self.subscriptions.get(message["currency_pair"], ())]
+        for subscription, message in targets:
+            subscription.deliver(message)
+
+
+class CacheBroadcaster(LocalBroadcaster):
+    """
+    Publishes the last message of each pair to the cache, a poller task of every serving process delivers
+    messages that changed since its previous poll. Only the latest rate of a pair is kept, a client can miss
+    rates published within one poll_interval, never the newest one.
+    """
+    def __init__(self, poll_interval: float = 1.0):
+        super().__init__()
+        self.poll_interval = poll_interval
+        self.poller = None
+        self.poller_loop = None
+
+    def subscribe(self, pairs: Iterable[str]) -> Subscription:
+        subscription = super().subscribe(pairs)
+        loop = asyncio.get_running_loop()
+        if (self.poller is None) or self.poller.done() or (self.poller_loop is not loop):
+            self.poller_loop = loop
+            self.poller = loop.create_task(self.poll())
+        return subscription
+
+    def publish(self, messages: List[dict]):
+        cache = get_cache()
+        cache.set_many({f"{PUSHED_KEY}{message['currency_pair']}": message for message in messages}, timeout=None)
+        # bumped after the messages are stored, a poller seeing the new version finds them
+        try:
+            cache.incr(PUSHED_VERSION_KEY)
+        except ValueError: # missing key
+            cache.set(PUSHED_VERSION_KEY, time.time_ns(), timeout=None)
+
+    async def poll(self):
+        """Runs while this process has subscriptions."""
+        cache = get_cache()
+        in_process = is_in_process(cache)
+        version = first_poll = object()
+        delivered = {} # pair: last delivered message
+        while self.get_subscribed_pairs():
+            current = cache.get(PUSHED_VERSION_KEY) if in_process else await cache.aget(PUSHED_VERSION_KEY)
+            if current != version:
+                keys = [f"{PUSHED_KEY}{pair}" for pair in self.get_subscribed_pairs()]
+                pushed = cache.get_many(keys) if in_process else await cache.aget_many(keys)
+                changed = [message for message in pushed.values() if delivered.get(message["currency_pair"]) != message]
+                # the first poll only records what was published before, connections start with a snapshot
+                if version is not first_poll:
+                    self.deliver(changed)
+                delivered.update({message["currency_pair"]: message for message in changed})
+                version = current
+            await asyncio.sleep(self.poll_interval)
+
+
+@lru_cache(maxsize=None)
+def get_broadcaster() -> LocalBroadcaster:
+    return import_string(getattr(settings, "CURRENCY_BROADCAST_BACKEND", "currencies.broadcast.LocalBroadcaster"))()
+
+
+def publish(messages: List[dict]):
+    """Pushes changed latest rates (see rate_message()) to subscribers."""
+    if messages:
+        get_broadcaster().publish(messages)
@@ -0,0 +1,143 @@
+"""
+Read-through cache for API responses, built on Django's cache framework (settings.CACHES).
+Every key is prefixed with an ingest generation. Bumping the generation (done whenever rates change)
+makes all previously cached entries unreachable at once, they are then evicted by LRU or TTL.
+The generation and the time of its last bump also validate HTTP responses (see currencies.conditional).
+"""
+import threading
+import time
+from datetime import datetime, timezone
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.locmem import LocMemCache
+
+GENERATION_KEY = "currencies:generation"
+MODIFIED_KEY = "currencies:modified"
+_MISSING = object()
+_stats_lock = threading.Lock()
+_stats = {"hits": 0, "misses": 0}
+
+
+def get_cache():
+    return caches[getattr(settings, "CURRENCIES_CACHE_ALIAS", "default")]
+
+
+def get_generation() -> int:
+    """
+    Returns current ingest generation.
+    A missing generation (first use or evicted) starts from current time, so it never repeats an old one.
+    """
+    cache = get_cache()
+    generation = cache.get(GENERATION_KEY)
+    if generation is None:
+        cache.add(GENERATION_KEY, time.time_ns(), timeout=None)
+        generation = cache.get(GENERATION_KEY)
+    return generation
+
+
+def bump_generation():
+    """Invalidates every cached entry. Called by ingestion whenever stored rates change."""
+    cache = get_cache()
+    try:
+        cache.incr(GENERATION_KEY)
+    except ValueError: # missing key
+        cache.set(GENERATION_KEY, time.time_ns(), timeout=None)
+    cache.set(MODIFIED_KEY, time.time(), timeout=None)
+
+
+def get_last_modified() -> datetime:
+    """
+    Returns time of the last generation bump (aware UTC).
+    A missing one (first use or evicted) starts from current time, like get_generation().
+    """
+    cache = get_cache()
+    modified = cache.get(MODIFIED_KEY)
+    if modified is None:
+        cache.add(MODIFIED_KEY, time.time(), timeout=None)
+        modified = cache.get(MODIFIED_KEY)
+    return datetime.fromtimestamp(modified, tz=timezone.utc)
+
+
+def get_or_compute(key: str, compute, timeout=None):
+    """
+    Returns value cached under key for current generation, computing and caching it on a miss.
+    Parameters:
+        key (str): key unique within a generation, i.e.: "latest:EURUSD"
+        compute (callable): called without arguments on a miss, must not return None
+        timeout (int): TTL in seconds, defaults to the TIMEOUT of the cache backend
+    """
+    cache = get_cache()
+    full_key = f"currencies:{get_generation()}:{key}"
+    value = cache.get(full_key, _MISSING)
+    if value is not _MISSING:
+        _record("hits")
+        return value
+    _record("misses")
+    value = compute()
+    if timeout is None:
+        cache.set(full_key, value)
+    else:
+        cache.set(full_key, value, timeout=timeout)
+    return value
+
+
+def is_in_process(cache) -> bool:
+    """
+    In-process backends never block on I/O, async code calls them directly,
+    their a*() methods would only add a thread pool hop.
+    """
+    return isinstance(cache, LocMemCache)
+
+
+async def aget_generation() -> int:
+    """Async version of get_generation()."""
+    cache = get_cache()
+    if is_in_process(cache):
+        return get_generation()
+    generation = await cache.aget(GENERATION_KEY)
+    if generation is None:
+        await cache.aadd(GENERATION_KEY, time.time_ns(), timeout=None)
+        generation = await cache.aget(GENERATION_KEY)
+    return generation
+
+
+async def aget_or_compute(key: str, compute, timeout=None):
+    """Async version of get_or_compute(), compute has to be a coroutine function."""
+    cache = get_cache()
+    in_process = is_in_process(cache)
+    full_key = f"currencies:{await aget_generation()}:{key}"
+    value = cache.get(full_key, _MISSING) if in_process else await cache.aget(full_key, _MISSING)
+    if value is not _MISSING:
+        _record("hits")
+        return value
+    _record("misses")
+    value = await compute()
+    kwargs = {} if timeout is None else {"timeout": timeout}
+    if in_process:
+        cache.set(full_key, value, **kwargs)
+    else:
+        await cache.aset(full_key, value, **kwargs)
+    return value
+
+
+def _record(counter: str):
+    with _stats_lock:
+        _stats[counter] += 1
+
+
+def get_stats() -> dict:
+    """Hit/miss counters of this process (every worker process counts separately)."""
+    with _stats_lock:
+        hits, misses = _stats["hits"], _stats["misses"]
+    total = hits + misses
+    return {"hits": hits,
+            "misses": misses,
+            "hit_ratio": hits/total if total else 0.0,
+            "generation": get_generation()}
+
+
+def reset_stats():
+    with _stats_lock:
+        _stats["hits"] = 0
+        _stats["misses"] = 0
@@ -0,0 +1,27 @@
+"""
+HTTP conditional requests (ETag, Last-Modified) and Cache-Control of read-only rate endpoints.
+Responses only change when ingestion bumps the cache generation, so the generation is the ETag and the time
+of its bump is Last-Modified: unchanged polls get 304 Not Modified from the cache, without running the endpoint.
+"""
+from django.conf import settings
+from django.views.decorators.cache import cache_control
+from django.views.decorators.http import condition
+
+from . import cache
+
+
+def get_etag(request, *args, **kwargs) -> str:
+    # weak, the same data can be served with another encoding or formatting
+    return f'W/"{cache.get_generation()}"'
+
+
+def get_last_modified(request, *args, **kwargs):
+    return cache.get_last_modified()
+
+
+# used as @decorate_view(*conditional_get) below @router.get(...), works with sync and async endpoints
+# (304 responses keep Cache-Control, so clients and shared caches revalidate again after max-age)
+conditional_get = [
+    condition(etag_func=get_etag, last_modified_func=get_last_modified),
+    cache_control(public=True, max_age=settings.CURRENCY_HTTP_MAX_AGE),
+]
@@ -0,0 +1,224 @@
+"""
+Batch conversion of amounts between currencies.
+Every rate a batch needs is read with at most two queries (LatestRate for undated items, Rate for items with date
+or instant "at"), items are then resolved in Python: stored pair first, otherwise triangulated through the pivot.
+"""
+import json
+import re
+
+from collections import defaultdict
+from decimal import Decimal, InvalidOperation
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+import numpy as np
+
+from pydantic import TypeAdapter
+
+from .asof import Point, from_nanoseconds, get_bounds_array, load_history, search_as_of, to_instant
+from .fields import from_scaled
+from .models import LatestRate
+from .schemas import CURRENCY_CODE_PATTERN, ConvertDate, ConvertInstant
+from .triangulation import get_cross_rate_candidates, get_leg_pairs, get_leg_value, get_pivot_code, resolve_cross_rate
+
+max_convert_items = 50_000
+amount_types = {str, int, Decimal}
+item_errors = (KeyError, TypeError, AttributeError, ValueError, InvalidOperation)
+# items are validated by the field types of ConvertItemSchema (distinct dates and instants at once)
+currency_code_pattern = re.compile(CURRENCY_CODE_PATTERN)
+date_list_adapter = TypeAdapter(List[ConvertDate])
+instant_list_adapter = TypeAdapter(List[ConvertInstant])
+
+
+def parse_convert_items(body: bytes) -> Dict[str, list]:
+    """
+    Parses body of a convert request, in format of {"items": [{"amount": "10.5", "from": "eur", "to": "PLN"}, ...]}
+    (every item may have a "date" or an instant "at" too, not both). Validated by hand with the rules of
+    ConvertItemSchema, pydantic is several times slower on 10k+ Decimal amounts. Raises ValueError for malformed body or items.
+    Returns:
+        items (dict): columns of items in format of {"amount": [Decimal("10.5"), ...], "from": ["EUR", ...], "to": ["PLN", ...],
+                      "date": [None, ...], "at": [None, ...]}, "at" as aware UTC datetimes
+    """
+    try:
+        items = json.loads(body, parse_float=Decimal)["items"]
+    except (ValueError, KeyError, TypeError):
+        raise ValueError("Body has to be a JSON object with a list of items.")
+    if not isinstance(items, list):
+        raise ValueError("Body has to be a JSON object with a list of items.")
+    if len(items) > max_convert_items:
+        raise ValueError(f"At most {max_convert_items} items can be converted at once.")
+    try:
+        return parse_item_columns(items)
+    except item_errors:
+        pass
+    # validated one by one only to tell which item is invalid
+    for index, item in enumerate(items):
+        try:
+            parse_item_columns([item])
+        except item_errors:
+            raise ValueError(f"Invalid item at index {index}: {item}.")
+    raise ValueError("Invalid items.")
+
+
+def parse_item_columns(items: List) -> Dict[str, list]:
+    """
+    Validates items column by column (see parse_convert_items()), raises one of item_errors for any invalid item.
+    Dates, instants and currency pairs repeat over items, each distinct one is parsed and validated once.
+    """
+    amounts = [item["amount"] for item in items]
+    if not {type(amount) for amount in amounts} <= amount_types: # bool is not accepted (it is an int subclass)
+        raise TypeError
+    amounts = list(map(Decimal, amounts))
+    if not all(map(Decimal.is_finite, amounts)):
+        raise ValueError
+    dates = [item.get("date") for item in items]
+    instants = [item.get("at") for item in items]
+    if any((_date_ is not None) and (at is not None) for _date_, at in zip(dates, instants)):
+        raise ValueError
+    parsed_dates = parse_distinct(dates, date_list_adapter)
+    parsed_instants = {value: at and to_instant(at) for value, at in parse_distinct(instants, instant_list_adapter).items()}
+    bases, quotes = [item["from"] for item in items], [item["to"] for item in items]
+    codes = {code: parse_code(code) for code in {*bases, *quotes}}
+    return {"amount": amounts,
+            "from": [codes[code] for code in bases],
+            "to": [codes[code] for code in quotes],
+            "date": [parsed_dates[value] for value in dates],
+            "at": [parsed_instants[value] for value in instants]}
+
+
+def parse_distinct(values: List, adapter: TypeAdapter) -> Dict:
+    """Maps every distinct value of a column to its parsed value, validated at once by adapter (None stays None)."""
+    distinct = list(set(values) - {None})
+    return {None: None, **dict(zip(distinct, adapter.validate_json(json.dumps(distinct))))}
+
+
+def parse_code(code: str) -> str:
+    """Upper case currency code of an item, raises ValueError for an invalid one."""
+    if not currency_code_pattern.fullmatch(code):
+        raise ValueError
+    return code.upper()
+
+
+def convert_amounts(items: Dict[str, list]) -> Dict[str, list]:
+    """
+    Converts every item with the rate of its pair (latest one, or the one in effect at item date or instant).
+    Parameters:
+        items (dict): parse_convert_items() result
+    Returns:
+        results (dict): items with "exchange_rate" and "converted" columns added (both None when the rate is unknown)
+    """
+    pivot = get_pivot_code()
+    # columns are zipped on the fly, a list of 10k+ key tuples kept alive costs full garbage collections
+    points = [at or _date_ for _date_, at in zip(items["date"], items["at"])]
+    keys = set(zip(items["from"], items["to"], points))
+    latest = get_latest_rates({(base, quote) for base, quote, point in keys if point is None}, pivot)
+    as_of = get_rates_as_of({key for key in keys if key[2] is not None}, pivot)
+    items["exchange_rate"] = [latest[base, quote] if point is None else as_of[base, quote, point]
+                              for base, quote, point in zip(items["from"], items["to"], points)]
+    items["converted"] = [None if exchange_rate is None else amount * exchange_rate
+                          for amount, exchange_rate in zip(items["amount"], items["exchange_rate"])]
+    return items
+
+
+def serialize_results(results: Dict[str, list]) -> str:
+    """
+    JSON of convert_amounts() results in format of ConvertResponseSchema, Decimals as strings (exact).
+    Items are formatted directly (codes are validated alphanumeric), json.dumps() of 10k+ dicts is several times slower.
+    Currency pairs, dates, instants and rates repeat over items, each distinct one is formatted once.
+    """
+    def optional(value) -> str:
+        return "null" if value is None else f'"{value}"'
+
+    pairs = {(base, quote): f'"from":"{base}","to":"{quote}"' for base, quote in set(zip(results["from"], results["to"]))}
+    dates = {value: optional(value) for value in set(results["date"])}
+    instants = {value: optional(value and value.isoformat()) for value in set(results["at"])}
+    rates = {value: optional(value) for value in set(results["exchange_rate"])}
+    exchange_rates = [rates[value] for value in results["exchange_rate"]]
+    converted = ["null" if value is None else f'"{value}"' for value in results["converted"]]
+    items = ",".join([f'{{"amount":"{amount}",{pairs[base, quote]},"date":{dates[_date_]},"at":{instants[at]},'
+                      f'"exchange_rate":{exchange_rate},"converted":{value}}}'
+                      for amount, base, quote, _date_, at, exchange_rate, value
+                      in zip(results["amount"], results["from"], results["to"], results["date"], results["at"],
+                             exchange_rates, converted)])
+    return f'{{"items":[{items}]}}'
+
+
+def get_candidates(pairs: Iterable[Tuple[str, str]], pivot: str) -> Set[str]:
+    """Union of get_cross_rate_candidates() of every pair."""
+    return {candidate for base, quote in pairs for candidate in get_cross_rate_candidates(base, quote, pivot)}
+
+
+def resolve(base: str, quote: str, pivot: str, rates: Dict[str, Decimal]) -> Optional[Decimal]:
+    """Same as resolve_cross_rate(), a currency converted to itself doesn't need any stored rate."""
+    if base == quote:
+        return Decimal(1)
+    return resolve_cross_rate(base, quote, pivot, rates)
+
+
+def get_latest_rates(pairs: Set[Tuple[str, str]], pivot: str) -> Dict[Tuple[str, str], Optional[Decimal]]:
+    """Latest rate of every (base, quote) pair, with a single LatestRate query."""
+    if not pairs:
+        return {}
+    rates = dict(LatestRate.objects.filter(pk__in=get_candidates(pairs, pivot)).values_list("pair", "exchange_rate"))
+    return {(base, quote): resolve(base, quote, pivot, rates) for base, quote in pairs}
+
+
+def get_rates_as_of(keys: Set[Tuple[str, str, Point]], pivot: str) -> Dict[Tuple[str, str, Point], Optional[Decimal]]:
+    """
+    Rate of every (base, quote, date or datetime) key in effect at that point (see currencies.asof),
+    with a single Rate query. Series of a pair is searched once for all of its points (numpy.searchsorted()),
+    legs of a triangulated pair are looked up as of the same point. Points sharing a series position share
+    the decoded rate and leg value, so a batch does Decimal work per distinct stored rate, not per item.
+    """
+    if not keys:
+        return {}
+    points = list({point for _base_, _quote_, point in keys})
+    bounds = get_bounds_array(points)
+    rows = {point: row for row, point in enumerate(points)}
+    history = load_history(get_candidates({(base, quote) for base, quote, _point_ in keys}, pivot),
+                           from_nanoseconds(bounds[:, 0].min()), from_nanoseconds(bounds[:, 1].max()))
+    decoded = defaultdict(dict) # pair -> {series position: rate}
+    leg_keys = {} # code -> series position of its leg at every point (-1 none, -2 - position for the inverse leg)
+    leg_values = defaultdict(dict) # code -> {leg key: get_leg_value()}
+
+    def search(pair: str, pair_bounds: np.ndarray) -> np.ndarray:
+        if pair not in history:
+            return np.full(len(pair_bounds), -1)
+        return search_as_of(history[pair][0], pair_bounds)
+
+    def decode(pair: str, position: int) -> Decimal:
+        if position not in decoded[pair]:
+            decoded[pair][position] = from_scaled(int(history[pair][1][position]))
+        return decoded[pair][position]
+
+    def get_leg_value_at(code: str, row: int) -> Optional[Decimal]:
+        if code not in leg_keys:
+            direct, inverse = get_leg_pairs(code, pivot)
+            direct_positions, inverse_positions = search(direct, bounds), search(inverse, bounds)
+            leg_keys[code] = np.where(direct_positions >= 0, direct_positions,
+                                      np.where(inverse_positions >= 0, -2 - inverse_positions, -1)).tolist()
+        key = leg_keys[code][row]
+        if key not in leg_values[code]:
+            direct, inverse = get_leg_pairs(code, pivot)
+            rates = {direct: decode(direct, key)} if key >= 0 else {inverse: decode(inverse, -2 - key)} if key < -1 else {}
+            leg_values[code][key] = get_leg_value(code, pivot, rates)
+        return leg_values[code][key]
+
+    points_by_pair = defaultdict(list)
+    for base, quote, point in keys:
+        points_by_pair[(base, quote)].append(point)
+    results = {}
+    for (base, quote), pair_points in points_by_pair.items():
+        if base == quote:
+            results.update({(base, quote, point): Decimal(1) for point in pair_points})
+            continue
+        # stored pair first, legs of the points without its rate then (same rules as resolve())
+        pair = f"{base}{quote}"
+        pair_rows = [rows[point] for point in pair_points]
+        for point, row, position in zip(pair_points, pair_rows, search(pair, bounds[pair_rows]).tolist()):
+            if position >= 0:
+                exchange_rate = decode(pair, position)
+            else:
+                base_value, quote_value = get_leg_value_at(base, row), get_leg_value_at(quote, row)
+                exchange_rate = base_value / quote_value if (base_value is not None) and quote_value else None
+            results[(base, quote, point)] = exchange_rate
+    return results
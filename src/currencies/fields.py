@@ -0,0 +1,78 @@
+"""
+Fixed-point storage of exchange rates: a Decimal scaled by 10**decimal_places and stored as a 64-bit integer.
+Integers keep every stored digit exact in any database (SQLite keeps DecimalField as REAL) and decode
+without going through float or string parsing.
+"""
+from decimal import ROUND_HALF_EVEN, Decimal
+
+from django import forms
+from django.core import exceptions
+from django.db import models
+from django.db.models import lookups
+from django.db.models.functions import Cast
+
+RATE_DECIMAL_PLACES = 8
+RATE_SCALE = 10**RATE_DECIMAL_PLACES
+
+
+def to_scaled(value, decimal_places: int = RATE_DECIMAL_PLACES) -> int:
+    """Rounds a number (half to even) to decimal_places and returns it as a scaled integer, i.e. 1.0845 -> 108450000."""
+    if isinstance(value, float):
+        value = repr(value) # shortest round-tripping digits, same as Decimal(str(value))
+    return int(Decimal(value).scaleb(decimal_places).to_integral_value(ROUND_HALF_EVEN))
+
+
+def from_scaled(value: int, decimal_places: int = RATE_DECIMAL_PLACES) -> Decimal:
+    """Inverse of to_scaled(), i.e. 108450000 -> Decimal("1.08450000")."""
+    return Decimal(value).scaleb(-decimal_places)
+
+
+def scaled(field_name: str) -> Cast:
+    """
+    Expression reading a FixedPointField as its stored integer (no Decimal per row).
+    Divide by RATE_SCALE for a float, i.e.: qs.values_list("id", scaled("exchange_rate"))
+    """
+    return Cast(field_name, output_field=models.BigIntegerField())
+
+
+class FixedPointField(models.BigIntegerField):
+    """Decimal column stored as an integer scaled by 10**decimal_places, values are read as Decimal."""
+    description = "Fixed-point decimal number stored as a scaled integer"
+
+    def __init__(self, *args, decimal_places: int = RATE_DECIMAL_PLACES, **kwargs):
+        self.decimal_places = decimal_places
+        super().__init__(*args, **kwargs)
+
+    def deconstruct(self):
+        name, path, args, kwargs = super().deconstruct()
+        if self.decimal_places != RATE_DECIMAL_PLACES:
+            kwargs["decimal_places"] = self.decimal_places
+        return name, path, args, kwargs
+
+    def from_db_value(self, value, expression, connection):
+        if value is None:
+            return None
+        return from_scaled(value, self.decimal_places)
+
+    def to_python(self, value):
+        if (value is None) or isinstance(value, Decimal):
+            return value
+        try:
+            return from_scaled(to_scaled(value, self.decimal_places), self.decimal_places)
+        except (ArithmeticError, ValueError, TypeError):
+            raise exceptions.ValidationError(f"'{value}' value must be a decimal number.", code="invalid")
+
+    def get_prep_value(self, value):
+        value = models.Field.get_prep_value(self, value) # skips int() of IntegerField
+        if value is None:
+            return None
+        return to_scaled(value, self.decimal_places)
+
+    def formfield(self, **kwargs):
+        return models.Field.formfield(self, **{"form_class": forms.DecimalField,
+                                               "decimal_places": self.decimal_places, **kwargs})
+
+
+# IntegerField lookups round float values and check integer ranges before scaling, compare scaled values instead
+for lookup in (lookups.Exact, lookups.GreaterThan, lookups.GreaterThanOrEqual, lookups.LessThan, lookups.LessThanOrEqual):
+    FixedPointField.register_lookup(lookup)
@@ -0,0 +1,241 @@
+import io
+
+import numpy as np
+import pandas as pd
+
+from datetime import datetime
+from decimal import Decimal
+from typing import Dict, List, Optional, Tuple
+
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+from django.db.models import Q
+
+from .fields import to_scaled
+from .models import Rate
+from .timestamps import get_granularity, to_timestamp
+
+RATE_QUANTUM = Decimal(1).scaleb(-Rate._meta.get_field("exchange_rate").decimal_places)
+RATE_COLUMNS = ["ticker", "base", "quote", "date", "time", "exchange_rate"]
+RATE_KEY_FIELDS = ["base_currency", "quote_currency", "granularity", "ts"] # fields of unique_rate_pair_timestamp
+COPY_COLUMNS = "base_currency_id, quote_currency_id, exchange_rate, ts, granularity"
+staging_table = "currencies_rate_staging"
+
+
+def split_response_index(index: pd.Index) -> Tuple[pd.Index, np.ndarray, Optional[np.ndarray]]:
+    """
+    Splits the index of a yf.download() response into dates and times of day (None for daily data).
+    Intraday timestamps are converted to UTC first (yfinance returns them in the exchange time zone).
+    Returns:
+        (index, dates, times) (tuple): UTC index, object arrays of datetime.date and datetime.time (or None)
+    """
+    daily = index.name == "Date"  # "Date" or "Datetime"
+    if (not daily) and (getattr(index, "tz", None) is not None):
+        index = index.tz_convert("UTC")
+    return index, index.date, (None if daily else index.time)
+
+
+def normalize_yfinance_response(response: pd.DataFrame, exchange_tickers: List,
+                                index_parts: Optional[Tuple] = None) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    """
+    Turns a yf.download() response into one long frame with a row per (ticker, timestamp).
+    Every step (Close -> Open fallback, date/time split, NaN filtering) runs on whole columns.
+    Parameters:
+        response (pd.DataFrame): dataframe response from yf.download() method (grouped by ticker)
+        exchange_tickers (list): list of tickers in format of ["EURUSD=X", "USDEUR=X", ...]
+        index_parts (tuple): (optional) split_response_index() of the response, reused over column groups of a response
+    Returns:
+        frame (pd.DataFrame): valid rows ordered by ticker with columns ["ticker", "base", "quote", "date", "time", "exchange_rate"]
+        skipped (pd.DataFrame): rows without any rate value with columns ["ticker", "timestamp"]
+    """
+    index, index_dates, index_times = index_parts or split_response_index(response.index)
+    opens = response.xs("Open", axis=1, level=1).reindex(columns=exchange_tickers)
+    closes = response.xs("Close", axis=1, level=1).reindex(columns=exchange_tickers)
+    # (timestamps x tickers) matrix flattened ticker by ticker
+    rates = closes.fillna(opens).to_numpy(dtype="float64").ravel(order="F")
+    valid = ~np.isnan(rates)
+
+    n_timestamps = len(index)
+    tickers = np.asarray(exchange_tickers, dtype=object)
+    ticker_codes = np.repeat(tickers, n_timestamps)
+    base_codes = np.repeat(np.array([ticker[:3] for ticker in exchange_tickers], dtype=object), n_timestamps)
+    quote_codes = np.repeat(np.array([ticker[3:6] for ticker in exchange_tickers], dtype=object), n_timestamps)
+    dates = np.tile(index_dates, len(tickers))
+    if index_times is None:
+        times = np.full(int(valid.sum()), None, dtype=object)
+    else:
+        times = np.tile(index_times, len(tickers))[valid]
+
+    frame = pd.DataFrame({
+        "ticker": ticker_codes[valid],
+        "base": base_codes[valid],
+        "quote": quote_codes[valid],
+        "date": dates[valid],
+        "time": times,
+        "exchange_rate": rates[valid],
+    }, columns=RATE_COLUMNS)
+    skipped = pd.DataFrame({
+        "ticker": ticker_codes[~valid],
+        "timestamp": index[np.flatnonzero(~valid) % n_timestamps], # stays datetime64, no per-row Timestamp objects
+    })
+    return frame, skipped
+
+
+def attach_currency_ids(frame: pd.DataFrame, currency_ids: Dict[str, int]) -> pd.DataFrame:
+    """
+    Maps "base" and "quote" code columns to "base_currency_id" and "quote_currency_id" columns.
+    Parameters:
+        frame (pd.DataFrame): normalized frame returned by normalize_yfinance_response()
+        currency_ids (dict): in format of {"EUR": 1, "USD": 2, ...}, must cover every code in frame
+    Returns:
+        frame (pd.DataFrame): the same frame with both id columns added
+    """
+    frame["base_currency_id"] = frame["base"].map(currency_ids)
+    frame["quote_currency_id"] = frame["quote"].map(currency_ids)
+    return frame
+
+
+def frame_pairs(frame: pd.DataFrame) -> List[Tuple[int, int]]:
+    """Returns distinct (base_currency_id, quote_currency_id) pairs of a frame with currency id columns."""
+    pairs = frame[["base_currency_id", "quote_currency_id"]].drop_duplicates().to_numpy().tolist()
+    return [tuple(pair) for pair in pairs]
+
+
+def frame_to_rate_instances(frame: pd.DataFrame, interval: Optional[str] = None) -> List[Rate]:
+    """
+    Builds unsaved Rate instances (for bulk creation) out of a frame with currency id columns.
+    Parameters:
+        interval (str): (optional) fetch_data interval of the rows, sets granularity of rows with time (see get_granularity())
+    """
+    return [
+        Rate(base_currency_id=base_id,
+             quote_currency_id=quote_id,
+             ts=to_timestamp(_date_, _time_),
+             granularity=get_granularity(_time_, interval),
+             exchange_rate=_exchange_rate_)
+        for base_id, quote_id, _date_, _time_, _exchange_rate_ in zip(
+            frame["base_currency_id"].tolist(),
+            frame["quote_currency_id"].tolist(),
+            frame["date"].tolist(),
+            frame["time"].tolist(),
+            frame["exchange_rate"].tolist(),
+        )
+    ]
+
+
+def get_rate_key(rate: Rate) -> Tuple[int, int, str, datetime]:
+    """Returns (base_currency_id, quote_currency_id, granularity, ts) of a rate, key of unique_rate_pair_timestamp."""
+    return (rate.base_currency_id, rate.quote_currency_id, rate.granularity, rate.ts)
+
+
+def get_stored_rates(rates: List[Rate]) -> Dict[Tuple[int, int, str, datetime], Decimal]:
+    """
+    Returns stored rates sharing the key (see get_rate_key()) of passed unsaved rates.
+    Stored rows are read with a ts range scan of every (pair, granularity) of the rates and matched in Python.
+    Returns:
+        stored (dict): key to stored rate, in format of {(base_currency_id, quote_currency_id, granularity, ts): Decimal("1.08"), ...}
+    """
+    keys = {get_rate_key(rate) for rate in rates}
+    ranges = {}
+    for base_id, quote_id, granularity, ts in keys:
+        first, last = ranges.get((base_id, quote_id, granularity), (ts, ts))
+        ranges[(base_id, quote_id, granularity)] = (min(first, ts), max(last, ts))
+    if not ranges:
+        return {}
+    conditions = Q()
+    for (base_id, quote_id, granularity), ts_range in ranges.items():
+        conditions |= Q(base_currency_id=base_id, quote_currency_id=quote_id, granularity=granularity, ts__range=ts_range)
+    stored = Rate.objects.filter(conditions).values_list("base_currency_id", "quote_currency_id", "granularity", "ts",
+                                                         "exchange_rate")
+    return {key[:4]: key[4] for key in stored if key[:4] in keys}
+
+
+def insert_rates(rates: List[Rate], using: str = DEFAULT_DB_ALIAS, on_conflict: Optional[str] = None):
+    """
+    Inserts unsaved rates, with COPY on PostgreSQL (rows are streamed as text, no INSERT statement to parse or plan,
+    several times faster on large batches), with bulk_create() elsewhere. COPY doesn't set ids of passed instances.
+    Parameters:
+        on_conflict (str): (optional) "ignore" to skip rates whose key is already stored, "update" to overwrite
+                           the stored rate (see RATE_KEY_FIELDS), rows stored meanwhile by another writer don't fail
+    """
+    connection = connections[using]
+    if (connection.vendor != "postgresql") or (not rates):
+        Rate.objects.using(using).bulk_create(
+            rates, ignore_conflicts=(on_conflict == "ignore"), update_conflicts=(on_conflict == "update"),
+            unique_fields=RATE_KEY_FIELDS if on_conflict == "update" else None,
+            update_fields=["exchange_rate"] if on_conflict == "update" else None)
+        return
+    table = connection.ops.quote_name(Rate._meta.db_table)
+    if on_conflict is None:
+        with connection.cursor() as cursor:
+            copy_rates(cursor, table, rates)
+        return
+    # COPY has no conflict handling, rows are copied into a staging table and merged with INSERT ... ON CONFLICT
+    action = "NOTHING" if on_conflict == "ignore" else "UPDATE SET exchange_rate = EXCLUDED.exchange_rate"
+    with transaction.atomic(using=using), connection.cursor() as cursor:
+        cursor.execute(f"DROP TABLE IF EXISTS {staging_table}")
+        cursor.execute(f"CREATE TEMPORARY TABLE {staging_table} ON COMMIT DROP AS "
+                       f"SELECT {COPY_COLUMNS} FROM {table} WITH NO DATA")
+        copy_rates(cursor, staging_table, rates)
+        cursor.execute(f"INSERT INTO {table} ({COPY_COLUMNS}) SELECT {COPY_COLUMNS} FROM {staging_table} "
+                       f"ON CONFLICT (base_currency_id, quote_currency_id, granularity, ts) DO {action}")
+
+
+def copy_rates(cursor, table: str, rates: List[Rate]):
+    """Streams unsaved rates into table (columns of COPY_COLUMNS) with COPY."""
+    null = "\\N"
+    rows = "".join(f"{rate.base_currency_id}\t{rate.quote_currency_id}\t{to_scaled(rate.exchange_rate)}\t"
+                   f"{null if rate.ts is None else rate.ts.isoformat()}\t{rate.granularity}\n"
+                   for rate in rates)
+    sql = f"COPY {table} ({COPY_COLUMNS}) FROM STDIN"
+    database_cursor = cursor.cursor
+    if hasattr(database_cursor, "copy"): # psycopg 3
+        with database_cursor.copy(sql) as copy:
+            copy.write(rows)
+    else: # psycopg2
+        database_cursor.copy_expert(sql, io.StringIO(rows))
+
+
+def insert_new_rates(rates: List[Rate]) -> Tuple[int, int, int]:
+    """
+    Inserts unsaved rates whose key is not stored yet, stored rows are left untouched.
+    Returns:
+        (inserted, updated, unchanged) (tuple): number of rows in each state, updated is always 0
+    """
+    stored = get_stored_rates(rates)
+    new_rates = [rate for rate in rates if get_rate_key(rate) not in stored]
+    insert_rates(new_rates, on_conflict="ignore")
+    return (len(new_rates), 0, len(rates) - len(new_rates))
+
+
+def quantize_rate(value) -> Decimal:
+    """Rounds a rate the same way it is stored in the exchange_rate column."""
+    return Decimal(str(value)).quantize(RATE_QUANTUM)
+
+
+def merge_rate_frame(frame: pd.DataFrame, interval: Optional[str] = None) -> Tuple[int, int, int]:
+    """
+    Upserts rows of a frame with currency id columns.
+    Rows already stored with the same (base, quote, granularity, ts) key are updated only if their rate changed.
+    Stored rows are read with get_stored_rates(), which tells unchanged rows apart. New and changed rows are written
+    with a single upsert on the key, a row inserted meanwhile by another writer is updated instead of failing.
+    Parameters:
+        frame (pd.DataFrame): frame ready for frame_to_rate_instances()
+        interval (str): (optional) see frame_to_rate_instances()
+    Returns:
+        (inserted, updated, unchanged) (tuple): number of rows in each state
+    """
+    if frame.empty:
+        return (0, 0, 0)
+    rates = frame_to_rate_instances(frame, interval)
+    stored_rates = get_stored_rates(rates)
+    to_write = []
+    inserted, unchanged = 0, 0
+    for rate in rates:
+        key = get_rate_key(rate)
+        if key in stored_rates and stored_rates[key] == quantize_rate(rate.exchange_rate):
+            unchanged += 1
+            continue
+        inserted += key not in stored_rates
+        to_write.append(rate)
+    insert_rates(to_write, on_conflict="update")
+    return (inserted, len(to_write) - inserted, unchanged)
@@ -0,0 +1,75 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from datetime import datetime, timedelta
+
+from currencies.archive import (
+    ArchiveError,
+    archive_pair_rates,
+    get_archivable_rates,
+    get_archive_root,
+    get_stored_pairs,
+    import_pyarrow,
+)
+from currencies.timestamps import to_timestamp
+
+
+class Command(BaseCommand):
+    help = "Move historical rates from Rate table to the Parquet archive (settings.CURRENCY_ARCHIVE_DIR)."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--days", type=int,
+                            help=f"""Archive rates older than this many days.
+                            Default is {settings.CURRENCY_ARCHIVE_AFTER_DAYS} (settings.CURRENCY_ARCHIVE_AFTER_DAYS).
+                            """)
+        parser.add_argument("--before", type=str,
+                            help="Archive rates dated before this date (YYYY-MM-DD), overrides --days.")
+        parser.add_argument("--pairs", type=str,
+                            help="""Pairs to archive. Separated by comas without spaces.
+                            Example: EURUSD,USDPLN. Default is every stored pair.""")
+        parser.add_argument("--dry-run", action="store_true",
+                            help="Only report how many rates would be archived.")
+
+    def handle(self, *args, **options):
+        before = get_before(options.get("before"), options.get("days"))
+        try:
+            pairs = get_stored_pairs(options.get("pairs"))
+        except ValueError as error:
+            raise CommandError(str(error))
+        dry_run = options.get("dry_run")
+        if not dry_run:
+            try:
+                import_pyarrow()
+            except ArchiveError as error:
+                raise CommandError(str(error))
+
+        total = 0
+        for base_id, quote_id, pair in pairs:
+            if dry_run:
+                count = get_archivable_rates(base_id, quote_id, before).count()
+            else:
+                try:
+                    count = archive_pair_rates(base_id, quote_id, pair, before)
+                except (ArchiveError, OSError) as error:
+                    raise CommandError(f"Archiving {pair} failed: {error}")
+            if count:
+                self.stdout.write(f"{pair}: {count} rates{' to archive' if dry_run else ' archived'}.")
+            total += count
+
+        action = "Would archive" if dry_run else "Archived"
+        self.stdout.write(self.style.SUCCESS(
+            f"{action} {total} rates dated before {before.date()} to {get_archive_root()}."))
+
+
+def get_before(before: str, days: int) -> datetime:
+    """Returns the (aware UTC) timestamp rates are archived before."""
+    if before:
+        try:
+            return to_timestamp(datetime.strptime(before, "%Y-%m-%d").date())
+        except ValueError:
+            raise CommandError(f"Invalid --before date '{before}', expected YYYY-MM-DD.")
+    days = settings.CURRENCY_ARCHIVE_AFTER_DAYS if days is None else days
+    if days < 0:
+        raise CommandError("--days must not be negative.")
+    return to_timestamp(timezone.now().date() - timedelta(days=days))
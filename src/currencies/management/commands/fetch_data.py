@@ -1,21 +1,48 @@
 from django.core.management.base import BaseCommand, CommandError
-from django.utils import timezone
+from django.db import transaction
+from django.db.models import Q
 
+from collections import defaultdict
 from itertools import permutations
 from datetime import datetime
-from typing import List, Dict, Tuple, Set
+from typing import Iterable, List, Dict, Tuple, Set
 import pandas as pd
-import yfinance as yf
 
-from currencies.models import Currency, Rate
+from currencies.archive import drop_archived_rows, get_boundaries
+from currencies.ingestion import (
+    attach_currency_ids,
+    frame_pairs,
+    frame_to_rate_instances,
+    insert_new_rates,
+    insert_rates,
+    merge_rate_frame,
+)
+from currencies.models import Currency, LatestRate, Rate
+from currencies.partitioning import ensure_rate_partitions
+from currencies.profiling import IngestProfiler, NullProfiler, null_profiler
+from currencies.rollups import get_frame_ranges, refresh_rollups
+from currencies.providers import (
+    ProviderError,
+    RateProvider,
+    ReplayProvider,
+    YFinanceProvider,
+    default_rate_limit,
+    default_retries,
+    default_workers,
+    iter_ticker_fetches,
+)
 
 valid_periods = ["1d", "5d", "1mo", "3mo" "6mo", "1y", "2y", "5y", "10y", "ytd", "max"]
 default_period = "max"
 valid_intervals = ["1m", "2m", "5m", "15m", "30m", "60m", "90m", "1h", "1d", "5d", "1wk", "1mo", "3mo"]
 default_interval = "1d"
+default_batch_size = 5000
+conflicts_chunk_size = 500 # ids per DELETE query of --conflicts (SQLite limits query parameters)
+profiled_options = ["currency_symbols", "period", "interval", "start", "end", "pivot", "conflicts", "upsert", "replay",
+                    "incremental", "workers", "batch_size"]
 
 class Command(BaseCommand):
-    help = "Populate database with a data from yfinance API."
+    help = "Populate database with a data from yfinance API (or from files with --replay)."
 
     def add_arguments(self, parser):
         # positional arguments
@@ -44,14 +71,53 @@ class Command(BaseCommand):
                             Default is now.
                             E.g. for end="2023-01-01", the last data point will be on "2022-12-31".
                             """)
+        parser.add_argument("--pivot", type=str,
+                            help="""Download only rates of every currency against this pivot currency (N-1 tickers instead of N*(N-1)).
+                            Other pairs are triangulated through the pivot by the API.
+                            Example: USD
+                            """)
         parser.add_argument("--conflicts", action="store_true",
                             help="Delete already present coflicting rows in the database and replace them with new values.")
+        parser.add_argument("--upsert", action="store_true",
+                            help="Insert new rows and update only stored rows whose rate changed. Other rows are left untouched.")
         parser.add_argument("--verbose", action="store_true",
                             help="Show each skipped value.")
+        parser.add_argument("--replay", type=str,
+                            help="""Load rates from a CSV/Parquet file (or a directory of them) instead of yfinance.
+                            Files have either pair,timestamp,rate or currency_pair,date,time,exchange_rate columns (format of CSV exports).
+                            Only pairs of passed currencies are loaded.
+                            """)
+        parser.add_argument("--incremental", action="store_true",
+                            help="""Download only rates newer than the last stored ones (per pair, starting from its last stored day).
+                            Pairs without stored rates are downloaded for the whole period. Implies --upsert unless --conflicts is passed.
+                            Tickers are downloaded in parallel and stored as soon as each of them arrives.
+                            """)
+        parser.add_argument("-w", "--workers", type=int, default=default_workers,
+                            help=f"Number of parallel downloads in --incremental mode. Default is {default_workers}.")
+        parser.add_argument("--retries", type=int, default=default_retries,
+                            help=f"Retries of a failed download in --incremental mode (with exponential backoff). Default is {default_retries}.")
+        parser.add_argument("--rate-limit", type=float, default=default_rate_limit,
+                            help=f"Maximal number of download requests per second in --incremental mode (0 for no limit). Default is {default_rate_limit}.")
+        parser.add_argument("-b", "--batch-size", type=int, default=default_batch_size,
+                            help=f"""Number of rows inserted (and committed) at once.
+                            Default is {default_batch_size}.
+                            """)
+        parser.add_argument("--profile", action="store_true",
+                            help="""Print time, SQL queries and peak traced memory of every ingest stage and rows loaded per ticker.
+                            Stage "provider" is the time spent waiting for provider batches besides their download and parsing.
+                            Memory tracing slows the run down, compare profiled runs only with each other.
+                            """)
+        parser.add_argument("--profile-report", type=str,
+                            help="Write the profile (with command options) to this JSON file as well. Implies --profile.")
+        parser.add_argument("--profile-dump", type=str,
+                            help="Write cProfile stats of the run to this file (for pstats, snakeviz, ...). Implies --profile.")
 
     def handle(self, *args, **options):
         # collect arguments
         __update_conflicts = options.get("conflicts")
+        __upsert = options.get("upsert")
+        if __update_conflicts and __upsert:
+            raise CommandError("Use either --conflicts or --upsert, not both.")
         __verbose = options.get("verbose")
         _currency_symbol_list = options["currency_symbols"].split(",")
         _currency_symbol_list = self.verify_currency_symbol_argument(_currency_symbol_list)
@@ -60,17 +126,57 @@ class Command(BaseCommand):
         if (_period is None) and (_start is None) and (_end is None):
             _period = default_period
         _interval = self.verify_interval_argument(options["interval"])
+        _batch_size = self.verify_batch_size_argument(options["batch_size"])
+        _pivot = self.verify_pivot_argument(options["pivot"])
+        _incremental = options.get("incremental")
+        if _incremental and not __update_conflicts:
+            __upsert = True # the last stored day is downloaded again
+        _workers, _retries, _rate_limit = self.verify_download_arguments(options["workers"], options["retries"], options["rate_limit"])
+        _profile_report, _profile_dump = options.get("profile_report"), options.get("profile_dump")
+        _profile = options.get("profile") or bool(_profile_report) or bool(_profile_dump)
 
         # setup
-        exchange_tickers = generate_yfinance_tickers(_currency_symbol_list)
-        # api request
-        response = get_data_from_yfinance(exchange_tickers, period=_period, interval=_interval, start=_start, end=_end)
-        # process
-        model_instances = parse_response_from_yfinance(self, response, exchange_tickers, __update_conflicts, __verbose)
-        # create
-        self.stdout.write(self.style.SUCCESS(f"\nCreating {len(model_instances)} instances of Rate model."))
-        Rate.objects.bulk_create(model_instances)
+        exchange_tickers = generate_yfinance_tickers(_currency_symbol_list, pivot=_pivot)
+        try:
+            provider = get_provider(replay=options.get("replay"))
+        except ProviderError as error:
+            raise CommandError(str(error))
+        profiler = IngestProfiler() if _profile else null_profiler
+        provider.profiler = profiler
+        # api request(s)
+        download_arguments = {"period": _period, "interval": _interval, "start": _start, "end": _end}
+        if _incremental:
+            provider_batches = iter_incremental_batches(self, provider, exchange_tickers, workers=_workers, retries=_retries,
+                                                        rate_limit=_rate_limit, **download_arguments)
+        else:
+            provider_batches = provider.iter_batches(exchange_tickers, **download_arguments)
+        provider_batches = profiler.iterate("provider", provider_batches)
+        # process & create batch by batch
+        inserted, updated, unchanged = 0, 0, 0
+        loaded_tickers = set()
+        try:
+            with profiler.run(dump=_profile_dump):
+                for batch_label, batch in iter_rate_batches(self, provider_batches, _batch_size, profiler=profiler):
+                    batch_counts = store_rate_batch(self, batch, __upsert, __update_conflicts, interval=_interval,
+                                                    profiler=profiler)
+                    inserted, updated, unchanged = (inserted+batch_counts[0], updated+batch_counts[1], unchanged+batch_counts[2])
+                    loaded_tickers.update(batch["ticker"].unique().tolist())
+                    profiler.count_rows(batch)
+                    self.stdout.write(f"{batch_label}: processed {len(batch)} rows ({inserted+updated+unchanged} in total).")
+        except ProviderError as error:
+            raise CommandError(str(error))
+        if not _incremental:
+            for exchange_ticker in exchange_tickers:
+                if exchange_ticker not in loaded_tickers:
+                    self.stdout.write(self.style.WARNING(f"No data downloaded for ticker {exchange_ticker}. Skipping..."))
+        report_skipped_rows(self, provider, __verbose)
+        self.stdout.write(self.style.SUCCESS(f"\nInserted {inserted}, updated {updated}, left {unchanged} unchanged instances of Rate model."))
+        if unchanged and not (__upsert or __update_conflicts):
+            self.stdout.write(self.style.WARNING(f"{unchanged} rows were already stored and left untouched. "
+                                                 f"Pass --upsert or --conflicts to update them."))
         self.stdout.write(self.style.SUCCESS(f"\nSuccesfully populated the database."))
+        if _profile:
+            report_profile(self, profiler, _profile_report, {name: options.get(name) for name in profiled_options})
 
 
 
@@ -97,6 +203,27 @@ class Command(BaseCommand):
             return interval
         return default_interval
 
+    def verify_pivot_argument(self, pivot):
+        if pivot:
+            if len(pivot) != 3:
+                raise CommandError(f"Received invalid pivot currency symbol '{pivot}'. Pivot symbol must be exactly three characters long.")
+            return pivot.upper()
+        return None
+
+    def verify_batch_size_argument(self, batch_size):
+        if batch_size < 1:
+            raise CommandError(f"Received invalid batch size argument of {batch_size}. Batch size must be a positive number.")
+        return batch_size
+
+    def verify_download_arguments(self, workers, retries, rate_limit):
+        if workers < 1:
+            raise CommandError(f"Received invalid workers argument of {workers}. Number of workers must be a positive number.")
+        if retries < 0:
+            raise CommandError(f"Received invalid retries argument of {retries}. Number of retries can not be negative.")
+        if rate_limit < 0:
+            raise CommandError(f"Received invalid rate limit argument of {rate_limit}. Rate limit can not be negative.")
+        return (workers, retries, rate_limit)
+
     def verify_date_arguments(self, start, end):
         if (start is not None) and (end is not None):
             try:
@@ -115,15 +242,19 @@ def get_existing_currencies_dict():
     return {obj.code: obj for obj in qs}
 
 
-def generate_yfinance_tickers(currency_symbol_list: List):
+def generate_yfinance_tickers(currency_symbol_list: List, pivot: str = None):
     """
     Generates ticker labels for every possible permutation of passed list elements.
+    With pivot passed generates only labels of each currency against the pivot.
     Ticker label format is "<base><quote>=X" (i.e.: "EURUSD=X" for exchanging EURO to US Dollar).
     Parameters:
         currency_symbol_list (list): in format of ["EUR", "USD", ...]
+        pivot (str): (optional) in format of "USD"
     Returns:
-        exchange_tickers (list): in format of ["EURUSD=X", "USDEUR=X", ...]
+        exchange_tickers (list): in format of ["EURUSD=X", "USDEUR=X", ...] (or ["EURUSD=X", "PLNUSD=X", ...] for pivot)
     """
+    if pivot:
+        return [f"{currency_symbol}{pivot}=X" for currency_symbol in currency_symbol_list if currency_symbol != pivot]
     currency_pairs = permutations(currency_symbol_list, r=2)
     exchange_tickers = []
     for currency_pair in currency_pairs:
@@ -131,60 +262,146 @@ def generate_yfinance_tickers(currency_symbol_list: List):
     return exchange_tickers
 
 
-def get_data_from_yfinance(exchange_tickers: List, period=default_period, interval=default_interval, start=None, end=None):
-    return yf.download(exchange_tickers, period=period, interval=interval, start=start, end=end, group_by="ticker", repair=True, keepna=True)
+def get_provider(replay: str = None) -> RateProvider:
+    if replay:
+        return ReplayProvider(replay)
+    return YFinanceProvider()
+
+
+def get_incremental_starts(exchange_tickers: List) -> Dict:
+    """
+    Returns last stored date (UTC) of every ticker's pair, read from LatestRate (None for pairs without rates).
+    Downloads restart from that day (not the next one), so a day stored before it was complete gets updated.
+    Returns:
+        starts (dict): in format of {"EURUSD=X": datetime.date(2024, 1, 5), "PLNUSD=X": None, ...}
+    """
+    stored = dict(LatestRate.objects.filter(pk__in=[ticker[:6] for ticker in exchange_tickers], ts__isnull=False)
+                  .values_list("pair", "ts"))
+    stored = {pair: ts.date() for pair, ts in stored.items()} # timestamps are read in UTC
+    return {ticker: stored.get(ticker[:6]) for ticker in exchange_tickers}
 
 
-def parse_response_from_yfinance(self, response: pd.DataFrame, exchange_tickers: List, update_conflicts: bool, verbose: bool):
+def iter_incremental_batches(self, provider: RateProvider, exchange_tickers: List, **kwargs):
     """
-    Fishes out relevant informations from response dataframe and creates a list of models for bulk creation.
+    Downloads only missing ranges of every ticker in parallel (see currencies.providers.iter_ticker_fetches()).
+    Yields:
+        batch (pd.DataFrame): normalized rows of a ticker, as soon as it is downloaded
+    """
+    starts = get_incremental_starts(exchange_tickers)
+    for exchange_ticker, start in starts.items():
+        if start is not None:
+            self.stdout.write(f"{exchange_ticker}: downloading rates since {start}.")
+    for exchange_ticker, batch, error in iter_ticker_fetches(provider, starts, **kwargs):
+        if error is not None:
+            self.stdout.write(self.style.ERROR(f"{error} Skipping..."))
+        elif batch.empty:
+            self.stdout.write(f"{exchange_ticker}: no new rates.")
+        else:
+            yield batch
+
+
+def store_rate_batch(self, batch: pd.DataFrame, upsert: bool, update_conflicts: bool,
+                     interval: str = default_interval, profiler: NullProfiler = null_profiler) -> Tuple[int, int, int]:
+    """
+    Writes a batch (and refreshes LatestRate and rollups of its pairs) in a single transaction.
+    On PostgreSQL missing yearly partitions of the batch are created first and new rows are loaded with COPY.
+    Without upsert nor update_conflicts rows already stored are skipped (counted as unchanged).
+    Stage "commit" is the time of the transaction itself (and of its on-commit callbacks).
+    Returns:
+        (inserted, updated, unchanged) (tuple): number of rows in each state
+    """
+    ranges = get_frame_ranges(batch)
+    with profiler.stage("commit"), transaction.atomic():
+        with profiler.stage("partitions"):
+            ensure_rate_partitions(ranges.values())
+        if upsert:
+            with profiler.stage("merge"):
+                batch_counts = merge_rate_frame(batch, interval)
+        else:
+            with profiler.stage("instances"):
+                rates = frame_to_rate_instances(batch, interval)
+            if update_conflicts:
+                with profiler.stage("conflicts"):
+                    remove_conflicting_values(self, get_conflict_sets(rates))
+            with profiler.stage("insert"):
+                if update_conflicts:
+                    insert_rates(rates)
+                    batch_counts = (len(batch), 0, 0)
+                else: # rows already stored are left untouched
+                    batch_counts = insert_new_rates(rates)
+        with profiler.stage("latest"):
+            LatestRate.refresh(frame_pairs(batch))
+        with profiler.stage("rollups"):
+            refresh_rollups(ranges)
+    return batch_counts
+
+
+def iter_rate_batches(self, provider_batches: Iterable[pd.DataFrame], batch_size: int,
+                      profiler: NullProfiler = null_profiler):
+    """
+    Streams normalized provider batches in chunks of at most batch_size rows, with currency id columns attached.
+    Currencies met for the first time are created on the way, rows already moved to the rate archive are dropped.
     Parameters:
-        response (pd.DataFrame): dataframe response from yf.download() method
-        exchange_tickers (list): list of tickers in format of ["EURUSD=X", "USDEUR=X", ...]
+        provider_batches (iterable): frames with currencies.ingestion.RATE_COLUMNS (see currencies.providers)
+        batch_size (int): maximal number of rows in a yielded frame (None to keep provider batches whole)
+    Yields:
+        (label, batch) (tuple): ticker label (or number of pairs of a mixed batch) and a frame ready for frame_to_rate_instances()
+    """
+    with profiler.stage("currencies"):
+        existing_currencies_dict = get_existing_currencies_dict()
+    with profiler.stage("archive"):
+        boundaries = get_boundaries()
+    for frame in provider_batches:
+        with profiler.stage("archive"):
+            frame = drop_archived_rows(frame, boundaries)
+        if frame.empty:
+            continue
+        with profiler.stage("currencies"):
+            for currency_symbol in pd.unique(frame[["base", "quote"]].to_numpy().ravel()):
+                if currency_symbol not in existing_currencies_dict:
+                    _, existing_currencies_dict = get_currency_obj(self, currency_symbol, existing_currencies_dict)
+        with profiler.stage("prepare"):
+            frame = attach_currency_ids(frame.copy(), {code: obj.id for code, obj in existing_currencies_dict.items()})
+        step = batch_size or len(frame)
+        for start in range(0, len(frame), step):
+            batch = frame.iloc[start:start+step]
+            tickers = batch["ticker"].unique()
+            yield (tickers[0] if len(tickers) == 1 else f"{len(tickers)} pairs"), batch
+
+
+def report_skipped_rows(self, provider: RateProvider, verbose: bool):
+    """Reports rows the provider dropped for missing rate values (each of them with verbose)."""
+    if not provider.skipped:
+        return
+    skipped = pd.concat(provider.skipped, ignore_index=True)
+    if verbose:
+        for exchange_ticker, timestamp in zip(skipped["ticker"], skipped["timestamp"]):
+            self.stdout.write(f"No rate value found for ticker {exchange_ticker} at {timestamp}. Skipping...")
+    if len(skipped):
+        self.stdout.write(self.style.WARNING(f"Skipped {len(skipped)} rows containing NaN values."))
+
+
+def report_profile(self, profiler: IngestProfiler, report: str = None, options: Dict = None):
+    """Prints the profile summary table, and writes the JSON report when a path is passed."""
+    self.stdout.write("\nProfile:")
+    for line in profiler.format_summary():
+        self.stdout.write(line)
+    if report:
+        profiler.write_report(report, options)
+        self.stdout.write(f"Profile report written to {report}.")
+
+
+def get_conflict_sets(rates: List[Rate]) -> Dict[Tuple[int, int, str], Set[datetime]]:
+    """
+    Returns argument of remove_conflicting_values() matching passed (unsaved) rates.
+    Timestamps are kept per pair, batches of ReplayProvider mix pairs.
     Returns:
-        model_instances (list): list for bulk creation of models
-    """ 
-    existing_currencies_dict = get_existing_currencies_dict()
-    df = response
-    timestamp_col_name = df.index.name # "Date" or "Datetime"
-    model_instances = []
-    skipped = 0
-    # (optional) create sets to delete
-    created_base_currencies = set()
-    created_quote_currencies = set()
-    created_dates = set()
-    time_is_null = timestamp_col_name=="Date"
-    for exchange_ticker in exchange_tickers:
-        ticker_df = df[exchange_ticker][["Open", "Close"]]
-        base_currency_symbol = exchange_ticker[:3]
-        quote_currency_symbol = exchange_ticker[3:6]
-        for timestamp, row in ticker_df.iterrows():
-            ret, _exchange_rate_ = check_rate_for_NaN_values(row)
-            if not ret:
-                if verbose:
-                    self.stdout.write(f"No rate value found for ticker {exchange_ticker} at {timestamp}. Skipping...")
-                skipped+=1
-                continue
-            _base_currency_obj_, existing_currencies_dict = get_currency_obj(self, base_currency_symbol, existing_currencies_dict)
-            _quote_currency_obj_, existing_currencies_dict = get_currency_obj(self, quote_currency_symbol, existing_currencies_dict)
-            (_date_, _time_) = separate_timestamp_values(timestamp, timestamp_col_name)
-            model_instances.append(Rate(date=_date_,
-                                        time=_time_,
-                                        base_currency=_base_currency_obj_,
-                                        quote_currency=_quote_currency_obj_,
-                                        exchange_rate=_exchange_rate_))
-
-            # (optional) add values to delete
-            created_base_currencies.add(_base_currency_obj_)
-            created_quote_currencies.add(_quote_currency_obj_)
-            created_dates.add(_date_)
-
-    # (optional) delete values to update
-    if update_conflicts:
-        remove_conflicting_values(self, created_dates, created_quote_currencies, created_quote_currencies, time_is_null)
-    if skipped:
-        self.stdout.write(self.style.WARNING(f"Skipped {skipped} rows containing NaN values."))
-    return model_instances
+        created_keys (dict): in format of {(base_currency_id, quote_currency_id, granularity): {ts, ...}, ...}
+    """
+    created_keys = defaultdict(set)
+    for rate in rates:
+        created_keys[(rate.base_currency_id, rate.quote_currency_id, rate.granularity)].add(rate.ts)
+    return dict(created_keys)
 
 
 def get_currency_obj(self, searched_currency: str, existing_currencies_dict: Dict) -> Tuple[Currency, List]:
@@ -207,35 +424,26 @@ def get_currency_obj(self, searched_currency: str, existing_currencies_dict: Dic
     return (found_obj, existing_currencies_dict)
 
 
-def separate_timestamp_values(timestamp: pd.Timestamp, timestamp_col_name: str):
-    timestamp = timestamp.to_pydatetime()
-    date = timestamp.date()
-    time = timestamp.time()
-    if (timestamp_col_name=="Date"):
-        return (date, None)
-    return (date, time)
-
-
-def check_rate_for_NaN_values(row):
-    if not pd.isna(row["Close"]):
-        return True, row["Close"]
-    if not pd.isna(row["Open"]):
-        return True, row["Open"]
-    return False, None
-
-
-def remove_conflicting_values(self, 
-                              created_dates: Set, 
-                              created_base_currencies: Set, 
-                              created_quote_currencies: Set,
-                              time_is_null: bool):
-    delete_qs = Rate.objects.filter(date__in=created_dates,
-                                    time__isnull=time_is_null,
-                                    base_currency__in=created_base_currencies,
-                                    quote_currency__in=created_quote_currencies)
-    if (delete_qs):
-        self.stdout.write(self.style.WARNING(f"\nFound {len(delete_qs)} conflicting values in database. Updating with new values."))
-        delete_qs.delete()
+def remove_conflicting_values(self, created_keys: Dict[Tuple[int, int, str], Set[datetime]]):
+    """
+    Deletes stored rates having the same (base, quote, granularity, ts) key as a new rate.
+    Stored rows are read with a ts range scan of every pair and matched in Python (like ingestion.merge_rate_frame()),
+    rows within the range missing from the new rates (i.e. skipped NaN values) are kept.
+    """
+    conditions = Q()
+    for (base_id, quote_id, granularity), timestamps in created_keys.items():
+        conditions |= Q(base_currency_id=base_id, quote_currency_id=quote_id, granularity=granularity,
+                        ts__range=(min(timestamps), max(timestamps)))
+    conflicting_ids = []
+    if created_keys:
+        stored = Rate.objects.filter(conditions).values_list("id", "base_currency_id", "quote_currency_id", "granularity", "ts")
+        conflicting_ids = [rate_id for rate_id, base_id, quote_id, granularity, ts in stored
+                           if ts in created_keys[(base_id, quote_id, granularity)]]
+    deleted = 0
+    for start in range(0, len(conflicting_ids), conflicts_chunk_size):
+        # only rows of the batch keys are deleted, store_rate_batch() refreshes their LatestRate and rollups
+        deleted += Rate.objects.filter(id__in=conflicting_ids[start:start+conflicts_chunk_size]).delete(refresh=False)[0]
+    if deleted:
+        self.stdout.write(self.style.WARNING(f"\nFound {deleted} conflicting values in database. Updating with new values."))
     else:
         self.stdout.write(self.style.WARNING(f"No conflicting values found in database."))
-
@@ -0,0 +1,52 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from currencies.models import LatestRate, Rate
+
+
+class Command(BaseCommand):
+    help = "Rebuild LatestRate table from Rate table or check if both are consistent."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--check", action="store_true",
+                            help="Only compare LatestRate rows with Rate table and report differences (fails if any found).")
+
+    def handle(self, *args, **options):
+        if options.get("check"):
+            differences = find_latest_rate_differences()
+            for pair, stored, expected in differences:
+                self.stdout.write(self.style.WARNING(f"{pair}: stored {stored}, expected {expected}."))
+            if differences:
+                raise CommandError(f"Found {len(differences)} inconsistent pairs in LatestRate table.")
+            self.stdout.write(self.style.SUCCESS("LatestRate table is consistent with Rate table."))
+            return
+
+        with transaction.atomic():
+            LatestRate.objects.all().delete()
+            LatestRate.refresh(get_stored_pairs())
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt LatestRate table with {LatestRate.objects.count()} pairs."))
+
+
+def get_stored_pairs():
+    """Returns every distinct (base_currency_id, quote_currency_id) pair found in Rate table."""
+    return set(Rate.objects.values_list("base_currency_id", "quote_currency_id").distinct())
+
+
+def find_latest_rate_differences():
+    """
+    Compares LatestRate rows with the newest Rate of every pair.
+    Returns:
+        differences (list): (pair, stored, expected) tuples, where stored and expected are (exchange_rate, ts, granularity) or None
+    """
+    stored = {(obj.base_currency_id, obj.quote_currency_id): obj for obj in LatestRate.objects.select_related("base_currency", "quote_currency")}
+    differences = []
+    for base_id, quote_id in get_stored_pairs():
+        latest = Rate.get_latest(base_currency_id=base_id, quote_currency_id=quote_id)
+        expected = (latest.exchange_rate, latest.ts, latest.granularity)
+        obj = stored.pop((base_id, quote_id), None)
+        current = (obj.exchange_rate, obj.ts, obj.granularity) if obj else None
+        if (current != expected) or (obj.pair != latest.currency_pair):
+            differences.append((latest.currency_pair, current, expected))
+    for obj in stored.values():
+        differences.append((obj.pair, (obj.exchange_rate, obj.ts, obj.granularity), None))
+    return differences
@@ -0,0 +1,63 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import Max, Min, Q
+
+from datetime import date, time
+
+from currencies.archive import get_archive_files, get_archive_root, get_stored_pairs
+from currencies.models import Rate, RateRollup
+from currencies.rollups import ROLLUP_INTERVALS, get_bucket_start, get_next_bucket_start, refresh_rollups
+from currencies.timestamps import to_timestamp
+
+
+class Command(BaseCommand):
+    help = "Rebuild daily, weekly and monthly rollups (RateRollup table) from raw and archived rates."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--pairs", type=str,
+                            help="""Pairs to rebuild. Separated by comas without spaces.
+                            Example: EURUSD,USDPLN. Default is every stored pair.""")
+
+    def handle(self, *args, **options):
+        try:
+            pairs = get_stored_pairs(options.get("pairs"))
+        except ValueError as error:
+            raise CommandError(str(error))
+        total = 0
+        for base_id, quote_id, pair in pairs:
+            count = rebuild_pair_rollups(base_id, quote_id, pair)
+            self.stdout.write(f"{pair}: {count} buckets.")
+            total += count
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt {total} rollups of {len(pairs)} pairs."))
+
+
+def rebuild_pair_rollups(base_id: int, quote_id: int, pair: str) -> int:
+    """
+    Recomputes rollups of a pair year by year (archived years included), each year in its own transaction.
+    Buckets of a year are replaced within the transaction recomputing it, so readers never see a year without buckets,
+    and a failed rebuild leaves the previous buckets of years not yet recomputed.
+    Returns:
+        count (int): number of stored buckets
+    """
+    rollups = RateRollup.objects.filter(base_currency_id=base_id, quote_currency_id=quote_id)
+    bounds = (Rate.objects.filter(base_currency_id=base_id, quote_currency_id=quote_id, ts__isnull=False)
+              .aggregate(first=Min("ts"), last=Max("ts")))
+    if bounds["last"] is None:
+        rollups.delete()
+        return 0
+    # archived rates are older than stored ones
+    archived_years = [int(path.stem) for _, path in get_archive_files(get_archive_root(), pair[:3], pair[3:])]
+    first_year, last_year = min([bounds["first"].year, *archived_years]), bounds["last"].year
+    for year in range(first_year, last_year + 1):
+        with transaction.atomic():
+            # weeks crossing the new year are recomputed as a whole by both years
+            refresh_rollups({(base_id, quote_id): (to_timestamp(date(year, 1, 1)),
+                                                   to_timestamp(date(year, 12, 31), time.max))})
+    # buckets outside of the rebuilt years are left from rates deleted meanwhile
+    outside = Q()
+    for interval in ROLLUP_INTERVALS:
+        start = get_bucket_start(to_timestamp(date(first_year, 1, 1)), interval)
+        end = get_next_bucket_start(get_bucket_start(to_timestamp(date(last_year, 12, 31)), interval), interval)
+        outside |= Q(interval=interval, ts__lt=start) | Q(interval=interval, ts__gte=end)
+    rollups.filter(outside).delete()
+    return rollups.count()
@@ -0,0 +1,144 @@
+"""
+Request metrics of this process: latency, database query count and database time per endpoint,
+recorded by currencies.middleware.MetricsMiddleware (opt-in, settings.CURRENCY_METRICS) and served
+on /api/metrics in Prometheus text format. Every worker process counts separately, like cache stats.
+django-ninja 1.3 has no hook around every operation (NinjaAPI.add_decorator() comes with 1.4), so requests are
+timed by a middleware, which also covers the time of the other middlewares, and labelled with the ninja route.
+"""
+import threading
+import time
+
+from bisect import bisect_left
+from collections import defaultdict
+from contextvars import ContextVar
+from typing import List, Tuple
+
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.http import HttpResponse
+from ninja import Router
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+class Histogram:
+    """Prometheus histogram without labels (observations per bucket, cumulated when rendered)."""
+    def __init__(self, buckets: Tuple[float, ...]):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1) # last one is +Inf
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+
+    def render(self, name: str, labels: str) -> List[str]:
+        lines = []
+        cumulative = 0
+        for bound, count in zip([*self.buckets, "+Inf"], self.counts):
+            cumulative += count
+            lines.append(f'{name}_bucket{{{labels},le="{bound}"}} {cumulative}')
+        lines.append(f"{name}_sum{{{labels}}} {self.sum}")
+        lines.append(f"{name}_count{{{labels}}} {cumulative}")
+        return lines
+
+
+class EndpointMetrics:
+    def __init__(self):
+        self.statuses = defaultdict(int) # status code: requests
+        self.duration = Histogram(DURATION_BUCKETS)
+        self.queries = Histogram(QUERY_BUCKETS)
+        self.db_seconds = 0.0
+
+
+class RequestStats:
+    """Database work of the current request, collected by record_query()."""
+    __slots__ = ("queries", "db_seconds")
+
+    def __init__(self):
+        self.queries = 0
+        self.db_seconds = 0.0
+
+
+# set by the middleware, also visible to ORM calls in sync_to_async threads (context is copied)
+current_request = ContextVar("currency_request_stats", default=None)
+_lock = threading.Lock()
+_endpoints = defaultdict(EndpointMetrics) # (method, endpoint): EndpointMetrics
+
+
+def record_query(execute, sql, params, many, context):
+    """Database execute wrapper (see connection.execute_wrapper()), counts queries of the current request."""
+    stats = current_request.get()
+    if stats is None:
+        return execute(sql, params, many, context)
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        stats.queries += 1
+        stats.db_seconds += time.perf_counter() - start
+
+
+def install_query_recorder(sender=None, connection=None, **kwargs):
+    """Adds record_query() to a connection, or to every open one (connection_created receiver)."""
+    for conn in [connection] if connection else connections.all(initialized_only=True):
+        if record_query not in conn.execute_wrappers:
+            conn.execute_wrappers.append(record_query)
+
+
+def enable_query_recording():
+    """
+    Records queries of connections opened from now on (and open ones of this thread).
+    Called by CurrenciesConfig.ready() when metrics are on, by MetricsMiddleware otherwise.
+    """
+    install_query_recorder()
+    connection_created.connect(install_query_recorder, dispatch_uid="currencies.metrics.install_query_recorder")
+
+
+def observe(method: str, endpoint: str, status: int, duration: float, stats: RequestStats):
+    with _lock:
+        metrics = _endpoints[(method, endpoint)]
+        metrics.statuses[status] += 1
+        metrics.duration.observe(duration)
+        metrics.queries.observe(stats.queries)
+        metrics.db_seconds += stats.db_seconds
+
+
+def reset_metrics():
+    with _lock:
+        _endpoints.clear()
+
+
+def escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def render_metrics() -> str:
+    """Every recorded endpoint in Prometheus text exposition format."""
+    requests = ["# HELP currency_api_requests_total Requests served, by endpoint, method and status.",
+                "# TYPE currency_api_requests_total counter"]
+    duration = ["# HELP currency_api_request_duration_seconds Time until the response is returned (streamed bodies excluded).",
+                "# TYPE currency_api_request_duration_seconds histogram"]
+    queries = ["# HELP currency_api_db_queries Database queries per request.",
+               "# TYPE currency_api_db_queries histogram"]
+    db_seconds = ["# HELP currency_api_db_duration_seconds_total Time spent executing database queries.",
+                  "# TYPE currency_api_db_duration_seconds_total counter"]
+    with _lock:
+        for (method, endpoint), metrics in sorted(_endpoints.items()):
+            labels = f'endpoint="{escape(endpoint)}",method="{escape(method)}"'
+            requests.extend(f'currency_api_requests_total{{{labels},status="{status}"}} {count}'
+                            for status, count in sorted(metrics.statuses.items()))
+            duration.extend(metrics.duration.render("currency_api_request_duration_seconds", labels))
+            queries.extend(metrics.queries.render("currency_api_db_queries", labels))
+            db_seconds.append(f"currency_api_db_duration_seconds_total{{{labels}}} {metrics.db_seconds}")
+    return "\n".join([*requests, *duration, *queries, *db_seconds]) + "\n"
+
+
+router = Router()
+
+# /api/metrics (mounted when settings.CURRENCY_METRICS is on)
+@router.get("", include_in_schema=False)
+def metrics(request):
+    return HttpResponse(render_metrics(), content_type=CONTENT_TYPE)
@@ -0,0 +1,49 @@
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+
+from .metrics import RequestStats, current_request, enable_query_recording, observe
+
+
+class MetricsMiddleware:
+    """
+    Records latency, database query count and database time of every request (see currencies.metrics).
+    Requests are labelled with their URL pattern, i.e. "api/currency/<BASE>/<QUOTE>/" for every pair
+    (operation paths of ninja routers), unresolved ones with "unmatched". Serves sync and async requests.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+        enable_query_recording()
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        stats = RequestStats()
+        token = current_request.set(stats)
+        start = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            current_request.reset(token)
+        self.observe(request, response, time.perf_counter() - start, stats)
+        return response
+
+    async def __acall__(self, request):
+        stats = RequestStats()
+        token = current_request.set(stats)
+        start = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            current_request.reset(token)
+        self.observe(request, response, time.perf_counter() - start, stats)
+        return response
+
+    def observe(self, request, response, duration: float, stats: RequestStats):
+        match = getattr(request, "resolver_match", None)
+        observe(request.method, match.route if match else "unmatched", response.status_code, duration, stats)
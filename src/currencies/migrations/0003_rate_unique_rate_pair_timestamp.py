@@ -0,0 +1,32 @@
+# Generated by Django 5.1.3 on 2026-10-18 16:46
+
+from django.db import migrations, models
+from django.db.models import Count, Max
+
+
+def remove_duplicated_rates(apps, schema_editor):
+    """Keeps only the most recently inserted row of every (base, quote, date, time) group."""
+    Rate = apps.get_model("currencies", "Rate")
+    duplicates = (Rate.objects.values("base_currency", "quote_currency", "date", "time")
+                  .annotate(rows=Count("id"), keep_id=Max("id"))
+                  .filter(rows__gt=1))
+    for group in duplicates:
+        Rate.objects.filter(base_currency=group["base_currency"],
+                            quote_currency=group["quote_currency"],
+                            date=group["date"],
+                            time=group["time"]).exclude(id=group["keep_id"]).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('currencies', '0002_remove_rate_timestamp_rate_date_rate_time'),
+    ]
+
+    operations = [
+        migrations.RunPython(remove_duplicated_rates, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='rate',
+            constraint=models.UniqueConstraint(fields=('base_currency', 'quote_currency', 'date', 'time'), name='unique_rate_pair_timestamp'),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 5.1.3 on 2026-10-18 16:46
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('currencies', '0003_rate_unique_rate_pair_timestamp'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='rate',
+            index=models.Index(fields=['base_currency', 'quote_currency', '-date', '-time', 'exchange_rate'], name='rate_pair_latest_idx'),
+        ),
+    ]
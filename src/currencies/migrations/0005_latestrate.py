@@ -0,0 +1,43 @@
+# Generated by Django 5.1.3 on 2026-10-18 17:22
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def populate_latest_rates(apps, schema_editor):
+    Currency = apps.get_model("currencies", "Currency")
+    Rate = apps.get_model("currencies", "Rate")
+    LatestRate = apps.get_model("currencies", "LatestRate")
+    codes = dict(Currency.objects.values_list("id", "code"))
+    pairs = Rate.objects.values_list("base_currency_id", "quote_currency_id").distinct()
+    for base_id, quote_id in pairs:
+        latest = (Rate.objects.filter(base_currency_id=base_id, quote_currency_id=quote_id)
+                  .order_by("-date", "-time").first())
+        LatestRate.objects.create(pair=f"{codes[base_id]}{codes[quote_id]}",
+                                  base_currency_id=base_id,
+                                  quote_currency_id=quote_id,
+                                  exchange_rate=latest.exchange_rate,
+                                  date=latest.date,
+                                  time=latest.time)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('currencies', '0004_rate_pair_latest_idx'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LatestRate',
+            fields=[
+                ('pair', models.CharField(max_length=6, primary_key=True, serialize=False)),
+                ('exchange_rate', models.DecimalField(decimal_places=3, max_digits=10)),
+                ('date', models.DateField(blank=True, null=True)),
+                ('time', models.TimeField(blank=True, null=True)),
+                ('base_currency', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='currencies.currency')),
+                ('quote_currency', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='currencies.currency')),
+            ],
+        ),
+        migrations.RunPython(populate_latest_rates, migrations.RunPython.noop),
+    ]
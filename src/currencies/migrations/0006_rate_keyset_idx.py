@@ -0,0 +1,17 @@
+# Generated by Django 5.1.3 on 2026-10-18 17:25
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('currencies', '0005_latestrate'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='rate',
+            index=models.Index(fields=['date', 'time'], name='rate_keyset_idx'),
+        ),
+    ]
@@ -0,0 +1,89 @@
+# Rates become integers scaled by 10**8: new column is added, filled from the old one, then takes its name.
+
+from django.db import migrations, models
+from django.db.models import F, Value
+from django.db.models.functions import Cast, Round
+
+import currencies.fields
+
+SCALE = 10**8
+
+
+def scale_rates(apps, schema_editor):
+    for model_name in ("Rate", "LatestRate"):
+        model = apps.get_model("currencies", model_name)
+        model.objects.update(exchange_rate_scaled=Cast(Round(F("exchange_rate") * SCALE), models.BigIntegerField()))
+
+
+def unscale_rates(apps, schema_editor):
+    for model_name in ("Rate", "LatestRate"):
+        model = apps.get_model("currencies", model_name)
+        model.objects.update(exchange_rate=Cast(F("exchange_rate_scaled"), models.FloatField()) / Value(float(SCALE)))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('currencies', '0006_rate_keyset_idx'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='rate',
+            name='rate_pair_latest_idx',
+        ),
+        # nullable old columns, so unapplying can re-add them before the values are copied back
+        migrations.AlterField(
+            model_name='rate',
+            name='exchange_rate',
+            field=models.DecimalField(decimal_places=3, max_digits=10, null=True),
+        ),
+        migrations.AlterField(
+            model_name='latestrate',
+            name='exchange_rate',
+            field=models.DecimalField(decimal_places=3, max_digits=10, null=True),
+        ),
+        migrations.AddField(
+            model_name='rate',
+            name='exchange_rate_scaled',
+            field=currencies.fields.FixedPointField(null=True),
+        ),
+        migrations.AddField(
+            model_name='latestrate',
+            name='exchange_rate_scaled',
+            field=currencies.fields.FixedPointField(null=True),
+        ),
+        migrations.RunPython(scale_rates, unscale_rates),
+        migrations.RemoveField(
+            model_name='rate',
+            name='exchange_rate',
+        ),
+        migrations.RemoveField(
+            model_name='latestrate',
+            name='exchange_rate',
+        ),
+        migrations.RenameField(
+            model_name='rate',
+            old_name='exchange_rate_scaled',
+            new_name='exchange_rate',
+        ),
+        migrations.RenameField(
+            model_name='latestrate',
+            old_name='exchange_rate_scaled',
+            new_name='exchange_rate',
+        ),
+        migrations.AlterField(
+            model_name='rate',
+            name='exchange_rate',
+            field=currencies.fields.FixedPointField(),
+        ),
+        migrations.AlterField(
+            model_name='latestrate',
+            name='exchange_rate',
+            field=currencies.fields.FixedPointField(),
+        ),
+        migrations.AddIndex(
+            model_name='rate',
+            index=models.Index(fields=['base_currency', 'quote_currency', '-date', '-time', 'exchange_rate'], name='rate_pair_latest_idx'),
+        ),
+    ]
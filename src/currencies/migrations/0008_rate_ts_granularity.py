@@ -0,0 +1,104 @@
+# date and time columns are merged into a UTC timestamp (ts) plus granularity, existing rows are backfilled in place.
+
+from datetime import timezone
+
+from django.db import migrations, models
+from django.db.models import Case, CharField, DateTimeField, Value, When
+from django.db.models.functions import Cast, Coalesce, Concat, TruncDate, TruncTime
+
+
+def get_ts_expression(vendor):
+    text = Concat(Cast("date", CharField()), Value(" "), Coalesce(Cast("time", CharField()), Value("00:00:00")),
+                  output_field=CharField())
+    if vendor == "sqlite":
+        return text # same text Django writes for UTC datetimes
+    return Cast(text, DateTimeField()) # connections run in UTC
+
+
+def fill_ts(apps, schema_editor):
+    granularity = Case(When(time__isnull=True, then=Value("daily")),
+                       When(time__minute=0, time__second=0, then=Value("hourly")),
+                       default=Value("minute"))
+    for model_name in ("Rate", "LatestRate"):
+        model = apps.get_model("currencies", model_name)
+        model.objects.filter(date__isnull=False).update(ts=get_ts_expression(schema_editor.connection.vendor),
+                                                        granularity=granularity)
+
+
+def fill_date_time(apps, schema_editor):
+    for model_name in ("Rate", "LatestRate"):
+        model = apps.get_model("currencies", model_name)
+        model.objects.filter(ts__isnull=False).update(
+            date=TruncDate("ts", tzinfo=timezone.utc),
+            time=Case(When(granularity="daily", then=Value(None)), default=TruncTime("ts", tzinfo=timezone.utc)))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('currencies', '0007_rate_exchange_rate_fixed_point'),
+    ]
+
+    operations = [
+        migrations.RemoveConstraint(
+            model_name='rate',
+            name='unique_rate_pair_timestamp',
+        ),
+        migrations.RemoveIndex(
+            model_name='rate',
+            name='rate_pair_latest_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='rate',
+            name='rate_keyset_idx',
+        ),
+        migrations.AddField(
+            model_name='rate',
+            name='ts',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='rate',
+            name='granularity',
+            field=models.CharField(choices=[('daily', 'Daily'), ('hourly', 'Hourly'), ('minute', 'Minute')], default='daily', max_length=6),
+        ),
+        migrations.AddField(
+            model_name='latestrate',
+            name='ts',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='latestrate',
+            name='granularity',
+            field=models.CharField(choices=[('daily', 'Daily'), ('hourly', 'Hourly'), ('minute', 'Minute')], default='daily', max_length=6),
+        ),
+        migrations.RunPython(fill_ts, fill_date_time),
+        migrations.RemoveField(
+            model_name='rate',
+            name='date',
+        ),
+        migrations.RemoveField(
+            model_name='rate',
+            name='time',
+        ),
+        migrations.RemoveField(
+            model_name='latestrate',
+            name='date',
+        ),
+        migrations.RemoveField(
+            model_name='latestrate',
+            name='time',
+        ),
+        migrations.AddConstraint(
+            model_name='rate',
+            constraint=models.UniqueConstraint(fields=('base_currency', 'quote_currency', 'granularity', 'ts'), name='unique_rate_pair_timestamp'),
+        ),
+        migrations.AddIndex(
+            model_name='rate',
+            index=models.Index(fields=['base_currency', 'quote_currency', '-ts', 'exchange_rate'], name='rate_pair_latest_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='rate',
+            index=models.Index(fields=['ts'], name='rate_keyset_idx'),
+        ),
+    ]
@@ -0,0 +1,74 @@
+# Generated by Django 5.1.3 on 2026-10-18 17:57
+
+import currencies.fields
+import django.db.models.deletion
+import pandas as pd
+from django.db import migrations, models
+
+# same buckets as currencies.resampling.INTERVAL_RULES
+ROLLUP_RULES = {"1d": "1D", "1wk": "W-MON", "1mo": "MS"}
+
+
+def populate_rollups(apps, schema_editor):
+    # rates already moved to the Parquet archive (archive_rates) are rolled up too, like rebuild_rollups does
+    from currencies.archive import has_archive, read_archive_frame
+    from currencies.fields import RATE_SCALE
+
+    Currency = apps.get_model("currencies", "Currency")
+    Rate = apps.get_model("currencies", "Rate")
+    RateRollup = apps.get_model("currencies", "RateRollup")
+    codes = dict(Currency.objects.values_list("id", "code"))
+    archived = has_archive()
+    pairs = Rate.objects.filter(ts__isnull=False).values_list("base_currency_id", "quote_currency_id").distinct()
+    for base_id, quote_id in pairs:
+        rows = Rate.objects.filter(base_currency_id=base_id, quote_currency_id=quote_id, ts__isnull=False)
+        frame = pd.DataFrame.from_records(list(rows.values_list("ts", "exchange_rate")), columns=["ts", "exchange_rate"])
+        frame = pd.DataFrame({"ts": pd.to_datetime(frame["ts"], utc=True),
+                              "exchange_rate": frame["exchange_rate"].astype("float64")})
+        if archived:
+            archive = read_archive_frame([f"{codes[base_id]}{codes[quote_id]}"])
+            frame = pd.concat([pd.DataFrame({"ts": pd.to_datetime(archive["ts"], utc=True),
+                                             "exchange_rate": archive["exchange_rate"].astype("float64") / RATE_SCALE}),
+                               frame], ignore_index=True)
+        rates = pd.Series(frame["exchange_rate"].to_numpy(), index=pd.DatetimeIndex(frame["ts"])).sort_index()
+        for interval, rule in ROLLUP_RULES.items():
+            grouped = rates.resample(rule, label="left", closed="left")
+            buckets = grouped.ohlc()
+            buckets["mean"] = grouped.mean()
+            buckets["count"] = grouped.count()
+            buckets = buckets[buckets["count"] > 0].rename_axis("ts").reset_index()
+            RateRollup.objects.bulk_create([
+                RateRollup(base_currency_id=base_id, quote_currency_id=quote_id, interval=interval, **bucket)
+                for bucket in buckets.to_dict("records")
+            ], batch_size=5000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('currencies', '0008_rate_ts_granularity'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RateRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('interval', models.CharField(choices=[('1d', 'Daily'), ('1wk', 'Weekly'), ('1mo', 'Monthly')], max_length=3)),
+                ('ts', models.DateTimeField()),
+                ('open', currencies.fields.FixedPointField()),
+                ('high', currencies.fields.FixedPointField()),
+                ('low', currencies.fields.FixedPointField()),
+                ('close', currencies.fields.FixedPointField()),
+                ('mean', currencies.fields.FixedPointField()),
+                ('count', models.PositiveIntegerField()),
+                ('base_currency', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='currencies.currency')),
+                ('quote_currency', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='currencies.currency')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['interval', 'ts'], name='rollup_interval_ts_idx')],
+                'constraints': [models.UniqueConstraint(fields=('base_currency', 'quote_currency', 'interval', 'ts'), name='unique_rollup_pair_interval_ts')],
+            },
+        ),
+        migrations.RunPython(populate_rollups, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,82 @@
+# On PostgreSQL the rate table is rebuilt as a table partitioned by range of ts (a partition per year, UTC),
+# with a BRIN index on ts next to the btree ones. Other databases keep the plain table (see currencies.partitioning).
+# A partitioned table can't have a primary key without its partition key, and ts is NULL for self-exchange rates,
+# so ids are kept unique by their sequence (with a UNIQUE (id, ts) constraint serving id lookups).
+
+from django.db import migrations
+
+TABLE = "currencies_rate"
+COLUMNS = "id, base_currency_id, quote_currency_id, exchange_rate, ts, granularity"
+
+
+def get_years(schema_editor):
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute(f"SELECT EXTRACT(YEAR FROM MIN(ts) AT TIME ZONE 'UTC')::int, "
+                       f"EXTRACT(YEAR FROM MAX(ts) AT TIME ZONE 'UTC')::int FROM {TABLE}")
+        first, last = cursor.fetchone()
+    return [] if first is None else list(range(first, last + 1))
+
+
+def replace_table(schema_editor, partitioned: bool):
+    """Copies every rate to a new table (partitioned or plain), drops the old one and recreates its constraints and indexes."""
+    new_table = f"{TABLE}_new"
+    years = get_years(schema_editor) if partitioned else []
+    statements = [
+        f"""CREATE TABLE {new_table} (
+            id bigserial NOT NULL{"" if partitioned else " PRIMARY KEY"},
+            base_currency_id bigint NOT NULL,
+            quote_currency_id bigint NOT NULL,
+            exchange_rate bigint NOT NULL,
+            ts timestamp with time zone NULL,
+            granularity varchar(6) NOT NULL
+        ){" PARTITION BY RANGE (ts)" if partitioned else ""}""",
+    ]
+    if partitioned:
+        statements.append(f"CREATE TABLE {TABLE}_default PARTITION OF {new_table} DEFAULT")
+        statements.extend(f"CREATE TABLE {TABLE}_y{year} PARTITION OF {new_table} "
+                          f"FOR VALUES FROM ('{year}-01-01 00:00:00+00') TO ('{year + 1}-01-01 00:00:00+00')"
+                          for year in years)
+    statements.extend([
+        f"INSERT INTO {new_table} ({COLUMNS}) SELECT {COLUMNS} FROM {TABLE}",
+        f"DROP TABLE {TABLE} CASCADE",
+        f"ALTER TABLE {new_table} RENAME TO {TABLE}",
+        f"ALTER SEQUENCE {new_table}_id_seq RENAME TO {TABLE}_id_seq",
+        *([] if partitioned else [f"ALTER TABLE {TABLE} RENAME CONSTRAINT {new_table}_pkey TO {TABLE}_pkey"]),
+        f"SELECT setval('{TABLE}_id_seq', COALESCE(MAX(id), 0) + 1, false) FROM {TABLE}",
+        f"ALTER TABLE {TABLE} ADD CONSTRAINT unique_rate_pair_timestamp UNIQUE (base_currency_id, quote_currency_id, granularity, ts)",
+        f"ALTER TABLE {TABLE} ADD CONSTRAINT {TABLE}_base_currency_id_fk FOREIGN KEY (base_currency_id) "
+        f"REFERENCES currencies_currency (id) DEFERRABLE INITIALLY DEFERRED",
+        f"ALTER TABLE {TABLE} ADD CONSTRAINT {TABLE}_quote_currency_id_fk FOREIGN KEY (quote_currency_id) "
+        f"REFERENCES currencies_currency (id) DEFERRABLE INITIALLY DEFERRED",
+        f"CREATE INDEX {TABLE}_quote_currency_id_idx ON {TABLE} (quote_currency_id)",
+        f"CREATE INDEX rate_pair_latest_idx ON {TABLE} (base_currency_id, quote_currency_id, ts DESC, exchange_rate)",
+        f"CREATE INDEX rate_keyset_idx ON {TABLE} (ts)",
+    ])
+    if partitioned:
+        statements.extend([
+            f"ALTER TABLE {TABLE} ADD CONSTRAINT {TABLE}_id_ts_uniq UNIQUE (id, ts)",
+            f"CREATE INDEX rate_ts_brin_idx ON {TABLE} USING brin (ts)",
+        ])
+    for statement in statements:
+        schema_editor.execute(statement)
+
+
+def partition_rates(apps, schema_editor):
+    if schema_editor.connection.vendor == "postgresql":
+        replace_table(schema_editor, partitioned=True)
+
+
+def unpartition_rates(apps, schema_editor):
+    if schema_editor.connection.vendor == "postgresql":
+        replace_table(schema_editor, partitioned=False)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('currencies', '0009_raterollup'),
+    ]
+
+    operations = [
+        migrations.RunPython(partition_rates, unpartition_rates),
+    ]
@@ -1,6 +1,14 @@
-from django.db import models
+from django.db import models, transaction
 from django.http import Http404
 
+from datetime import datetime
+from typing import Dict, Iterable, Optional, Tuple
+
+from .broadcast import publish, rate_message
+from .cache import bump_generation
+from .fields import FixedPointField
+from .timestamps import Granularity, get_granularity, split_timestamp, to_timestamp
+
 # Create your models here.
 class Currency(models.Model):
     # id
@@ -14,34 +22,233 @@ class Currency(models.Model):
         if self.code:
             self.code = self.code.upper()
 
+    @transaction.atomic
     def save(self, *args, **kwargs):
         if self.code:
             self.code = self.code.upper()
         if not self.id: # not existed before
             super().save(*args, **kwargs)
-            # create self-exchange model
+            # create self-exchange model (also creates its LatestRate)
             obj = Currency.objects.get(pk=self.id)
             Rate.objects.create(base_currency=obj,
                                 quote_currency=obj,
                                 exchange_rate=1.0,
-                                date=None,
-                                time=None)
+                                ts=None)
         else:
             super().save(*args, **kwargs)
+            # code might have changed, pair keys have to follow
+            LatestRate.refresh_currency(self.id)
+
+class TimestampMixin:
+    """
+    date and time of a rate derived from its ts and granularity (see currencies.timestamps).
+    Both are still accepted by the constructor, i.e.: Rate(date=date(2024, 1, 2), time=None, ...) is a daily rate.
+    """
+    def __init__(self, *args, **kwargs):
+        if ("date" in kwargs) or ("time" in kwargs):
+            _date_, _time_ = kwargs.pop("date", None), kwargs.pop("time", None)
+            kwargs["ts"] = to_timestamp(_date_, _time_)
+            kwargs.setdefault("granularity", get_granularity(_time_))
+        super().__init__(*args, **kwargs)
+
+    @property
+    def date(self):
+        return split_timestamp(self.ts, self.granularity)[0]
+
+    @property
+    def time(self):
+        return split_timestamp(self.ts, self.granularity)[1]
+
 
-class Rate(models.Model):
+class RateQuerySet(models.QuerySet):
+    def delete(self, refresh: bool = True):
+        """
+        Deletes the rates and recomputes LatestRate and rollups of every pair that lost rows, in one transaction.
+        Pass refresh=False when the caller refreshes those pairs itself (or the rates are only moved, i.e. archived).
+        """
+        if not refresh:
+            return super().delete()
+        with transaction.atomic(using=self.db):
+            ranges = {(base_id, quote_id): (first, last) for base_id, quote_id, first, last
+                      in self.order_by().values_list("base_currency_id", "quote_currency_id")
+                                        .annotate(first=models.Min("ts"), last=models.Max("ts"))}
+            deleted = super().delete()
+            Rate.refresh_pairs(ranges)
+        return deleted
+
+
+class Rate(TimestampMixin, models.Model):
     # id 
     base_currency = models.ForeignKey(Currency, on_delete=models.CASCADE, related_name="base_currency")
     quote_currency = models.ForeignKey(Currency, on_delete=models.CASCADE, related_name="quote_currency")
-    exchange_rate = models.DecimalField(max_digits=10, decimal_places=3)
-    # timestamp = models.DateTimeField()
-    date = models.DateField(null=True, blank=True)
-    time = models.TimeField(null=True, blank=True)
+    exchange_rate = FixedPointField() # Decimal with 8 decimal places, stored as a scaled 64-bit integer
+    ts = models.DateTimeField(null=True, blank=True) # UTC, midnight for daily rates, NULL for self-exchange rates
+    granularity = models.CharField(max_length=6, choices=Granularity.choices, default=Granularity.DAILY)
+
+    objects = RateQuerySet.as_manager()
+
+    class Meta:
+        constraints = [
+            # daily and hourly rates at midnight are different rows
+            models.UniqueConstraint(fields=["base_currency", "quote_currency", "granularity", "ts"],
+                                    name="unique_rate_pair_timestamp"),
+        ]
+        indexes = [
+            # serves get_latest() and ts range scans of a pair: newest row of a pair is the first index entry,
+            # trailing exchange_rate makes it covering (no table lookup, id is the rowid)
+            models.Index(fields=["base_currency", "quote_currency", "-ts", "exchange_rate"],
+                         name="rate_pair_latest_idx"),
+            # serves keyset pagination of unfiltered rates list, ordered by (ts, id), and ts range scans
+            models.Index(fields=["ts"], name="rate_keyset_idx"),
+        ]
 
     @property
     def currency_pair(self):
         return f"{self.base_currency}{self.quote_currency}"
 
+    @transaction.atomic
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        Rate.refresh_pairs({(self.base_currency_id, self.quote_currency_id): (self.ts, self.ts)})
+
+    @transaction.atomic
+    def delete(self, *args, **kwargs):
+        deleted = super().delete(*args, **kwargs)
+        Rate.refresh_pairs({(self.base_currency_id, self.quote_currency_id): (self.ts, self.ts)})
+        return deleted
+
+    @staticmethod
+    def refresh_pairs(ranges: Dict[Tuple[int, int], Tuple[Optional[datetime], Optional[datetime]]]):
+        """
+        Recomputes LatestRate and rollups of pairs whose rates changed. Call it inside the transaction that changed them.
+        Parameters:
+            ranges (dict): in format of {(base_currency_id, quote_currency_id): (first_ts, last_ts), ...},
+                           (None, None) for self-exchange rates (they have no rollups)
+        """
+        LatestRate.refresh(ranges.keys())
+        ranges = {pair: (first, last) for pair, (first, last) in ranges.items() if first is not None}
+        if ranges:
+            # imported here, rollups read archived rates (currencies.archive imports this module)
+            from .rollups import refresh_rollups
+            refresh_rollups(ranges)
+
     @classmethod
     def get_latest(cls, **filters):
-        return cls.objects.filter(**filters).order_by("-date", "-time").first() or None
+        return cls.objects.filter(**filters).order_by("-ts").first() or None
+
+    @classmethod
+    def get_latest_by_codes(cls, base_code: str, quote_code: str):
+        """
+        Resolves currency codes to ids first, so the rate query walks rate_pair_latest_idx without joining Currency.
+        Found currencies are attached to the returned rate (currency_pair does not query them again).
+        """
+        currencies = {obj.code: obj for obj in Currency.objects.filter(code__in=[base_code, quote_code])}
+        if (base_code not in currencies) or (quote_code not in currencies):
+            return None
+        obj = cls.get_latest(base_currency_id=currencies[base_code].id,
+                             quote_currency_id=currencies[quote_code].id)
+        if obj:
+            obj.base_currency = currencies[base_code]
+            obj.quote_currency = currencies[quote_code]
+        return obj
+
+
+class LatestRate(TimestampMixin, models.Model):
+    """
+    Newest Rate of every currency pair, keyed by pair code (i.e.: "EURUSD") for a single primary key lookup.
+    Kept current by Rate.save(), Rate deletes, Currency.save() and fetch_data, rebuilt with the rebuild_latest_rates command.
+    """
+    pair = models.CharField(max_length=6, primary_key=True)
+    base_currency = models.ForeignKey(Currency, on_delete=models.CASCADE, related_name="+")
+    quote_currency = models.ForeignKey(Currency, on_delete=models.CASCADE, related_name="+")
+    exchange_rate = FixedPointField()
+    ts = models.DateTimeField(null=True, blank=True)
+    granularity = models.CharField(max_length=6, choices=Granularity.choices, default=Granularity.DAILY)
+
+    def __str__(self):
+        return f"{self.pair}"
+
+    @property
+    def currency_pair(self):
+        return self.pair
+
+    @classmethod
+    def refresh(cls, pairs: Iterable[Tuple[int, int]]):
+        """
+        Recomputes rows of passed pairs from Rate table. Call it inside the transaction that changed the rates.
+        Also invalidates cached API responses, right away and once more after commit
+        (a request served in between could have cached the old rows again),
+        and pushes pairs whose latest rate changed to subscribers after commit (see currencies.broadcast).
+        Parameters:
+            pairs (iterable): (base_currency_id, quote_currency_id) tuples
+        """
+        pairs = set(pairs)
+        codes = dict(Currency.objects.filter(id__in={currency_id for pair in pairs for currency_id in pair})
+                     .values_list("id", "code"))
+        keys = {f"{codes[base_id]}{codes[quote_id]}" for base_id, quote_id in pairs}
+        previous = {pair: (ts, exchange_rate) for pair, ts, exchange_rate
+                    in cls.objects.filter(pair__in=keys).values_list("pair", "ts", "exchange_rate")}
+        changed = []
+        for base_id, quote_id in pairs:
+            latest = Rate.get_latest(base_currency_id=base_id, quote_currency_id=quote_id)
+            if latest is None:
+                cls.objects.filter(base_currency_id=base_id, quote_currency_id=quote_id).delete()
+                continue
+            obj, _ = cls.objects.update_or_create(pair=f"{codes[base_id]}{codes[quote_id]}",
+                                                  defaults={"base_currency_id": base_id,
+                                                            "quote_currency_id": quote_id,
+                                                            "exchange_rate": latest.exchange_rate,
+                                                            "ts": latest.ts,
+                                                            "granularity": latest.granularity})
+            # backfilled history leaves the latest rate as it was
+            if (obj.ts is not None) and (previous.get(obj.pair) != (obj.ts, obj.exchange_rate)):
+                changed.append(rate_message(obj))
+        bump_generation()
+        transaction.on_commit(bump_generation)
+        transaction.on_commit(lambda: publish(changed))
+
+    @classmethod
+    def refresh_currency(cls, currency_id: int):
+        """Recomputes every pair the currency takes part in (i.e. after its code changed)."""
+        pairs = set(Rate.objects.filter(models.Q(base_currency_id=currency_id) | models.Q(quote_currency_id=currency_id))
+                    .values_list("base_currency_id", "quote_currency_id").distinct())
+        cls.objects.filter(models.Q(base_currency_id=currency_id) | models.Q(quote_currency_id=currency_id)).delete()
+        cls.refresh(pairs)
+
+
+class RollupInterval(models.TextChoices):
+    # same keys as resampling.INTERVAL_RULES
+    DAY = "1d", "Daily"
+    WEEK = "1wk", "Weekly"
+    MONTH = "1mo", "Monthly"
+
+
+class RateRollup(models.Model):
+    """
+    OHLC bucket of a pair (the same as resampling.resample_rates() computes out of raw rates), starting at ts (UTC).
+    Kept current by Rate.save(), Rate deletes and fetch_data, rebuilt with the rebuild_rollups command (see currencies.rollups).
+    """
+    base_currency = models.ForeignKey(Currency, on_delete=models.CASCADE, related_name="+")
+    quote_currency = models.ForeignKey(Currency, on_delete=models.CASCADE, related_name="+")
+    interval = models.CharField(max_length=3, choices=RollupInterval.choices)
+    ts = models.DateTimeField() # bucket start, weeks start on Monday and months on their first day
+    open = FixedPointField()
+    high = FixedPointField()
+    low = FixedPointField()
+    close = FixedPointField()
+    mean = FixedPointField()
+    count = models.PositiveIntegerField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["base_currency", "quote_currency", "interval", "ts"],
+                                    name="unique_rollup_pair_interval_ts"),
+        ]
+        indexes = [
+            # serves rollups of every pair within a ts range
+            models.Index(fields=["interval", "ts"], name="rollup_interval_ts_idx"),
+        ]
+
+    @property
+    def currency_pair(self):
+        return f"{self.base_currency}{self.quote_currency}"
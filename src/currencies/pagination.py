@@ -0,0 +1,178 @@
+"""
+Keyset (cursor) pagination of rates ordered by (ts, id), NULLs first.
+Pages are read with values_list() and currency codes are mapped from a single Currency query,
+so serializing a page never touches Currency per row.
+Rates are read as their stored scaled integers and divided once (no Decimal per row).
+"""
+import base64
+import heapq
+import json
+
+from itertools import islice
+
+from datetime import datetime, timezone
+from typing import AsyncIterator, Iterable, Iterator, List, Optional, Tuple
+
+from asgiref.sync import sync_to_async
+from django.db.models import F, Q, QuerySet
+
+from .fields import RATE_SCALE, scaled
+from .models import Currency
+from .timestamps import split_timestamp
+
+KEYSET_FIELDS = ["ts", "id"]
+KEYSET_ORDERING = [F("ts").asc(nulls_first=True), F("id").asc()]
+RATE_ROW_FIELDS = ["id", "base_currency_id", "quote_currency_id", "ts", "granularity", scaled("exchange_rate")]
+MIN_TS = datetime.min.replace(tzinfo=timezone.utc)
+default_page_size = 100
+max_page_size = 1000
+
+
+def encode_cursor(row: dict) -> str:
+    """Opaque cursor pointing right after the passed row."""
+    key = [row["ts"].isoformat() if row["ts"] else None, row["id"]]
+    return base64.urlsafe_b64encode(json.dumps(key).encode()).decode()
+
+
+def decode_cursor(cursor: str) -> Tuple[Optional[datetime], int]:
+    """Raises ValueError for cursors not created by encode_cursor()."""
+    try:
+        ts, _id_ = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        ts = datetime.fromisoformat(ts) if ts else None
+        if (ts is not None) and (ts.tzinfo is None):
+            raise ValueError
+        return (ts, int(_id_))
+    except (TypeError, ValueError, UnicodeDecodeError) as error:
+        raise ValueError(f"Invalid cursor '{cursor}'.") from error
+
+
+def keyset_filter(after: Tuple, fields: List[str] = KEYSET_FIELDS) -> Q:
+    """
+    Builds a filter for rows ordered strictly after the `after` key (NULLs sort first).
+    (ts, id) > (t, i) expands to: ts > t OR (ts = t AND id > i)
+    """
+    field, value = fields[0], after[0]
+    if len(fields) == 1:
+        return Q(**{f"{field}__gt": value})
+    rest = keyset_filter(after[1:], fields[1:])
+    if value is None:
+        return (Q(**{f"{field}__isnull": True}) & rest) | Q(**{f"{field}__isnull": False})
+    return Q(**{f"{field}__gt": value}) | (Q(**{field: value}) & rest)
+
+
+def keyset_key(row: dict) -> Tuple:
+    """Python sort key matching KEYSET_ORDERING."""
+    return (row["ts"] is not None, row["ts"] or MIN_TS, row["id"])
+
+
+def iter_rate_rows(qs: QuerySet, chunk_size: Optional[int] = None) -> Iterator[dict]:
+    """
+    Yields rates of a queryset as dictionaries (with "currency_pair", "ts" and derived "date" and "time")
+    without instantiating models.
+    With chunk_size passed rows are streamed from a server-side cursor.
+    """
+    codes = dict(Currency.objects.values_list("id", "code"))
+    rows = qs.values_list(*RATE_ROW_FIELDS)
+    if chunk_size:
+        rows = rows.iterator(chunk_size=chunk_size)
+    for _id_, base_id, quote_id, ts, granularity, scaled_rate in rows:
+        _date_, _time_ = split_timestamp(ts, granularity)
+        yield {"id": _id_,
+               "currency_pair": f"{codes[base_id]}{codes[quote_id]}",
+               "ts": ts,
+               "date": _date_,
+               "time": _time_,
+               "exchange_rate": scaled_rate / RATE_SCALE}
+
+
+async def aiter_rate_rows(qs: QuerySet, chunk_size: Optional[int] = None) -> AsyncIterator[dict]:
+    """
+    Async version of iter_rate_rows() (rows are always fetched in chunks).
+    QuerySet.aiterator() can't be used, values_list() iterables run the query as soon as they are created,
+    so the lazy sync iterator is advanced chunk by chunk in the database thread instead.
+    """
+    chunk_size = chunk_size or 2000
+    async for row in aiterate(iter_rate_rows(qs, chunk_size=chunk_size), chunk_size):
+        yield row
+
+
+async def aiterate(rows: Iterator, chunk_size: int = 2000) -> AsyncIterator:
+    """Turns a blocking iterator (database cursor, archive files, ...) into an async one, advanced chunk by chunk in a thread."""
+    next_chunk = sync_to_async(lambda: list(islice(rows, chunk_size)))
+    while True:
+        chunk = await next_chunk()
+        for row in chunk:
+            yield row
+        if len(chunk) < chunk_size:
+            break
+
+
+def merge_rows(*rows: Iterable[dict]) -> Iterator[dict]:
+    """Merges iterables of rows ordered by the keyset into one ordered iterator (i.e.: archived and live rates)."""
+    return heapq.merge(*rows, key=keyset_key)
+
+
+async def amerge_rows(first: AsyncIterator[dict], second: AsyncIterator[dict]) -> AsyncIterator[dict]:
+    """Async version of merge_rows() for two async iterators."""
+    first_row = await anext(first, None)
+    async for second_row in second:
+        while (first_row is not None) and (keyset_key(first_row) < keyset_key(second_row)):
+            yield first_row
+            first_row = await anext(first, None)
+        yield second_row
+    while first_row is not None:
+        yield first_row
+        first_row = await anext(first, None)
+
+
+def order_rates(qs: QuerySet, after: Optional[Tuple] = None) -> QuerySet:
+    """Orders a Rate queryset by the keyset, optionally starting after a decoded cursor."""
+    if after is not None:
+        qs = qs.filter(keyset_filter(after))
+    return qs.order_by(*KEYSET_ORDERING)
+
+
+def paginate_rates(qs: QuerySet, after: Optional[Tuple], limit: int, archived: Iterable[dict] = ()) -> dict:
+    """
+    Returns a page of rates ordered by the keyset.
+    Parameters:
+        archived (iterable): (optional) archived rows after the cursor in keyset order, merged into the page
+    Returns:
+        page (dict): in format of {"items": [...], "next_cursor": "..." or None}
+    """
+    rows = iter_rate_rows(order_rates(qs, after)[:limit+1])
+    return make_page(list(islice(merge_rows(archived, rows), limit+1)), limit)
+
+
+async def apaginate_rates(qs: QuerySet, after: Optional[Tuple], limit: int,
+                          archived: Optional[AsyncIterator[dict]] = None) -> dict:
+    """Async version of paginate_rates()."""
+    rows = [row async for row in aiter_rate_rows(order_rates(qs, after)[:limit+1], chunk_size=limit+1)]
+    if archived is not None:
+        archived_rows = []
+        async for row in archived:
+            archived_rows.append(row)
+            if len(archived_rows) > limit:
+                break
+        rows = list(islice(merge_rows(archived_rows, rows), limit+1))
+    return make_page(rows, limit)
+
+
+def order_rows(rows: Iterable[dict], after: Optional[Tuple] = None) -> List[dict]:
+    """Same as order_rates() for rows computed in Python (i.e.: triangulated ones)."""
+    rows = sorted(rows, key=keyset_key)
+    if after is not None:
+        after_key = keyset_key({"ts": after[0], "id": after[1]})
+        rows = [row for row in rows if keyset_key(row) > after_key]
+    return rows
+
+
+def paginate_rows(rows: Iterable[dict], after: Optional[Tuple], limit: int) -> dict:
+    """Same as paginate_rates() for rows computed in Python (i.e.: triangulated ones)."""
+    return make_page(order_rows(rows, after)[:limit+1], limit)
+
+
+def make_page(rows: List[dict], limit: int) -> dict:
+    """Expects up to limit+1 rows, the extra one only tells if a next page exists."""
+    next_cursor = encode_cursor(rows[limit-1]) if len(rows) > limit else None
+    return {"items": rows[:limit], "next_cursor": next_cursor}
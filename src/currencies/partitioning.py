@@ -0,0 +1,66 @@
+"""
+Yearly range partitions of the Rate table on PostgreSQL (created by migration 0010_rate_partitioning).
+Rates are partitioned by ts, a partition per calendar year (UTC) named i.e. currencies_rate_y2024, and a default
+partition holding self-exchange rates (NULL ts) and years without a partition of their own yet.
+Every partition has a BRIN index on ts besides the btree ones, rates are appended in time order so a few index
+pages summarize a whole year. Other databases keep a plain table, every function here is a no-op for them.
+"""
+from datetime import datetime, timezone
+from typing import Iterable, List, Optional, Set, Tuple
+
+from django.db import DEFAULT_DB_ALIAS, connections
+
+from .models import Rate
+
+
+def get_partition_name(year: int) -> str:
+    return f"{Rate._meta.db_table}_y{year}"
+
+
+def get_partition_years(using: str = DEFAULT_DB_ALIAS) -> Optional[Set[int]]:
+    """Years having a partition, None when the Rate table is not partitioned (i.e. on SQLite)."""
+    connection = connections[using]
+    if connection.vendor != "postgresql":
+        return None
+    table = Rate._meta.db_table
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT relkind FROM pg_class WHERE oid = to_regclass(%s)", [table])
+        row = cursor.fetchone()
+        if (row is None) or (row[0] != "p"):
+            return None
+        cursor.execute("SELECT child.relname FROM pg_inherits JOIN pg_class child ON child.oid = pg_inherits.inhrelid "
+                       "WHERE pg_inherits.inhparent = to_regclass(%s)", [table])
+        names = [name for name, in cursor.fetchall()]
+    prefix = f"{table}_y"
+    return {int(name[len(prefix):]) for name in names if name.startswith(prefix) and name[len(prefix):].isdigit()}
+
+
+def ensure_rate_partitions(ranges: Iterable[Tuple[datetime, datetime]], using: str = DEFAULT_DB_ALIAS) -> List[int]:
+    """
+    Creates partitions of every year within passed (first, last) ts ranges that doesn't have one yet.
+    Rows of those years already in the default partition are moved to the new partition before it is attached.
+    Call it in the transaction writing the rates (DDL is transactional on PostgreSQL).
+    Parameters:
+        ranges (iterable): i.e. values of rollups.get_frame_ranges()
+    Returns:
+        years (list): years whose partition was created
+    """
+    years = {year for first, last in ranges
+             for year in range(first.astimezone(timezone.utc).year, last.astimezone(timezone.utc).year + 1)}
+    if not years:
+        return []
+    existing = get_partition_years(using)
+    if existing is None:
+        return []
+    table = Rate._meta.db_table
+    missing = sorted(years - existing)
+    with connections[using].cursor() as cursor:
+        for year in missing:
+            partition = get_partition_name(year)
+            start, end = f"'{year}-01-01 00:00:00+00'", f"'{year + 1}-01-01 00:00:00+00'"
+            cursor.execute(f"CREATE TABLE {partition} (LIKE {table} INCLUDING DEFAULTS)")
+            cursor.execute(f"WITH moved AS (DELETE FROM {table}_default WHERE ts >= {start} AND ts < {end} RETURNING *) "
+                           f"INSERT INTO {partition} SELECT * FROM moved")
+            # matching indexes (btree and BRIN) and constraints of the partitioned table are created on attach
+            cursor.execute(f"ALTER TABLE {table} ATTACH PARTITION {partition} FOR VALUES FROM ({start}) TO ({end})")
+    return missing
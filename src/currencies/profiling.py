@@ -0,0 +1,218 @@
+"""
+Profile of an ingest run (fetch_data --profile): wall time, SQL queries and peak traced memory (tracemalloc)
+of every stage, rows stored per ticker. Stages may be nested, time and queries of a stage exclude its nested stages.
+Stages of download workers (--incremental) run in parallel with the main thread, their times are summed over workers.
+Ingest functions take NullProfiler (no overhead) unless a run is profiled.
+"""
+import cProfile
+import json
+import threading
+import time
+import tracemalloc
+
+from collections import defaultdict
+from contextlib import contextmanager, nullcontext
+from datetime import datetime, timezone
+from typing import Iterable, Iterator, List, Optional
+
+import pandas as pd
+
+from django.db import DEFAULT_DB_ALIAS, connections
+
+
+class NullProfiler:
+    """Profiler doing nothing, default of every ingest function."""
+    def run(self, dump: Optional[str] = None, using: str = DEFAULT_DB_ALIAS):
+        return nullcontext(self)
+
+    def stage(self, name: str):
+        return nullcontext()
+
+    def iterate(self, name: str, iterable: Iterable) -> Iterable:
+        return iterable
+
+    def count_rows(self, batch: pd.DataFrame):
+        pass
+
+
+null_profiler = NullProfiler()
+
+
+class StageStats:
+    def __init__(self):
+        self.calls = 0
+        self.seconds = 0.0
+        self.queries = 0
+        self.peak_memory = 0 # bytes
+
+
+class Frame:
+    """A running stage."""
+    __slots__ = ("stats", "child_seconds", "peak_memory")
+
+    def __init__(self, stats: StageStats):
+        self.stats = stats
+        self.child_seconds = 0.0
+        self.peak_memory = 0
+
+
+class IngestProfiler(NullProfiler):
+    def __init__(self):
+        self.stages = {} # name: StageStats, in order of first use
+        self.rows = defaultdict(int) # ticker: rows
+        self.seconds = 0.0
+        self.queries = 0
+        self.peak_memory = 0
+        self.started = None
+        self._attributed_seconds = 0.0 # exclusive time of stages of the thread calling run()
+        self._thread = None
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._open = [] # frames of every thread, each gets the peak traced memory seen while it runs
+
+    def _stack(self) -> List[Frame]:
+        if not hasattr(self._local, "stack"):
+            self._local.stack = []
+        return self._local.stack
+
+    def _fold_peak(self):
+        """Folds the traced memory peak since the last reset into every running stage (called with the lock held)."""
+        if not tracemalloc.is_tracing():
+            return
+        peak = tracemalloc.get_traced_memory()[1]
+        for frame in self._open:
+            frame.peak_memory = max(frame.peak_memory, peak)
+        self.peak_memory = max(self.peak_memory, peak)
+        tracemalloc.reset_peak()
+
+    def record_query(self, execute, sql, params, many, context):
+        """Database execute wrapper (see connection.execute_wrapper()), counts queries of the innermost stage."""
+        stack = self._stack()
+        self.queries += 1
+        if stack:
+            stack[-1].stats.queries += 1
+        return execute(sql, params, many, context)
+
+    @contextmanager
+    def run(self, dump: Optional[str] = None, using: str = DEFAULT_DB_ALIAS):
+        """
+        Profiles the block: traces memory allocations and counts queries on the connection.
+        Parameters:
+            dump (str): (optional) path to write cProfile stats of the block to (readable by pstats, snakeviz, ...)
+            using (str): database alias whose queries are counted
+        """
+        started_tracing = not tracemalloc.is_tracing()
+        if started_tracing:
+            tracemalloc.start()
+        tracemalloc.reset_peak()
+        profile = cProfile.Profile() if dump else None
+        self.started = datetime.now(timezone.utc)
+        self._thread = threading.get_ident()
+        start = time.perf_counter()
+        try:
+            with connections[using].execute_wrapper(self.record_query):
+                if profile:
+                    profile.enable()
+                try:
+                    yield self
+                finally:
+                    if profile:
+                        profile.disable()
+        finally:
+            self.seconds += time.perf_counter() - start
+            with self._lock:
+                self._fold_peak()
+            if started_tracing:
+                tracemalloc.stop()
+            if profile:
+                profile.dump_stats(dump)
+
+    @contextmanager
+    def stage(self, name: str):
+        stack = self._stack()
+        with self._lock:
+            stats = self.stages.setdefault(name, StageStats())
+            frame = Frame(stats)
+            self._fold_peak()
+            self._open.append(frame)
+        stack.append(frame)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - start
+            stack.pop()
+            if stack:
+                stack[-1].child_seconds += seconds
+            with self._lock:
+                self._fold_peak()
+                self._open.remove(frame)
+                stats.calls += 1
+                stats.seconds += seconds - frame.child_seconds
+                stats.peak_memory = max(stats.peak_memory, frame.peak_memory)
+                if threading.get_ident() == self._thread:
+                    self._attributed_seconds += seconds - frame.child_seconds
+
+    def iterate(self, name: str, iterable: Iterable) -> Iterator:
+        """Yields items of iterable, every step (i.e. a read of a lazy generator) profiled as the stage."""
+        iterator = iter(iterable)
+        while True:
+            with self.stage(name):
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    return
+            yield item
+
+    def count_rows(self, batch: pd.DataFrame):
+        for ticker, rows in batch["ticker"].value_counts(sort=False).items():
+            self.rows[ticker] += rows
+
+    def get_report(self, options: Optional[dict] = None) -> dict:
+        """
+        Returns:
+            report (dict): JSON serializable profile, "other" stage is the time of the main thread outside any stage
+        """
+        stages = [{"name": name, "calls": stats.calls, "seconds": stats.seconds, "queries": stats.queries,
+                   "peak_memory": stats.peak_memory} for name, stats in self.stages.items()]
+        stages.append({"name": "other", "calls": None, "seconds": max(self.seconds - self._attributed_seconds, 0.0),
+                       "queries": self.queries - sum(stats.queries for stats in self.stages.values()), "peak_memory": None})
+        return {
+            "started": self.started and self.started.isoformat(),
+            "options": options or {},
+            "seconds": self.seconds,
+            "queries": self.queries,
+            "peak_memory": self.peak_memory,
+            "rows": sum(self.rows.values()),
+            "rows_per_ticker": dict(sorted(self.rows.items())),
+            "stages": stages,
+        }
+
+    def write_report(self, path: str, options: Optional[dict] = None):
+        with open(path, "w") as file:
+            json.dump(self.get_report(options), file, indent=2, default=str)
+
+    def format_summary(self) -> List[str]:
+        """Lines of a table of every stage (and totals), followed by rows per ticker."""
+        report = self.get_report()
+        lines = [f"{'stage':<16}{'calls':>8}{'seconds':>12}{'share':>8}{'queries':>10}{'peak memory':>14}"]
+        for stage in report["stages"]:
+            share = stage["seconds"] / report["seconds"] if report["seconds"] else 0.0
+            calls = "" if stage["calls"] is None else stage["calls"]
+            peak_memory = "" if stage["peak_memory"] is None else format_bytes(stage["peak_memory"])
+            lines.append(f"{stage['name']:<16}{calls:>8}{stage['seconds']:>12.3f}{share:>8.1%}{stage['queries']:>10}{peak_memory:>14}")
+        lines.append(f"{'total':<16}{'':>8}{report['seconds']:>12.3f}{'':>8}{report['queries']:>10}"
+                     f"{format_bytes(report['peak_memory']):>14}")
+        lines.append("")
+        lines.append(f"{'ticker':<16}{'rows':>8}")
+        lines.extend(f"{ticker:<16}{rows:>8}" for ticker, rows in report["rows_per_ticker"].items())
+        lines.append(f"{'total':<16}{report['rows']:>8}")
+        return lines
+
+
+def format_bytes(size: int) -> str:
+    for unit in ["B", "KiB", "MiB"]:
+        if size < 1024:
+            return f"{size:.0f} {unit}" if unit == "B" else f"{size:.1f} {unit}"
+        size /= 1024
+    return f"{size:.1f} GiB"
@@ -0,0 +1,263 @@
+"""
+Sources of exchange rates for the fetch_data command.
+Every provider yields normalized batches: frames with currencies.ingestion.RATE_COLUMNS
+(ticker, base, quote, date, time, exchange_rate), one row per (pair, timestamp, rate), whatever layout the source uses.
+    YFinanceProvider - yfinance API (FrameProvider serves a frame in the same layout, for tests)
+    ReplayProvider - CSV/Parquet dumps on disk, i.e.: exports of /api/currency/rates/?format=csv
+"""
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+
+from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import date
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import yfinance as yf
+from yfinance.exceptions import YFPricesMissingError
+
+from .ingestion import RATE_COLUMNS, normalize_yfinance_response, split_response_index
+from .profiling import null_profiler
+
+default_workers = 4
+default_retries = 3
+default_backoff = 1.0 # seconds, doubled after every failed attempt
+default_rate_limit = 2.0 # requests per second, shared by all workers
+default_replay_chunk_size = 100_000
+daily_intervals = ["1d", "5d", "1wk", "1mo", "3mo"]
+
+
+class ProviderError(Exception):
+    """Download failed in a way worth retrying (network, throttling, ...)."""
+
+
+class RateProvider(ABC):
+    def __init__(self):
+        # frames with ["ticker", "timestamp"] columns of rows dropped for missing rate
+        self.skipped = []
+        # stages of downloads and parsing are timed on it (see currencies.profiling, fetch_data --profile)
+        self.profiler = null_profiler
+
+    @abstractmethod
+    def iter_batches(self, exchange_tickers: List[str], period: Optional[str] = None, interval: str = "1d",
+                     start=None, end=None) -> Iterator[pd.DataFrame]:
+        """
+        Yields normalized batches of passed tickers. Tickers without data are just missing from the batches.
+        Parameters:
+            exchange_tickers (list): in format of ["EURUSD=X", "USDEUR=X", ...]
+            period, interval, start, end: same meaning as fetch_data arguments (start inclusive, end exclusive)
+        """
+
+    def fetch_ticker(self, exchange_ticker: str, period: Optional[str] = None, interval: str = "1d",
+                     start=None, end=None) -> pd.DataFrame:
+        """
+        Returns normalized rows of a single ticker, has to be safe to call from several threads at once.
+        Raises ProviderError for failures worth retrying, an empty range is an empty frame.
+        """
+        batches = list(self.iter_batches([exchange_ticker], period=period, interval=interval, start=start, end=end))
+        return pd.concat(batches, ignore_index=True) if batches else pd.DataFrame(columns=RATE_COLUMNS)
+
+
+class YFinanceProvider(RateProvider):
+    def download(self, exchange_tickers, period=None, interval="1d", start=None, end=None) -> pd.DataFrame:
+        """Returns response of yf.download(group_by="ticker") for every ticker at once."""
+        return yf.download(exchange_tickers, period=period, interval=interval, start=start, end=end,
+                           group_by="ticker", repair=True, keepna=True)
+
+    def download_ticker(self, exchange_ticker, period=None, interval="1d", start=None, end=None) -> pd.DataFrame:
+        """Same as download() for a single ticker, safe to run in parallel (yf.download() keeps state in module globals)."""
+        try:
+            history = yf.Ticker(exchange_ticker).history(period=period, interval=interval, start=start, end=end,
+                                                         repair=True, keepna=True, raise_errors=True)
+        except YFPricesMissingError: # nothing in the requested range
+            return pd.DataFrame()
+        except Exception as error:
+            raise ProviderError(f"Download of {exchange_ticker} failed: {error}") from error
+        if history.index.name == "Date":
+            history.index = history.index.tz_localize(None) # same as yf.download() does for daily data
+        return pd.concat({exchange_ticker: history[["Open", "Close"]]}, axis=1, names=["Ticker", "Price"])
+
+    def iter_batches(self, exchange_tickers, period=None, interval="1d", start=None, end=None):
+        with self.profiler.stage("download"):
+            response = self.download(exchange_tickers, period=period, interval=interval, start=start, end=end)
+        yield from self.normalize(response, exchange_tickers)
+
+    def fetch_ticker(self, exchange_ticker, period=None, interval="1d", start=None, end=None):
+        with self.profiler.stage("download"):
+            response = self.download_ticker(exchange_ticker, period=period, interval=interval, start=start, end=end)
+        batches = list(self.normalize(response, [exchange_ticker]))
+        return batches[0] if batches else pd.DataFrame(columns=RATE_COLUMNS)
+
+    def normalize(self, response: pd.DataFrame, exchange_tickers: List[str]) -> Iterator[pd.DataFrame]:
+        """
+        Yields a normalized batch per downloaded ticker of a yfinance response (see normalize_yfinance_response()).
+        Column groups are normalized one ticker at a time, so besides the response only the batch being stored is held.
+        """
+        downloaded_tickers = set(response.columns.get_level_values(0)) if len(response.columns) else set()
+        exchange_tickers = [ticker for ticker in exchange_tickers if ticker in downloaded_tickers]
+        if not exchange_tickers:
+            return
+        with self.profiler.stage("parse"):
+            index_parts = split_response_index(response.index)
+        for exchange_ticker in exchange_tickers:
+            with self.profiler.stage("parse"):
+                frame, skipped = normalize_yfinance_response(response[[exchange_ticker]], [exchange_ticker], index_parts)
+            self.skipped.append(skipped)
+            if not frame.empty:
+                yield frame
+
+
+class FrameProvider(YFinanceProvider):
+    """Serves slices of a frame already in yf.download(group_by="ticker") layout (tests, synthetic benchmarks)."""
+    def __init__(self, response: pd.DataFrame):
+        super().__init__()
+        self.response = response
+        self.calls = []
+
+    def download(self, exchange_tickers, period=None, interval="1d", start=None, end=None):
+        self.calls.append((tuple(exchange_tickers), start, end))
+        frame = self.response.loc[:, self.response.columns.get_level_values(0).isin(exchange_tickers)]
+        if start is not None:
+            frame = frame[frame.index >= pd.Timestamp(start)]
+        if end is not None:
+            frame = frame[frame.index < pd.Timestamp(end)]
+        return frame
+
+    def download_ticker(self, exchange_ticker, period=None, interval="1d", start=None, end=None):
+        return self.download([exchange_ticker], period=period, interval=interval, start=start, end=end)
+
+
+class ReplayProvider(RateProvider):
+    """
+    Replays rates from CSV or Parquet files (a single file or every *.csv/*.parquet file of a directory),
+    read in chunks of chunk_size rows. Two column layouts are accepted:
+        pair, timestamp, rate - time of day (UTC) is kept only for intraday intervals (see daily_intervals)
+        currency_pair, date, time, exchange_rate - layout of CSV exports, empty time for daily rows
+    Only pairs of the requested tickers within [start, end) are yielded, period is ignored.
+    Parquet files need pyarrow (optional dependency).
+    """
+    def __init__(self, path, chunk_size: int = default_replay_chunk_size):
+        super().__init__()
+        self.path = Path(path)
+        self.chunk_size = chunk_size
+        if self.path.is_dir():
+            self.files = sorted(file for file in self.path.iterdir() if file.suffix in (".csv", ".parquet"))
+        elif self.path.exists():
+            self.files = [self.path]
+        else:
+            raise ProviderError(f"Replay source {self.path} does not exist.")
+
+    def iter_batches(self, exchange_tickers, period=None, interval="1d", start=None, end=None):
+        pairs = {ticker[:6] for ticker in exchange_tickers}
+        start = pd.Timestamp(start).date() if start is not None else None
+        end = pd.Timestamp(end).date() if end is not None else None
+        for file in self.files:
+            for chunk in self.profiler.iterate("read", self.read_chunks(file)):
+                with self.profiler.stage("parse"):
+                    frame = replay_chunk_to_rate_frame(chunk, daily=interval in daily_intervals)
+                    mask = frame["ticker"].str[:6].isin(pairs).to_numpy()
+                    if start is not None:
+                        mask &= (frame["date"] >= start).to_numpy()
+                    if end is not None:
+                        mask &= (frame["date"] < end).to_numpy()
+                    frame = frame[mask]
+                if not frame.empty:
+                    yield frame.reset_index(drop=True)
+
+    def read_chunks(self, file: Path) -> Iterator[pd.DataFrame]:
+        if file.suffix == ".parquet":
+            try:
+                import pyarrow.parquet as pq
+            except ImportError:
+                raise ProviderError(f"Reading {file} requires pyarrow, install it with: pip install pyarrow")
+            for record_batch in pq.ParquetFile(file).iter_batches(batch_size=self.chunk_size):
+                yield record_batch.to_pandas()
+        else:
+            yield from pd.read_csv(file, chunksize=self.chunk_size, dtype={"pair": str, "currency_pair": str,
+                                                                           "date": str, "time": str})
+
+
+def replay_chunk_to_rate_frame(chunk: pd.DataFrame, daily: bool) -> pd.DataFrame:
+    """
+    Converts a chunk of a replay file (either layout of ReplayProvider) to a normalized batch, rows without rate are dropped.
+    """
+    if "timestamp" in chunk.columns:
+        pairs, rates = chunk["pair"], chunk["rate"]
+        timestamps = pd.to_datetime(chunk["timestamp"], utc=True) # naive timestamps are UTC already
+        dates = timestamps.dt.date.to_numpy(dtype=object)
+        times = np.full(len(chunk), None, dtype=object) if daily else timestamps.dt.time.to_numpy(dtype=object)
+    else:
+        pairs, rates = chunk["currency_pair"], chunk["exchange_rate"]
+        dates = pd.to_datetime(chunk["date"]).dt.date.to_numpy(dtype=object)
+        parsed_times = pd.to_datetime(chunk["time"], format="%H:%M:%S", errors="coerce")
+        times = np.where(parsed_times.isna(), None, parsed_times.dt.time.to_numpy(dtype=object))
+    pairs = pairs.astype(str).str.upper()
+    rates = pd.to_numeric(rates, errors="coerce").to_numpy(dtype="float64")
+    valid = ~np.isnan(rates)
+    pairs = pairs.to_numpy(dtype=object)[valid]
+    return pd.DataFrame({
+        "ticker": [f"{pair}=X" for pair in pairs],
+        "base": [pair[:3] for pair in pairs],
+        "quote": [pair[3:6] for pair in pairs],
+        "date": dates[valid],
+        "time": times[valid],
+        "exchange_rate": rates[valid],
+    }, columns=RATE_COLUMNS)
+
+
+class RateLimiter:
+    """Spaces calls of every thread sharing the limiter at least 1/per_second apart (no limit for 0 or None)."""
+    def __init__(self, per_second: Optional[float]):
+        self.interval = 1 / per_second if per_second else 0.0
+        self.next_call = 0.0
+        self.lock = threading.Lock()
+
+    def wait(self):
+        with self.lock:
+            now = time.monotonic()
+            delay = self.next_call - now
+            self.next_call = max(now, self.next_call) + self.interval
+        if delay > 0:
+            time.sleep(delay)
+
+
+def fetch_with_retry(provider: RateProvider, exchange_ticker: str, limiter: RateLimiter,
+                     retries: int = default_retries, backoff: float = default_backoff, **kwargs) -> pd.DataFrame:
+    """Calls provider.fetch_ticker(), retrying ProviderError with exponential backoff (re-raised after the last try)."""
+    for attempt in range(retries + 1):
+        limiter.wait()
+        try:
+            return provider.fetch_ticker(exchange_ticker, **kwargs)
+        except ProviderError:
+            if attempt == retries:
+                raise
+            time.sleep(backoff * 2**attempt)
+
+
+def iter_ticker_fetches(provider: RateProvider, starts: Dict[str, Optional[date]], workers: int = default_workers,
+                        retries: int = default_retries, backoff: float = default_backoff,
+                        rate_limit: float = default_rate_limit, **kwargs) -> Iterator[Tuple[str, Optional[pd.DataFrame], Optional[Exception]]]:
+    """
+    Downloads tickers on a bounded thread pool, each from its own start date.
+    Parameters:
+        starts (dict): in format of {"EURUSD=X": date(2024, 1, 5), "PLNUSD=X": None, ...} (None downloads the whole period)
+        kwargs: period, interval and end passed to every download
+    Yields:
+        (exchange_ticker, batch, error) (tuple): in order of completion, batch is None when every attempt failed
+    """
+    limiter = RateLimiter(rate_limit)
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {
+            executor.submit(fetch_with_retry, provider, exchange_ticker, limiter, retries, backoff,
+                            **{**kwargs, "start": start or kwargs.get("start")}): exchange_ticker
+            for exchange_ticker, start in starts.items()
+        }
+        for future in as_completed(futures):
+            try:
+                yield futures[future], future.result(), None
+            except ProviderError as error:
+                yield futures[future], None, error
@@ -0,0 +1,48 @@
+"""
+Resampling of rate history into OHLC buckets (open, high, low, close = last, mean, count) with pandas.
+Buckets are labelled by their start, weeks start on Monday and months on their first day.
+"""
+import pandas as pd
+
+from typing import Iterable, List
+
+INTERVAL_RULES = {
+    "1h": "1h",
+    "1d": "1D",
+    "1wk": "W-MON",
+    "1mo": "MS",
+}
+
+
+def rates_to_frame(rows: Iterable[dict]) -> pd.DataFrame:
+    """
+    Builds a (naive UTC) timestamp indexed frame with "currency_pair" and "exchange_rate" columns out of rate dictionaries.
+    Rows without ts (self-exchange rates) are dropped, daily rows start at midnight.
+    """
+    frame = pd.DataFrame.from_records(list(rows), columns=["currency_pair", "ts", "exchange_rate"])
+    frame = frame[frame["ts"].notna()]
+    frame.index = pd.DatetimeIndex(pd.to_datetime(frame["ts"], utc=True)).tz_localize(None)
+    frame.index.name = "timestamp"
+    frame["exchange_rate"] = frame["exchange_rate"].astype("float64")
+    return frame[["currency_pair", "exchange_rate"]].sort_index()
+
+
+def resample_rates(rows: Iterable[dict], interval: str) -> List[dict]:
+    """
+    Parameters:
+        rows (iterable): rate dictionaries with "currency_pair", "ts" and "exchange_rate" keys
+        interval (str): one of INTERVAL_RULES keys
+    Returns:
+        buckets (list): in format of [{"currency_pair": "EURUSD", "start": ..., "open": ..., "high": ..., "low": ...,
+                        "close": ..., "mean": ..., "count": ...}, ...] ordered by pair and start, empty buckets skipped
+    """
+    frame = rates_to_frame(rows)
+    if frame.empty:
+        return []
+    grouped = (frame.groupby("currency_pair")["exchange_rate"]
+               .resample(INTERVAL_RULES[interval], label="left", closed="left"))
+    buckets = grouped.ohlc()
+    buckets["mean"] = grouped.mean()
+    buckets["count"] = grouped.count()
+    buckets = buckets[buckets["count"] > 0].reset_index().rename(columns={"timestamp": "start"})
+    return buckets.to_dict("records")
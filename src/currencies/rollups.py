@@ -0,0 +1,162 @@
+"""
+Precomputed OHLC buckets (RateRollup) of every pair at daily, weekly and monthly interval.
+Buckets are the ones resampling.resample_rates() builds out of raw rates (archived rates included), they are
+recomputed from raw rates whenever rates within them change: by Rate.save(), Rate deletes and by fetch_data
+after each batch.
+The rebuild_rollups command recomputes all of them.
+"""
+from datetime import date, datetime, timedelta, timezone
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from django.db.models import QuerySet
+
+from .archive import has_archive, read_archive_frame
+from .fields import RATE_SCALE, scaled
+from .models import Currency, Rate, RateRollup, RollupInterval
+from .timestamps import to_timestamp
+
+ROLLUP_INTERVALS = [interval.value for interval in RollupInterval]
+ROLLUP_COLUMNS = ["open", "high", "low", "close", "mean"]
+
+
+def get_bucket_start(ts: datetime, interval: str) -> datetime:
+    """Start of the bucket ts falls into (weeks start on Monday, months on their first day)."""
+    start = ts.replace(hour=0, minute=0, second=0, microsecond=0)
+    if interval == RollupInterval.WEEK:
+        return start - timedelta(days=start.weekday())
+    if interval == RollupInterval.MONTH:
+        return start.replace(day=1)
+    return start
+
+
+def get_next_bucket_start(start: datetime, interval: str) -> datetime:
+    if interval == RollupInterval.WEEK:
+        return start + timedelta(days=7)
+    if interval == RollupInterval.MONTH:
+        return (start + timedelta(days=32)).replace(day=1)
+    return start + timedelta(days=1)
+
+
+def can_use_rollups(interval: str, start: Optional[date] = None, end: Optional[date] = None) -> bool:
+    """
+    True if buckets of a (start, end) date range (both inclusive) are whole rollups.
+    Raw rates cut at the range bounds would otherwise give partial first or last buckets.
+    """
+    if interval not in ROLLUP_INTERVALS:
+        return False
+    bounds = [to_timestamp(day) for day in (start, end and end + timedelta(days=1)) if day]
+    return all(get_bucket_start(bound, interval) == bound for bound in bounds)
+
+
+def get_pair_rates(base_id: int, quote_id: int, pair: str, ts__gte: datetime, ts__lt: datetime) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Raw rates of a pair within [ts__gte, ts__lt), archived ones included.
+    Returns:
+        (timestamps, rates) (tuple): naive UTC datetime64[us] and float64 arrays (unordered)
+    """
+    rows = (Rate.objects.filter(base_currency_id=base_id, quote_currency_id=quote_id, ts__gte=ts__gte, ts__lt=ts__lt)
+            .values_list("ts", scaled("exchange_rate")))
+    frame = pd.DataFrame.from_records(list(rows), columns=["ts", "exchange_rate"])
+    if has_archive():
+        archived = read_archive_frame([pair], ts__gte=ts__gte, ts__lt=ts__lt)
+        frame = pd.concat([archived[["ts", "exchange_rate"]], frame], ignore_index=True)
+    timestamps = pd.DatetimeIndex(pd.to_datetime(frame["ts"], utc=True)).tz_localize(None).to_numpy(dtype="datetime64[us]")
+    return timestamps, frame["exchange_rate"].to_numpy(dtype="float64") / RATE_SCALE
+
+
+def get_bucket_starts(timestamps: np.ndarray, interval: str) -> np.ndarray:
+    """Vectorized get_bucket_start() of naive UTC datetime64 timestamps."""
+    days = timestamps.astype("datetime64[D]")
+    if interval == RollupInterval.WEEK:
+        # 1970-01-01 was a Thursday
+        return days - ((days.astype("int64") + 3) % 7).astype("timedelta64[D]")
+    if interval == RollupInterval.MONTH:
+        return timestamps.astype("datetime64[M]").astype("datetime64[D]")
+    return days
+
+
+def compute_buckets(timestamps: np.ndarray, rates: np.ndarray, interval: str) -> List[dict]:
+    """
+    OHLC buckets of rates, the same resample_rates() returns (without currency_pair), computed with numpy reductions
+    over contiguous buckets of time ordered rates (resampling a few buckets with pandas costs milliseconds).
+    """
+    if not len(rates):
+        return []
+    order = np.argsort(timestamps, kind="stable")
+    timestamps, rates = timestamps[order], rates[order]
+    starts, first = np.unique(get_bucket_starts(timestamps, interval), return_index=True)
+    last = np.append(first[1:], len(rates)) - 1
+    counts = last - first + 1
+    columns = {"open": rates[first].tolist(),
+               "high": np.maximum.reduceat(rates, first).tolist(),
+               "low": np.minimum.reduceat(rates, first).tolist(),
+               "close": rates[last].tolist(),
+               "mean": (np.add.reduceat(rates, first) / counts).tolist()}
+    starts = starts.astype("datetime64[us]").tolist()
+    return [{"start": start, "count": count, **{column: values[index] for column, values in columns.items()}}
+            for index, (start, count) in enumerate(zip(starts, counts.tolist()))]
+
+
+def refresh_rollups(ranges: Dict[Tuple[int, int], Tuple[datetime, datetime]]) -> int:
+    """
+    Recomputes every bucket overlapping the changed ts range of each pair. Call it inside the transaction that
+    changed the rates. Raw rates are read once per pair, over the union of the buckets of every interval.
+    Parameters:
+        ranges (dict): in format of {(base_currency_id, quote_currency_id): (first_ts, last_ts), ...}, both inclusive
+    Returns:
+        count (int): number of stored buckets
+    """
+    codes = dict(Currency.objects.filter(id__in={currency_id for pair in ranges for currency_id in pair})
+                 .values_list("id", "code"))
+    count = 0
+    for (base_id, quote_id), (first, last) in ranges.items():
+        bounds = {interval: (get_bucket_start(first, interval),
+                             get_next_bucket_start(get_bucket_start(last, interval), interval))
+                  for interval in ROLLUP_INTERVALS}
+        timestamps, rates = get_pair_rates(base_id, quote_id, f"{codes[base_id]}{codes[quote_id]}",
+                                           min(start for start, _ in bounds.values()),
+                                           max(end for _, end in bounds.values()))
+        for interval, (start, end) in bounds.items():
+            within = (timestamps >= np.datetime64(start.replace(tzinfo=None))) & (timestamps < np.datetime64(end.replace(tzinfo=None)))
+            buckets = compute_buckets(timestamps[within], rates[within], interval)
+            RateRollup.objects.filter(base_currency_id=base_id, quote_currency_id=quote_id, interval=interval,
+                                      ts__gte=start, ts__lt=end).delete()
+            RateRollup.objects.bulk_create([
+                RateRollup(base_currency_id=base_id,
+                           quote_currency_id=quote_id,
+                           interval=interval,
+                           ts=bucket["start"].replace(tzinfo=timezone.utc),
+                           count=bucket["count"],
+                           **{column: bucket[column] for column in ROLLUP_COLUMNS})
+                for bucket in buckets
+            ])
+            count += len(buckets)
+    return count
+
+
+def get_frame_ranges(frame: pd.DataFrame) -> Dict[Tuple[int, int], Tuple[datetime, datetime]]:
+    """refresh_rollups() ranges of a frame with currency id columns (see ingestion.attach_currency_ids())."""
+    ranges = {}
+    for base_id, quote_id, _date_, _time_ in zip(frame["base_currency_id"].tolist(), frame["quote_currency_id"].tolist(),
+                                                 frame["date"].tolist(), frame["time"].tolist()):
+        ts = to_timestamp(_date_, _time_)
+        first, last = ranges.get((base_id, quote_id), (ts, ts))
+        ranges[(base_id, quote_id)] = (min(first, ts), max(last, ts))
+    return ranges
+
+
+def rollup_rows(qs: QuerySet) -> List[dict]:
+    """
+    Returns buckets of RateRollup rows in format and order of resample_rates() (by pair and start).
+    """
+    rows = (qs.order_by("base_currency__code", "quote_currency__code", "ts")
+            .values_list("base_currency__code", "quote_currency__code", "ts", "count",
+                         *[scaled(column) for column in ROLLUP_COLUMNS]))
+    return [{"currency_pair": f"{base}{quote}",
+             "start": ts.replace(tzinfo=None), # naive UTC, as resample_rates() labels buckets
+             "count": count,
+             **{column: value / RATE_SCALE for column, value in zip(ROLLUP_COLUMNS, values)}}
+            for base, quote, ts, count, *values in rows]
@@ -1,5 +1,11 @@
 from ninja import Schema
 
+import datetime
+from decimal import Decimal
+from typing import Annotated, List, Optional
+
+from pydantic import BaseModel, ConfigDict, Field, Strict, StringConstraints, model_validator
+
 class CurrencyListSchema(Schema):
     # List -> CurrencyOut
     code: str
@@ -8,3 +14,74 @@ class RateDetailSchema(Schema):
     # Detail => RateOut
     currency_pair: str
     exchange_rate: float
+
+class RateListSchema(Schema):
+    # List => RateOut with timestamp
+    currency_pair: str
+    exchange_rate: float
+    date: Optional[datetime.date] = None
+    time: Optional[datetime.time] = None
+
+class RatePageSchema(Schema):
+    items: List[RateListSchema]
+    next_cursor: Optional[str] = None
+
+class RateBucketSchema(Schema):
+    # OHLC of rates within [start, start + interval)
+    currency_pair: str
+    start: datetime.datetime
+    open: float
+    high: float
+    low: float
+    close: float
+    mean: float
+    count: int
+
+class RateBucketListSchema(Schema):
+    interval: str
+    buckets: List[RateBucketSchema]
+
+# Convert schemas are plain pydantic models, ninja Schema wraps every item in a getter (too slow for 10k+ items)
+# field types below are shared with the parser of currencies.conversion, which validates the body by hand
+CURRENCY_CODE_PATTERN = r"^[A-Za-z0-9]{3}$"
+CurrencyCode = Annotated[str, StringConstraints(pattern=CURRENCY_CODE_PATTERN)]
+ConvertDate = Annotated[datetime.date, Strict()] # ISO 8601 string only, no timestamps
+ConvertInstant = Annotated[datetime.datetime, Strict()]
+
+class ConvertItemSchema(BaseModel):
+    # amount in "from" currency, converted with the latest rate or the one in effect on date or at instant (not both)
+    model_config = ConfigDict(populate_by_name=True)
+    amount: Decimal = Field(allow_inf_nan=False)
+    from_: CurrencyCode = Field(alias="from")
+    to: CurrencyCode
+    date: Optional[ConvertDate] = None
+    at: Optional[ConvertInstant] = None
+
+    @model_validator(mode="after")
+    def check_single_point(self):
+        if (self.date is not None) and (self.at is not None):
+            raise ValueError("An item can have either a date or an instant, not both.")
+        return self
+
+class ConvertRequestSchema(BaseModel):
+    items: List[ConvertItemSchema]
+
+def get_convert_openapi() -> dict:
+    """OpenAPI request body of the convert endpoint (item schema inlined, components only know response schemas)."""
+    schema = ConvertRequestSchema.model_json_schema()
+    schema["properties"]["items"]["items"] = schema.pop("$defs")["ConvertItemSchema"]
+    return {"requestBody": {"content": {"application/json": {"schema": schema}}, "required": True}}
+
+class ConvertResultSchema(ConvertItemSchema):
+    # both None when the rate is unknown
+    exchange_rate: Optional[Decimal] = None
+    converted: Optional[Decimal] = None
+
+class ConvertResponseSchema(BaseModel):
+    items: List[ConvertResultSchema]
+
+class CacheStatsSchema(Schema):
+    hits: int
+    misses: int
+    hit_ratio: float
+    generation: int
@@ -0,0 +1,99 @@
+"""
+Streaming export of rates (NDJSON or CSV) from a server-side iterator, memory use does not depend on row count.
+Also Server-Sent Events of pushed latest rates (see currencies.broadcast).
+"""
+import csv
+import json
+
+from typing import AsyncIterable, AsyncIterator, Iterable, Iterator, List, Union
+
+from django.http import StreamingHttpResponse
+
+EXPORT_COLUMNS = ["currency_pair", "date", "time", "exchange_rate"]
+CONTENT_TYPES = {
+    "ndjson": "application/x-ndjson",
+    "csv": "text/csv",
+}
+export_chunk_size = 2000
+# comment lines sent to idle event streams, keep proxies and load balancers from closing them
+heartbeat_interval = 15
+
+
+class Echo:
+    """File-like object returning what is written, lets csv.writer produce lines for a generator."""
+    def write(self, value):
+        return value
+
+
+def serialize_row(row: dict) -> list:
+    return [row["currency_pair"],
+            row["date"].isoformat() if row["date"] else None,
+            row["time"].isoformat() if row["time"] else None,
+            float(row["exchange_rate"])]
+
+
+def iter_ndjson(rows: Iterable[dict]) -> Iterator[str]:
+    for row in rows:
+        yield json.dumps(dict(zip(EXPORT_COLUMNS, serialize_row(row)))) + "\n"
+
+
+def iter_csv(rows: Iterable[dict]) -> Iterator[str]:
+    writer = csv.writer(Echo())
+    yield writer.writerow(EXPORT_COLUMNS)
+    for row in rows:
+        yield writer.writerow(serialize_row(row))
+
+
+async def aiter_lines(rows: AsyncIterable[dict], format: str) -> AsyncIterator[str]:
+    """Async version of iter_ndjson() / iter_csv()."""
+    writer = csv.writer(Echo())
+    if format == "csv":
+        yield writer.writerow(EXPORT_COLUMNS)
+    async for row in rows:
+        if format == "csv":
+            yield writer.writerow(serialize_row(row))
+        else:
+            yield json.dumps(dict(zip(EXPORT_COLUMNS, serialize_row(row)))) + "\n"
+
+
+def stream_rates(rows: Union[Iterable[dict], AsyncIterable[dict]], format: str) -> StreamingHttpResponse:
+    """
+    Parameters:
+        rows (iterable): rate dictionaries (i.e. from pagination.iter_rate_rows() with chunk_size),
+                         async iterables are streamed as async content (served without blocking under ASGI)
+        format (str): one of CONTENT_TYPES keys
+    """
+    if hasattr(rows, "__aiter__"):
+        content = aiter_lines(rows, format)
+    else:
+        content = iter_ndjson(rows) if format == "ndjson" else iter_csv(rows)
+    response = StreamingHttpResponse(content, content_type=CONTENT_TYPES[format])
+    if format == "csv":
+        response["Content-Disposition"] = 'attachment; filename="rates.csv"'
+    return response
+
+
+def format_event(message: dict) -> str:
+    return f"event: rate\ndata: {json.dumps(message)}\n\n"
+
+
+async def aiter_events(broadcaster, subscription, snapshot: List[dict]) -> AsyncIterator[str]:
+    """
+    Server-Sent Events of a subscription: snapshot messages first, then every pushed one.
+    Unsubscribes when the client disconnects (the server cancels the iterator).
+    """
+    try:
+        for message in snapshot:
+            yield format_event(message)
+        while True:
+            message = await subscription.get(timeout=heartbeat_interval)
+            yield format_event(message) if message else ": heartbeat\n\n"
+    finally:
+        broadcaster.unsubscribe(subscription)
+
+
+def stream_events(broadcaster, subscription, snapshot: List[dict]) -> StreamingHttpResponse:
+    response = StreamingHttpResponse(aiter_events(broadcaster, subscription, snapshot), content_type="text/event-stream")
+    response["Cache-Control"] = "no-cache"
+    response["X-Accel-Buffering"] = "no" # nginx would buffer the stream otherwise
+    return response
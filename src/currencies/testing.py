@@ -0,0 +1,25 @@
+"""
+Test helpers of currencies.
+"""
+from contextlib import contextmanager
+
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.test.utils import CaptureQueriesContext
+
+
+class QueryBudgetMixin:
+    """
+    TestCase mixin failing a test when a block runs more queries than its declared budget.
+    Unlike assertNumQueries() the budget is an upper bound, it catches N+1 regressions without pinning exact counts:
+
+        with self.assertQueryBudget(3):
+            self.client.get("/api/currency/rates/")
+    """
+    @contextmanager
+    def assertQueryBudget(self, budget: int, using: str = DEFAULT_DB_ALIAS):
+        with CaptureQueriesContext(connections[using]) as context:
+            yield context
+        executed = len(context)
+        if executed > budget:
+            queries = "\n".join(f"{index}. {query['sql']}" for index, query in enumerate(context.captured_queries, start=1))
+            self.fail(f"{executed} queries executed, budget is {budget}:\n{queries}")
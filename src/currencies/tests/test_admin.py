@@ -0,0 +1,76 @@
+from django.contrib.auth import get_user_model
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+
+from datetime import datetime, timedelta
+from unittest import mock
+
+from currencies.admin import ApproximateCountPaginator, IndexedDatesQuerySet
+from currencies.models import Currency, Rate
+
+class RateAdminTest(TestCase):
+    def setUp(self):
+        self.currencies = {code: Currency.objects.create(code=code) for code in ["USD", "EUR", "PLN"]}
+        base_time = datetime(2023, 12, 30, 22, 0, 0)
+        for i in range(6):
+            timestamp = base_time + timedelta(hours=13*i)
+            for base in ("EUR", "PLN"):
+                Rate.objects.create(base_currency=self.currencies[base],
+                                    quote_currency=self.currencies["USD"],
+                                    exchange_rate=1+i/10,
+                                    date=timestamp.date(),
+                                    time=timestamp.time())
+        user = get_user_model().objects.create_superuser("admin", "admin@example.com", "password")
+        self.client.force_login(user)
+        self.url = "/admin/currencies/rate/"
+
+    def get_changelist(self, **params):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(self.url, params)
+        self.assertEqual(response.status_code, 200)
+        return response.context["cl"], queries.captured_queries
+
+    def test_changelist_queries(self):
+        """
+        Test if listed currencies are joined (no query per row) and nothing counts the whole table.
+        """
+        cl, queries = self.get_changelist()
+        self.assertEqual(cl.result_count, Rate.objects.count())
+        for base in ("EUR", "PLN"):
+            Rate.objects.create(base_currency=self.currencies[base], quote_currency=self.currencies["USD"],
+                                exchange_rate=2, date=datetime(2024, 2, 1).date(), time=None)
+        _, more_queries = self.get_changelist()
+        self.assertEqual(len(more_queries), len(queries))
+        self.assertFalse([query for query in more_queries if 'COUNT(*) AS "__count" FROM "currencies_rate"' in query["sql"]])
+
+    def test_search_exact_codes(self):
+        """
+        Test if search matches exact codes and pairs only.
+        """
+        self.assertEqual(self.get_changelist(q="eurusd")[0].result_count, 6)
+        self.assertEqual(self.get_changelist(q="PLN")[0].result_count, 7) # self-exchange rate included
+        self.assertEqual(self.get_changelist(q="USD")[0].result_count, 13)
+        self.assertEqual(self.get_changelist(q="EU")[0].result_count, 0)
+        self.assertEqual(self.get_changelist(base_currency=self.currencies["EUR"].id)[0].result_count, 7)
+
+    def test_date_hierarchy_choices(self):
+        """
+        Test if index seeks find the same periods as DISTINCT over truncated timestamps.
+        """
+        qs = Rate.objects.filter(ts__isnull=False)
+        indexed = IndexedDatesQuerySet(model=Rate, query=qs.query)
+        for kind in ("year", "month", "day"):
+            self.assertEqual(indexed.datetimes("ts", kind), list(qs.datetimes("ts", kind)))
+        cl, _ = self.get_changelist(ts__year=2024)
+        self.assertEqual(cl.result_count, 8)
+
+    def test_approximate_count(self):
+        """
+        Test if filtered counts are capped and unfiltered ones come from planner statistics when available.
+        """
+        with mock.patch("currencies.admin.admin_count_limit", 5):
+            self.assertEqual(ApproximateCountPaginator(Rate.objects.filter(base_currency__code="EUR").order_by("ts"), 2).count, 5)
+        with connection.cursor() as cursor:
+            cursor.execute("ANALYZE")
+        self.assertEqual(ApproximateCountPaginator(Rate.objects.order_by("ts"), 2).count, Rate.objects.count())
@@ -1,9 +1,21 @@
+from django.conf import settings
 from django.test import TestCase
 from django.utils import timezone
 
-from datetime import datetime
+from datetime import datetime, timedelta
+from decimal import Decimal
+import json
 
-from currencies.models import Rate, Currency
+from pydantic import ValidationError
+
+from currencies import cache
+from currencies.asof import get_cross_rate_as_of, to_instant
+from currencies.conversion import max_convert_items
+from currencies.models import Rate, RateRollup, Currency
+from currencies.pagination import iter_rate_rows
+from currencies.resampling import resample_rates
+from currencies.schemas import ConvertRequestSchema, ConvertResponseSchema
+from currencies.triangulation import get_latest_rate_matrix
 
 class APITest(TestCase):
     def setUp(self):
@@ -40,3 +52,331 @@ class APITest(TestCase):
         """
         response = self.client.get(f"/api/currency/{self.base_currency_code}/AAAA/")
         self.assertEqual(response.status_code, 404)
+
+    def test_rate_detail_cache(self):
+        """
+        Test if repeated detail requests are served from cache and new rates invalidate it.
+        """
+        cache.reset_stats()
+        url = f"/api/currency/{self.base_currency_code}/{self.quote_currency_code}/"
+        self.client.get(url)
+        with self.assertNumQueries(0):
+            response = self.client.get(url)
+        self.assertEqual(response.json()['exchange_rate'], self.obj.exchange_rate)
+        stats = self.client.get("/api/currency/cache/").json()
+        self.assertEqual((stats['hits'], stats['misses']), (1, 1))
+
+        Rate.objects.create(base_currency=self.base_currency_obj,
+                            quote_currency=self.quote_currency_obj,
+                            exchange_rate=2.5,
+                            time=self.obj.time,
+                            date=self.obj.date.replace(year=2025))
+        self.assertEqual(self.client.get(url).json()['exchange_rate'], 2.5)
+
+    def test_conditional_requests(self):
+        """
+        Test if unchanged polls get 304 without queries and new rates change ETag and Last-Modified.
+        """
+        url = f"/api/currency/rates/?base={self.base_currency_code}&quote={self.quote_currency_code}"
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response["Cache-Control"], f"public, max-age={settings.CURRENCY_HTTP_MAX_AGE}")
+        etag, last_modified = response["ETag"], response["Last-Modified"]
+        with self.assertNumQueries(0):
+            response = self.client.get(url, headers={"If-None-Match": etag})
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response["Cache-Control"], f"public, max-age={settings.CURRENCY_HTTP_MAX_AGE}")
+        self.assertEqual(self.client.get(url, headers={"If-Modified-Since": last_modified}).status_code, 304)
+
+        Rate.objects.create(base_currency=self.base_currency_obj,
+                            quote_currency=self.quote_currency_obj,
+                            exchange_rate=2.5,
+                            time=self.obj.time,
+                            date=self.obj.date.replace(year=2025))
+        response = self.client.get(url, headers={"If-None-Match": etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response["ETag"], etag)
+        self.assertEqual(len(response.json()['items']), 2)
+        self.assertNotIn("ETag", self.client.post("/api/currency/convert", {"items": []}, content_type="application/json"))
+
+class TriangulationAPITest(TestCase):
+    def setUp(self):
+        # only legs against the pivot (USD) are stored
+        self.currencies = {code: Currency.objects.create(code=code) for code in ["USD", "EUR", "PLN"]}
+        base_time = datetime(2024, 1, 1, 12, 0, 0)
+        for code, exchange_rate in (("EUR", 1.1), ("PLN", 0.25)):
+            Rate.objects.create(base_currency=self.currencies[code],
+                                quote_currency=self.currencies["USD"],
+                                exchange_rate=exchange_rate,
+                                time=base_time.time(),
+                                date=base_time.date())
+
+    def test_get_triangulated_rate_detail(self):
+        """
+        Test if pair not stored directly is computed through the pivot (including inverse of a leg).
+        """
+        response = self.client.get("/api/currency/EUR/PLN/")
+        self.assertEqual(response.status_code, 200)
+        self.assertAlmostEqual(response.json()['exchange_rate'], 1.1/0.25)
+        response = self.client.get("/api/currency/USD/PLN/")
+        self.assertAlmostEqual(response.json()['exchange_rate'], 4.0)
+
+    def test_list_triangulated_rates(self):
+        """
+        Test if rates list falls back to triangulated history for pairs not stored directly.
+        """
+        response = self.client.get("/api/currency/rates/?base=eur&quote=pln")
+        self.assertEqual(response.status_code, 200)
+        items = response.json()['items']
+        self.assertEqual(len(items), 1)
+        self.assertEqual(items[0]['currency_pair'], "EURPLN")
+        self.assertAlmostEqual(items[0]['exchange_rate'], 1.1/0.25)
+
+    def test_triangulated_pages_on_shared_timestamp(self):
+        """
+        Test if a page boundary between daily and hourly triangulated rows of the same ts neither skips nor repeats rows.
+        """
+        for code, exchange_rate in (("EUR", 1.2), ("PLN", 0.3)):
+            for _time_ in (None, datetime.min.time()): # daily and hourly rate at midnight
+                Rate.objects.create(base_currency=self.currencies[code], quote_currency=self.currencies["USD"],
+                                    exchange_rate=exchange_rate, date=datetime(2024, 1, 1).date(), time=_time_)
+        seen = []
+        url = "/api/currency/rates/?base=eur&quote=pln&limit=1"
+        while url:
+            page = self.client.get(url).json()
+            seen.extend(page['items'])
+            url = f"/api/currency/rates/?base=eur&quote=pln&limit=1&cursor={page['next_cursor']}" if page['next_cursor'] else None
+        self.assertEqual([(item['date'], item['time']) for item in seen],
+                         [("2024-01-01", None), ("2024-01-01", "00:00:00"), ("2024-01-01", "12:00:00")])
+
+    def test_latest_rate_matrix(self):
+        """
+        Test if matrix[i, j] holds rate of codes[i] to codes[j].
+        """
+        codes, matrix = get_latest_rate_matrix(["EUR", "PLN", "USD"])
+        self.assertEqual(matrix.shape, (3, 3))
+        self.assertAlmostEqual(matrix[0, 1], 1.1/0.25)
+        self.assertAlmostEqual(matrix[1, 0], 0.25/1.1)
+        self.assertAlmostEqual(matrix[2, 2], 1.0)
+
+class RateListAPITest(TestCase):
+    def setUp(self):
+        self.base_currency_obj = Currency.objects.create(code="USD")
+        self.quote_currency_obj = Currency.objects.create(code="EUR")
+        base_time = datetime(2024, 1, 1, 12, 0, 0)
+        self.number_of_obj = 7
+        for i in range(self.number_of_obj):
+            timestamp = base_time + timedelta(hours=i)
+            Rate.objects.create(base_currency=self.base_currency_obj,
+                                quote_currency=self.quote_currency_obj,
+                                exchange_rate=1+i/10,
+                                time=timestamp.time() if i%2 else None, # mix of daily and hourly rows
+                                date=timestamp.date() + timedelta(days=i//2))
+
+    def test_keyset_pagination(self):
+        """
+        Test if following next_cursor walks every rate exactly once, in (date, time, id) order, with constant queries.
+        """
+        seen = []
+        url = "/api/currency/rates/?base=usd&quote=eur&limit=3"
+        while url:
+            with self.assertNumQueries(3): # pair exists check, currency codes, page
+                page = self.client.get(url).json()
+            seen.extend(page['items'])
+            url = f"/api/currency/rates/?base=usd&quote=eur&limit=3&cursor={page['next_cursor']}" if page['next_cursor'] else None
+        self.assertEqual(len(seen), self.number_of_obj)
+        keys = [(item['date'], item['time'] or "") for item in seen]
+        self.assertEqual(keys, sorted(keys))
+
+    def test_resampled_rates(self):
+        """
+        Test if interval returns OHLC buckets labelled by their start.
+        """
+        response = self.client.get("/api/currency/rates/?base=usd&quote=eur&interval=1d")
+        self.assertEqual(response.status_code, 200)
+        buckets = response.json()['buckets']
+        self.assertEqual(len(buckets), 4)
+        self.assertEqual(buckets[0]['start'], "2024-01-01T00:00:00")
+        self.assertEqual((buckets[0]['open'], buckets[0]['high'], buckets[0]['close'], buckets[0]['count']), (1.0, 1.1, 1.1, 2))
+
+        buckets = self.client.get("/api/currency/rates/?base=usd&quote=eur&interval=1wk").json()['buckets']
+        self.assertEqual(len(buckets), 1)
+        self.assertEqual((buckets[0]['open'], buckets[0]['low'], buckets[0]['close'], buckets[0]['count']), (1.0, 1.0, 1.6, 7))
+        self.assertAlmostEqual(buckets[0]['mean'], 1.3)
+
+    def test_date_range(self):
+        """
+        Test if start and end limit listed and resampled rates (both inclusive).
+        """
+        page = self.client.get("/api/currency/rates/?base=usd&quote=eur&start=2024-01-02&end=2024-01-03").json()
+        self.assertEqual(len(page['items']), 4)
+        buckets = self.client.get("/api/currency/rates/?base=usd&quote=eur&start=2024-01-02&interval=1d").json()['buckets']
+        self.assertEqual([bucket['start'][:10] for bucket in buckets], ["2024-01-02", "2024-01-03", "2024-01-04"])
+
+    def test_resampled_rates_from_rollups(self):
+        """
+        Test if whole buckets are served from rollups and match buckets resampled from raw rates.
+        """
+        RateRollup.objects.filter(interval="1wk").update(count=0) # tells rollups apart from raw rates
+        buckets = self.client.get("/api/currency/rates/?base=usd&quote=eur&interval=1wk").json()['buckets']
+        self.assertEqual([bucket['count'] for bucket in buckets], [0])
+        buckets = self.client.get("/api/currency/rates/?base=usd&quote=eur&start=2024-01-02&interval=1wk").json()['buckets']
+        self.assertEqual([bucket['count'] for bucket in buckets], [5]) # partial week, resampled from raw rates
+
+        for interval in ("1d", "1mo"):
+            with self.assertNumQueries(2): # LatestRate check and rollups
+                buckets = self.client.get(f"/api/currency/rates/?base=usd&quote=eur&interval={interval}").json()['buckets']
+            expected = resample_rates(iter_rate_rows(Rate.objects.all()), interval)
+            self.assertEqual([(bucket['start'], bucket['count']) for bucket in buckets],
+                             [(bucket['start'].isoformat(), bucket['count']) for bucket in expected])
+            for bucket, expected_bucket in zip(buckets, expected):
+                for column in ("open", "high", "low", "close", "mean"):
+                    self.assertAlmostEqual(bucket[column], expected_bucket[column])
+
+    def test_invalid_pagination_arguments(self):
+        """
+        Test if invalid cursor, limit or format are rejected.
+        """
+        self.assertEqual(self.client.get("/api/currency/rates/?cursor=abc").status_code, 400)
+        self.assertEqual(self.client.get("/api/currency/rates/?limit=0").status_code, 400)
+        self.assertEqual(self.client.get("/api/currency/rates/?format=xml").status_code, 400)
+        self.assertEqual(self.client.get("/api/currency/rates/?interval=2d").status_code, 400)
+
+    def test_resampled_rates_need_pair(self):
+        """
+        Test if raw rates are resampled only for a single pair, while whole buckets of every pair come from rollups.
+        """
+        self.assertEqual(self.client.get("/api/currency/rates/?interval=1h").status_code, 400)
+        self.assertEqual(self.client.get("/api/currency/rates/?base=usd&interval=1h").status_code, 400)
+        self.assertEqual(self.client.get("/api/currency/rates/?start=2024-01-02&interval=1wk").status_code, 400)
+        self.assertEqual(self.client.get("/api/currency/rates/?interval=1wk").status_code, 200)
+        self.assertEqual(self.client.get("/api/currency/rates/?base=usd&quote=eur&interval=1h").status_code, 200)
+
+    def test_streaming_export(self):
+        """
+        Test if NDJSON and CSV exports stream every row of the filtered rates.
+        """
+        response = self.client.get("/api/currency/rates/?base=usd&quote=eur&format=ndjson")
+        self.assertEqual(response['Content-Type'], "application/x-ndjson")
+        lines = b"".join(response.streaming_content).decode().splitlines()
+        self.assertEqual(len(lines), self.number_of_obj)
+        self.assertEqual(json.loads(lines[0])['currency_pair'], "USDEUR")
+
+        response = self.client.get("/api/currency/rates/?format=csv")
+        lines = b"".join(response.streaming_content).decode().splitlines()
+        self.assertEqual(lines[0], "currency_pair,date,time,exchange_rate")
+        self.assertEqual(len(lines), 1 + self.number_of_obj + 2) # header + rates + self-exchange rates
+
+class ConvertAPITest(TestCase):
+    def setUp(self):
+        self.currencies = {code: Currency.objects.create(code=code) for code in ["USD", "EUR", "PLN"]}
+        for code, exchange_rate, day in (("EUR", "1.1", 1), ("EUR", "1.2", 5), ("PLN", "0.25", 1)):
+            Rate.objects.create(base_currency=self.currencies[code],
+                                quote_currency=self.currencies["USD"],
+                                exchange_rate=exchange_rate,
+                                time=None,
+                                date=datetime(2024, 1, day).date())
+
+    def convert(self, items):
+        return self.client.post("/api/currency/convert", {"items": items}, content_type="application/json")
+
+    def test_convert_latest(self):
+        """
+        Test if undated items are converted with latest stored or triangulated rates using a single query.
+        """
+        items = [{"amount": "10", "from": "eur", "to": "USD"},
+                 {"amount": "100", "from": "PLN", "to": "EUR"},
+                 {"amount": "3.5", "from": "PLN", "to": "PLN"},
+                 {"amount": "1", "from": "EUR", "to": "GBP"}] * 1000
+        with self.assertNumQueries(1):
+            response = self.convert(items)
+        self.assertEqual(response.status_code, 200)
+        results = response.json()['items']
+        self.assertEqual(len(results), len(items))
+        self.assertEqual((results[0]['from'], results[0]['exchange_rate'], results[0]['converted']), ("EUR", "1.20000000", "12.00000000"))
+        self.assertEqual(Decimal(results[1]['converted']), Decimal("100") * Decimal("0.25") / Decimal("1.2"))
+        self.assertEqual(Decimal(results[2]['converted']), Decimal("3.5"))
+        self.assertIsNone(results[3]['converted'])
+
+    def test_convert_as_of_date(self):
+        """
+        Test if dated items use the last rate on or before their date, within the lookback window.
+        """
+        items = [{"amount": "10", "from": "EUR", "to": "USD", "date": "2024-01-04"},
+                 {"amount": "10", "from": "EUR", "to": "USD", "date": "2024-01-05"},
+                 {"amount": "10", "from": "USD", "to": "PLN", "date": "2024-01-03"},
+                 {"amount": "10", "from": "EUR", "to": "USD", "date": "2023-12-31"},
+                 {"amount": "10", "from": "EUR", "to": "USD"}]
+        with self.assertNumQueries(2):
+            results = self.convert(items).json()['items']
+        self.assertEqual([Decimal(result['converted']) for result in results[:3]], [11, 12, 40])
+        self.assertIsNone(results[3]['exchange_rate'])
+        self.assertEqual(results[4]['date'], None)
+
+    def test_rate_detail_as_of(self):
+        """
+        Test if detail with an instant returns the rate in effect then, stored or triangulated from legs as of then.
+        """
+        url = "/api/currency/{}/?at={}"
+        with self.assertNumQueries(2): # currency ids and a single ORDER BY ts DESC LIMIT 1
+            response = self.client.get(url.format("EUR/USD", "2024-01-04T23:59:59Z"))
+        self.assertEqual(response.json()['exchange_rate'], 1.1)
+        self.assertEqual(self.client.get(url.format("eur/usd", "2024-01-05T00:00:00")).json()['exchange_rate'], 1.2)
+        response = self.client.get(url.format("PLN/EUR", "2024-01-03T00:00:00%2B01:00"))
+        self.assertAlmostEqual(response.json()['exchange_rate'], 0.25 / 1.1)
+        self.assertEqual(self.client.get(url.format("EUR/USD", "2023-12-31T12:00:00Z")).status_code, 404)
+        self.assertEqual(self.client.get(url.format("EUR/USD", "2024-01-20T00:00:00Z")).status_code, 404) # beyond lookback
+
+    def test_convert_as_of_instants(self):
+        """
+        Test if items with instants resolved from pair series at once match single as-of lookups.
+        """
+        instants = [datetime.fromisoformat("2023-12-31T00:00:00+00:00") + timedelta(hours=7 * i) for i in range(50)]
+        pairs = [("EUR", "USD"), ("USD", "EUR"), ("PLN", "EUR"), ("EUR", "EUR"), ("GBP", "USD")]
+        items = [{"amount": "10", "from": base, "to": quote, "at": at.isoformat()} for at in instants for base, quote in pairs]
+        with self.assertNumQueries(1):
+            results = self.convert(items).json()['items']
+        for item, result in zip(items, results):
+            expected = get_cross_rate_as_of(item['from'], item['to'], datetime.fromisoformat(item['at']))
+            self.assertEqual(result['exchange_rate'] and Decimal(result['exchange_rate']), expected)
+        self.assertEqual(results[0]['at'], "2023-12-31T00:00:00+00:00")
+        self.assertEqual(self.convert([{"amount": "1", "from": "EUR", "to": "USD", "date": "2024-01-02",
+                                        "at": "2024-01-02T00:00:00"}]).status_code, 400)
+
+    def test_convert_invalid_items(self):
+        """
+        Test if malformed items and batches over the limit are rejected.
+        """
+        for item in ({"amount": "abc", "from": "EUR", "to": "USD"},
+                     {"amount": "NaN", "from": "EUR", "to": "USD"},
+                     {"amount": "1", "from": "EU\"R", "to": "USD"},
+                     {"amount": "1", "from": "EUR", "to": "USD", "date": "2024-13-01"},
+                     {"amount": "1", "from": "EUR"}):
+            self.assertEqual(self.convert([item]).status_code, 400)
+        items = [{"amount": "1", "from": "EUR", "to": "USD"}] * (max_convert_items + 1)
+        self.assertEqual(self.convert(items).status_code, 400)
+
+    def test_convert_follows_schema(self):
+        """
+        Test if the hand-written parser accepts and rejects the same items as ConvertRequestSchema,
+        and if responses are valid ConvertResponseSchema documents echoing the items.
+        """
+        changes = [{"amount": 10}, {"amount": 1.5}, {"amount": "1e3"}, {"amount": " 1 "}, {"amount": "Infinity"},
+                   {"amount": True}, {"amount": None}, {"amount": [1]}, {"from": "eur"}, {"from": "EURO"},
+                   {"from": "ÄBC"}, {"from": 1}, {"to": None}, {"date": "2024-01-02"}, {"date": "20240102"},
+                   {"date": "2024-01-02T00:00:00"}, {"date": 20240102}, {"date": 1.5}, {"at": "2024-01-02T15:30:00"},
+                   {"at": "2024-01-02 15:30+01:00"}, {"at": "2024-01-02"}, {"at": "1704209400"}, {"at": 1704209400},
+                   {"date": "2024-01-02", "at": "2024-01-02T00:00:00Z"}, {"date": None, "at": None}]
+        for change in changes:
+            item = {"amount": "1", "from": "EUR", "to": "PLN", **change}
+            with self.subTest(item=item):
+                response = self.convert([item])
+                try:
+                    expected = ConvertRequestSchema.model_validate_json(json.dumps({"items": [item]})).items[0]
+                except ValidationError:
+                    self.assertEqual(response.status_code, 400)
+                    continue
+                self.assertEqual(response.status_code, 200)
+                result = ConvertResponseSchema.model_validate_json(response.content).items[0]
+                self.assertEqual((result.amount, result.from_, result.to), (expected.amount, "EUR", "PLN"))
+                self.assertEqual((result.date, result.at), (expected.date, expected.at and to_instant(expected.at))) # naive is UTC
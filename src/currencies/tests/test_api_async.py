@@ -0,0 +1,122 @@
+from asgiref.sync import sync_to_async
+from django.test import RequestFactory, TestCase
+from ninja.testing import TestAsyncClient
+
+from datetime import datetime, timedelta
+import asyncio
+import json
+
+from currencies.api_async import router, stream_latest_rates
+from currencies.broadcast import CacheBroadcaster, get_broadcaster
+from currencies.models import Rate, Currency
+
+class AsyncAPITest(TestCase):
+    def setUp(self):
+        self.client = TestAsyncClient(router)
+        self.base_currency_obj = Currency.objects.create(code="USD")
+        self.quote_currency_obj = Currency.objects.create(code="EUR")
+        base_time = datetime(2024, 1, 1, 12, 0, 0)
+        self.number_of_obj = 5
+        for i in range(self.number_of_obj):
+            self.obj = Rate.objects.create(base_currency=self.base_currency_obj,
+                                           quote_currency=self.quote_currency_obj,
+                                           exchange_rate=1+i/10,
+                                           time=(base_time+timedelta(hours=i)).time(),
+                                           date=base_time.date())
+
+    async def test_get_currency_list(self):
+        """
+        Test if async list request returns every currency.
+        """
+        response = await self.client.get("")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual({row['code'] for row in response.json()}, {"USD", "EUR"})
+
+    async def test_get_rate_detail(self):
+        """
+        Test if async detail request returns the latest rate and 404 for unknown codes.
+        """
+        response = await self.client.get("/USD/EUR/")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), {"currency_pair": "USDEUR", "exchange_rate": 1.4})
+        response = await self.client.get("/USD/AAA/")
+        self.assertEqual(response.status_code, 404)
+
+    async def test_list_rates(self):
+        """
+        Test if async list request paginates the same way as the sync one.
+        """
+        page = (await self.client.get("rates/?base=usd&quote=eur&limit=3")).json()
+        self.assertEqual(len(page['items']), 3)
+        page = (await self.client.get(f"rates/?base=usd&quote=eur&limit=3&cursor={page['next_cursor']}")).json()
+        self.assertEqual([item['exchange_rate'] for item in page['items']], [1.3, 1.4])
+        self.assertIsNone(page['next_cursor'])
+        response = await self.client.get("rates/?interval=1h")
+        self.assertEqual(response.status_code, 400) # raw rates are resampled only for a single pair
+
+    async def test_conditional_requests(self):
+        """
+        Test if async endpoints answer unchanged polls with 304 too.
+        """
+        response = await self.client.get("/USD/EUR/")
+        self.assertEqual(response.status_code, 200)
+        response = await self.client.get("/USD/EUR/", META={"HTTP_IF_NONE_MATCH": response["ETag"]})
+        self.assertEqual(response.status_code, 304)
+
+    async def test_convert(self):
+        """
+        Test if async convert endpoint converts with the latest rate.
+        """
+        response = await self.client.post("convert", json={"items": [{"amount": "2", "from": "usd", "to": "eur"}]})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['items'][0]['converted'], "2.80000000")
+
+    def create_rate(self, exchange_rate: float, day: int):
+        with self.captureOnCommitCallbacks(execute=True):
+            Rate.objects.create(base_currency=self.base_currency_obj,
+                                quote_currency=self.quote_currency_obj,
+                                exchange_rate=exchange_rate,
+                                time=None,
+                                date=datetime(2024, 1, day).date())
+
+    async def read_event(self, events):
+        lines = (await anext(events)).decode().splitlines()
+        self.assertEqual(lines[0], "event: rate")
+        return json.loads(lines[1].removeprefix("data: "))
+
+    async def test_stream_latest_rates(self):
+        """
+        Test if subscribed clients get the latest rate first and then every new latest rate of their pairs only.
+        """
+        response = await stream_latest_rates(RequestFactory().get("/stream/"), pairs="usdeur,EURUSD")
+        self.assertEqual(response["Content-Type"], "text/event-stream")
+        events = aiter(response.streaming_content)
+        self.assertEqual(await self.read_event(events), {"currency_pair": "USDEUR", "exchange_rate": 1.4,
+                                                         "date": "2024-01-01", "time": "16:00:00"})
+        await sync_to_async(self.create_rate)(1.5, 1) # older than the latest hourly rate, not pushed
+        await sync_to_async(self.create_rate)(1.6, 2)
+        self.assertEqual(await self.read_event(events), {"currency_pair": "USDEUR", "exchange_rate": 1.6,
+                                                         "date": "2024-01-02", "time": None})
+        # client disconnect cancels the waiting response
+        reading = asyncio.ensure_future(anext(events))
+        await asyncio.sleep(0.01)
+        reading.cancel()
+        with self.assertRaises(asyncio.CancelledError):
+            await reading
+        self.assertEqual(get_broadcaster().get_subscribed_pairs(), [])
+        response = await self.client.get("stream/?pairs=USDEUR,USD")
+        self.assertEqual(response.status_code, 400)
+
+    async def test_cache_broadcaster(self):
+        """
+        Test if rates published through the cache reach subscribers of the polling process.
+        """
+        broadcaster = CacheBroadcaster(poll_interval=0.01)
+        subscription = broadcaster.subscribe(["USDEUR"])
+        await subscription.get(timeout=0.05) # first poll
+        broadcaster.publish([{"currency_pair": "EURUSD", "exchange_rate": 0.5}])
+        broadcaster.publish([{"currency_pair": "USDEUR", "exchange_rate": 2.0}])
+        self.assertEqual(await subscription.get(timeout=1), {"currency_pair": "USDEUR", "exchange_rate": 2.0})
+        self.assertIsNone(await subscription.get(timeout=0.05))
+        broadcaster.unsubscribe(subscription)
+        await broadcaster.poller
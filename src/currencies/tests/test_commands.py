@@ -1,11 +1,29 @@
-from django.test import TestCase
+from django.test import TestCase, override_settings
 from django.core.management import CommandError, call_command
+from django.apps import apps
+from django.db.models import F
 
+from datetime import date, time
+from decimal import Decimal
 from math import factorial
+from unittest import mock, skipIf, skipUnless
+from io import StringIO
+from importlib import import_module
+from importlib.util import find_spec
+import json
+import pstats
 import re
+import tempfile
 
+import numpy as np
+import pandas as pd
+
+from currencies.archive import drop_archived_rows
+from currencies.management.commands import rebuild_rollups
 from currencies.management.commands.fetch_data import generate_yfinance_tickers
-from currencies.models import Currency, Rate
+from currencies.models import Currency, LatestRate, Rate, RateRollup
+from currencies.providers import FrameProvider, ProviderError
+from currencies.timestamps import to_timestamp
 
 class YFinanceTestCase(TestCase):
     def setUp(self):
@@ -62,6 +80,13 @@ class YFinanceTestCase(TestCase):
         for ticker in generated_tickers:
             self.assertTrue(re.match(regex_pattern, ticker))
 
+    def test_generate_pivot_tickers(self):
+        """
+        Test if pivot mode generates only N-1 tickers against the pivot.
+        """
+        generated_tickers = generate_yfinance_tickers(self.sample_symbol_list, pivot="USD")
+        self.assertEqual(generated_tickers, ["EURUSD=X", "PLNUSD=X"])
+
     def test_command_expected_result(self):
         """
         Test if command overall result (number of created model instances) because reading multi-level-index csv file from yfinance is a little nightmare. 
@@ -72,3 +97,351 @@ class YFinanceTestCase(TestCase):
         expected_rate_count = len(self.sample_symbol_list) + len(self.sample_symbol_list)*2 # self-exchange + permutation of each two currencies
         rate_count = Rate.objects.count()
         self.assertEqual(rate_count, expected_rate_count)
+
+class FetchDataOfflineTestCase(TestCase):
+    def setUp(self):
+        self.command_name = "fetch_data"
+        self.sample_symbols = "EUR,USD,PLN"
+        self.tickers = generate_yfinance_tickers(self.sample_symbols.split(","))
+        self.periods = 5
+        columns = pd.MultiIndex.from_product([self.tickers, ["Open", "Close"]], names=["Ticker", "Price"])
+        index = pd.date_range("2024-01-01", periods=self.periods, freq="1D", name="Date")
+        self.response = pd.DataFrame(np.linspace(1.0, 2.0, self.periods*len(columns)).reshape(self.periods, -1),
+                                     index=index, columns=columns)
+
+    def call_command(self, *args, provider=None, **kwargs):
+        out = StringIO()
+        provider = provider or FrameProvider(self.response)
+        with mock.patch("currencies.management.commands.fetch_data.get_provider", return_value=provider):
+            call_command(self.command_name, self.sample_symbols, *args, stdout=out, **kwargs)
+        return out.getvalue()
+
+    def test_batched_insert(self):
+        """
+        Test if rows are streamed in batches no bigger than --batch-size and all of them get inserted.
+        """
+        output = self.call_command(batch_size=2)
+        expected_rate_count = 3 + len(self.tickers)*self.periods # self-exchange + every ticker row
+        self.assertEqual(Rate.objects.count(), expected_rate_count)
+        self.assertEqual(output.count("processed 2 rows"), len(self.tickers)*2)
+        self.assertEqual(output.count("processed 1 rows"), len(self.tickers))
+
+    def test_invalid_batch_size_argument(self):
+        """
+        Test if command catches non positive batch size argument.
+        """
+        with self.assertRaises(CommandError):
+            self.call_command(batch_size=0)
+
+    def test_upsert_rerun(self):
+        """
+        Test if re-running with --upsert only touches rows whose rate changed.
+        """
+        self.call_command(upsert=True)
+        expected_rate_count = Rate.objects.count()
+        self.response.iloc[-1, 1] = 5.0 # last close of the first ticker
+        output = self.call_command(upsert=True)
+        self.assertEqual(Rate.objects.count(), expected_rate_count)
+        self.assertIn(f"Inserted 0, updated 1, left {len(self.tickers)*self.periods-1} unchanged", output)
+        self.assertEqual(Rate.get_latest(base_currency__code="EUR", quote_currency__code="USD").exchange_rate, 5)
+
+    def test_plain_rerun(self):
+        """
+        Test if re-running without --upsert nor --conflicts skips stored rows instead of failing on the unique key.
+        """
+        self.call_command()
+        expected_rate_count = Rate.objects.count()
+        self.response.iloc[-1, 1] = 5.0 # last close of the first ticker
+        output = self.call_command()
+        self.assertEqual(Rate.objects.count(), expected_rate_count)
+        self.assertIn(f"Inserted 0, updated 0, left {len(self.tickers)*self.periods} unchanged", output)
+        self.assertIn("Pass --upsert or --conflicts", output)
+        self.assertNotEqual(Rate.get_latest(base_currency__code="EUR", quote_currency__code="USD").exchange_rate, 5)
+
+    def test_conflicts_rerun(self):
+        """
+        Test if re-running with --conflicts replaces rows instead of duplicating them.
+        """
+        self.call_command()
+        expected_rate_count = Rate.objects.count()
+        self.call_command(conflicts=True)
+        self.assertEqual(Rate.objects.count(), expected_rate_count)
+
+    def test_conflicts_mixed_pair_replay(self):
+        """
+        Test if --conflicts over a batch mixing pairs replaces only rows of the pairs in the batch.
+        """
+        currencies = {code: Currency.objects.create(code=code) for code in ["EUR", "USD", "PLN"]}
+        for base, quote, exchange_rate in [("EUR", "PLN", 4.3), ("EUR", "USD", 1.1)]:
+            Rate.objects.create(base_currency=currencies[base], quote_currency=currencies[quote],
+                                exchange_rate=exchange_rate, date=date(2024, 1, 2), time=None)
+        with tempfile.NamedTemporaryFile("w", suffix=".csv") as file:
+            file.write("pair,timestamp,rate\nEURUSD,2024-01-02,1.2\nUSDPLN,2024-01-02,3.9\n")
+            file.flush()
+            call_command(self.command_name, self.sample_symbols, replay=file.name, conflicts=True, stdout=StringIO())
+        rates = Rate.objects.exclude(base_currency=F("quote_currency"))
+        self.assertEqual(sorted(rates.values_list("base_currency__code", "quote_currency__code", "exchange_rate")),
+                         [("EUR", "PLN", Decimal("4.3")), ("EUR", "USD", Decimal("1.2")), ("USD", "PLN", Decimal("3.9"))])
+        self.assertEqual(LatestRate.objects.get(pk="EURPLN").exchange_rate, Decimal("4.3"))
+        self.assertEqual(LatestRate.objects.get(pk="EURUSD").exchange_rate, Decimal("1.2"))
+
+    def test_conflicts_keep_missing_timestamps(self):
+        """
+        Test if --conflicts keeps stored rows within the range of new rates that the new rates do not contain.
+        """
+        self.call_command()
+        rates = Rate.objects.filter(base_currency__code="EUR", quote_currency__code="USD").order_by("ts")
+        before = list(rates.values_list("exchange_rate", flat=True))
+        self.response.iloc[:, 1] = 5.0 # close of the first ticker
+        self.response.iloc[2, 0:2] = np.nan # 2024-01-03 is skipped (no open nor close)
+        self.call_command(conflicts=True)
+        self.assertEqual(list(rates.values_list("exchange_rate", flat=True)), [5, 5, before[2], 5, 5])
+
+    def test_conflicts_and_upsert_arguments(self):
+        """
+        Test if command refuses both conflict handling modes at once.
+        """
+        with self.assertRaises(CommandError):
+            self.call_command(conflicts=True, upsert=True)
+
+    def test_latest_rates_kept_current(self):
+        """
+        Test if ingestion keeps LatestRate table consistent, and if rebuild_latest_rates restores it.
+        """
+        self.call_command()
+        self.assertEqual(LatestRate.objects.count(), 3 + len(self.tickers))
+        self.assertEqual(LatestRate.objects.get(pk="EURUSD").exchange_rate,
+                         Rate.get_latest_by_codes("EUR", "USD").exchange_rate)
+        call_command("rebuild_latest_rates", check=True, stdout=StringIO())
+
+        LatestRate.objects.filter(pk="EURUSD").update(exchange_rate=0)
+        with self.assertRaises(CommandError):
+            call_command("rebuild_latest_rates", check=True, stdout=StringIO())
+        call_command("rebuild_latest_rates", stdout=StringIO())
+        call_command("rebuild_latest_rates", check=True, stdout=StringIO())
+
+    def test_rollups_kept_current(self):
+        """
+        Test if ingestion keeps rollups of changed buckets current, and if rebuild_rollups restores them.
+        """
+        self.call_command(upsert=True)
+        weeks = RateRollup.objects.filter(base_currency__code="EUR", quote_currency__code="USD", interval="1wk")
+        week = weeks.get()
+        rates = Rate.objects.filter(base_currency__code="EUR", quote_currency__code="USD").order_by("ts")
+        self.assertEqual((week.count, week.open, week.close), (self.periods, rates.first().exchange_rate, rates.last().exchange_rate))
+        self.response.iloc[-1, 1] = 5.0 # last close of the first ticker
+        self.call_command(upsert=True)
+        week = weeks.get() # changed buckets are replaced
+        self.assertEqual((week.high, week.close), (5, 5))
+
+        expected = sorted(RateRollup.objects.values_list("base_currency", "quote_currency", "interval", "ts", "close"))
+        RateRollup.objects.all().delete()
+        call_command("rebuild_rollups", stdout=StringIO())
+        self.assertEqual(sorted(RateRollup.objects.values_list("base_currency", "quote_currency", "interval", "ts", "close")),
+                         expected)
+
+    def test_rebuild_rollups_keeps_buckets(self):
+        """
+        Test if rebuild_rollups replaces buckets year by year (a failed rebuild keeps them) and drops stale ones.
+        """
+        self.call_command()
+        eur, usd = Currency.objects.get(code="EUR"), Currency.objects.get(code="USD")
+        Rate.objects.create(base_currency=eur, quote_currency=usd, exchange_rate=1.5, date=date(2023, 6, 1), time=None)
+        days = RateRollup.objects.filter(base_currency=eur, quote_currency=usd, interval="1d")
+        expected = sorted(days.values_list("ts", "close"))
+        # recomputing 2023 passes, 2024 fails
+        with mock.patch.object(rebuild_rollups, "refresh_rollups", side_effect=[None, RuntimeError("failed")]):
+            with self.assertRaises(RuntimeError):
+                call_command("rebuild_rollups", pairs="EURUSD", stdout=StringIO())
+        self.assertEqual(sorted(days.values_list("ts", "close")), expected)
+
+        RateRollup.objects.filter(pk=days.first().pk).update(ts=to_timestamp(date(2020, 1, 1)))
+        call_command("rebuild_rollups", pairs="EURUSD", stdout=StringIO())
+        self.assertEqual(sorted(days.values_list("ts", "close")), expected)
+
+    def test_incremental_rerun(self):
+        """
+        Test if --incremental downloads only rates since the last stored day of each pair and merges them.
+        """
+        provider = FrameProvider(self.response.iloc[:3])
+        self.call_command(incremental=True, rate_limit=0, provider=provider)
+        self.assertTrue(all(start is None for _, start, _ in provider.calls))
+        provider.response = self.response
+        provider.calls.clear()
+        output = self.call_command(incremental=True, rate_limit=0, provider=provider)
+        self.assertEqual(sorted(tickers[0] for tickers, _, _ in provider.calls), sorted(self.tickers))
+        self.assertTrue(all(str(start) == "2024-01-03" for _, start, _ in provider.calls))
+        self.assertIn(f"Inserted {len(self.tickers)*2}, updated 0, left {len(self.tickers)} unchanged", output)
+        self.assertEqual(Rate.objects.count(), 3 + len(self.tickers)*self.periods)
+
+    def test_incremental_failed_download(self):
+        """
+        Test if a ticker failing every retry is skipped while the others are stored.
+        """
+        class FailingProvider(FrameProvider):
+            def fetch_ticker(self, exchange_ticker, **kwargs):
+                if exchange_ticker == "EURUSD=X":
+                    raise ProviderError(f"Download of {exchange_ticker} failed.")
+                return super().fetch_ticker(exchange_ticker, **kwargs)
+
+        with mock.patch("currencies.providers.time.sleep") as sleep:
+            output = self.call_command(incremental=True, retries=2, rate_limit=0, provider=FailingProvider(self.response))
+        self.assertEqual(sleep.call_count, 2) # backoff before each retry
+        self.assertIn("Download of EURUSD=X failed. Skipping...", output)
+        self.assertFalse(Rate.objects.filter(base_currency__code="EUR", quote_currency__code="USD").exists())
+        self.assertEqual(Rate.objects.count(), 3 + (len(self.tickers)-1)*self.periods)
+
+    def test_replay_exported_rates(self):
+        """
+        Test if a CSV export of the rates endpoint replays into an empty database with --replay.
+        """
+        self.call_command()
+        export = b"".join(self.client.get("/api/currency/rates/?format=csv").streaming_content)
+        expected = sorted(Rate.objects.values_list("base_currency__code", "quote_currency__code", "ts", "granularity", "exchange_rate"))
+        Rate.objects.all().delete()
+        with tempfile.NamedTemporaryFile(suffix=".csv") as file:
+            file.write(export)
+            file.flush()
+            out = StringIO()
+            call_command(self.command_name, self.sample_symbols, replay=file.name, stdout=out)
+        rates = sorted(Rate.objects.exclude(base_currency=F("quote_currency"))
+                       .values_list("base_currency__code", "quote_currency__code", "ts", "granularity", "exchange_rate"))
+        self.assertEqual(rates, [rate for rate in expected if rate[0] != rate[1]])
+
+
+    def test_profile(self):
+        """
+        Test if --profile reports every stage with its queries and rows per ticker, and writes JSON report and cProfile dump.
+        """
+        with tempfile.TemporaryDirectory() as directory:
+            report_path, dump_path = f"{directory}/profile.json", f"{directory}/profile.prof"
+            output = self.call_command(upsert=True, profile_report=report_path, profile_dump=dump_path)
+            with open(report_path) as file:
+                report = json.load(file)
+            self.assertGreater(len(pstats.Stats(dump_path).stats), 0)
+        self.assertIn("Profile:", output)
+        self.assertRegex(output, r"EURUSD=X\s+5\n")
+        stages = {stage["name"]: stage for stage in report["stages"]}
+        self.assertEqual(list(stages)[:2], ["currencies", "archive"])
+        for name in ["provider", "download", "parse", "prepare", "commit", "merge", "latest", "rollups", "other"]:
+            self.assertIn(name, stages)
+        self.assertEqual(stages["merge"]["calls"], len(self.tickers)) # a batch per ticker
+        self.assertEqual(sum(stage["queries"] for stage in stages.values()), report["queries"])
+        self.assertGreater(report["peak_memory"], 0)
+        self.assertEqual(report["rows"], len(self.tickers)*self.periods)
+        self.assertEqual(report["rows_per_ticker"]["EURUSD=X"], self.periods)
+        self.assertTrue(report["options"]["upsert"])
+
+        output = self.call_command(upsert=True)
+        self.assertNotIn("Profile:", output)
+
+class ArchiveRatesTestCase(TestCase):
+    def setUp(self):
+        tickers = generate_yfinance_tickers(["EUR", "USD", "PLN"])
+        columns = pd.MultiIndex.from_product([tickers, ["Open", "Close"]], names=["Ticker", "Price"])
+        index = pd.date_range("2023-12-28", periods=10, freq="1D", name="Date")
+        self.response = pd.DataFrame(np.linspace(1.0, 2.0, 10*len(columns)).reshape(10, -1), index=index, columns=columns)
+        self.provider = FrameProvider(self.response)
+        self.call_fetch_data()
+        self.archive_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.archive_dir.cleanup)
+        settings_override = override_settings(CURRENCY_ARCHIVE_DIR=self.archive_dir.name)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+    def call_fetch_data(self, **kwargs):
+        out = StringIO()
+        with mock.patch("currencies.management.commands.fetch_data.get_provider", return_value=self.provider):
+            call_command("fetch_data", "EUR,USD,PLN", stdout=out, **kwargs)
+        return out.getvalue()
+
+    def get_all_rows(self, path):
+        """Follows cursors of a rates endpoint url through every page."""
+        rows, cursor = [], None
+        while True:
+            page = self.client.get(path, {"limit": 4, **({"cursor": cursor} if cursor else {})}).json()
+            rows.extend(page["items"])
+            cursor = page["next_cursor"]
+            if not cursor:
+                return rows
+
+    def test_dry_run(self):
+        """
+        Test if --dry-run reports rates older than --before (without the newest rate of a pair) and keeps them stored.
+        """
+        expected_rate_count = Rate.objects.count()
+        out = StringIO()
+        call_command("archive_rates", before="2024-01-03", dry_run=True, stdout=out)
+        self.assertIn("Would archive 36 rates dated before 2024-01-03", out.getvalue()) # 6 pairs x 6 days
+        self.assertEqual(Rate.objects.count(), expected_rate_count)
+
+    def test_invalid_arguments(self):
+        """
+        Test if command catches invalid --before date and unknown pairs.
+        """
+        with self.assertRaises(CommandError):
+            call_command("archive_rates", before="2024-13-01", dry_run=True, stdout=StringIO())
+        with self.assertRaises(CommandError):
+            call_command("archive_rates", pairs="EURXXX", dry_run=True, stdout=StringIO())
+
+    @skipIf(find_spec("pyarrow"), "pyarrow is installed")
+    def test_archive_without_pyarrow(self):
+        """
+        Test if archiving fails with CommandError when the optional pyarrow dependency is missing.
+        """
+        expected_rate_count = Rate.objects.count()
+        with self.assertRaises(CommandError):
+            call_command("archive_rates", before="2024-01-03", stdout=StringIO())
+        self.assertEqual(Rate.objects.count(), expected_rate_count)
+
+    @skipUnless(find_spec("pyarrow"), "pyarrow is not installed")
+    def test_archived_rates_listed(self):
+        """
+        Test if archived rates are still listed (same rows, order and cursors) and not ingested again.
+        """
+        expected = self.get_all_rows("/api/currency/rates/")
+        expected_pair = self.client.get("/api/currency/rates/", {"base": "EUR", "quote": "USD", "format": "csv"})
+        expected_pair = b"".join(expected_pair.streaming_content)
+        items = [{"amount": "1", "from": "PLN", "to": "EUR", "at": f"2024-01-0{day}T12:00:00Z"} for day in range(1, 6)]
+        convert = lambda: self.client.post("/api/currency/convert", {"items": items}, content_type="application/json").json()
+        expected_converted = convert()
+        expected_as_of = self.client.get("/api/currency/EUR/USD/", {"at": "2024-01-01T12:00:00Z"}).json()
+        self.assertTrue(all(item["exchange_rate"] for item in expected_converted["items"]) and expected_as_of["exchange_rate"])
+        expected_rate_count = Rate.objects.count()
+        call_command("archive_rates", before="2024-01-03", stdout=StringIO())
+        self.assertEqual(Rate.objects.count(), expected_rate_count - 36)
+
+        self.assertEqual(self.get_all_rows("/api/currency/rates/"), expected)
+        self.assertEqual(convert(), expected_converted)
+        self.assertEqual(self.client.get("/api/currency/EUR/USD/", {"at": "2024-01-01T12:00:00Z"}).json(), expected_as_of)
+        pair = self.client.get("/api/currency/rates/", {"base": "EUR", "quote": "USD", "format": "csv"})
+        self.assertEqual(b"".join(pair.streaming_content), expected_pair)
+        self.assertIn("Inserted 0, updated 0, left 24 unchanged", self.call_fetch_data(upsert=True)) # archived days are dropped
+        self.assertEqual(Rate.objects.count(), expected_rate_count - 36)
+
+    @skipUnless(find_spec("pyarrow"), "pyarrow is not installed")
+    def test_initial_rollups_include_archive(self):
+        """
+        Test if the migration populating rollups rolls up archived rates too.
+        """
+        fields = ["base_currency", "quote_currency", "interval", "ts", "open", "close", "count"]
+        expected = sorted(RateRollup.objects.values_list(*fields))
+        call_command("archive_rates", before="2024-01-03", stdout=StringIO())
+        RateRollup.objects.all().delete()
+        import_module("currencies.migrations.0009_raterollup").populate_rollups(apps, None)
+        self.assertEqual(sorted(RateRollup.objects.values_list(*fields)), expected)
+
+    def test_drop_archived_rows(self):
+        """
+        Test if rows at or before the archive boundary of their pair are dropped from ingested batches.
+        """
+        frame = pd.DataFrame({"base": ["EUR", "EUR", "USD"], "quote": ["USD", "USD", "PLN"],
+                              "date": [pd.Timestamp("2024-01-02").date(), pd.Timestamp("2024-01-03").date(),
+                                       pd.Timestamp("2024-01-01").date()],
+                              "time": [None, None, None]})
+        boundaries = {"EURUSD": pd.Timestamp("2024-01-02", tz="UTC").to_pydatetime()}
+        self.assertEqual(drop_archived_rows(frame, boundaries).index.tolist(), [1, 2])
+        self.assertIs(drop_archived_rows(frame, {}), frame)
+        frame["time"] = [time(23, 59, 59, 500000), time(0, 0, 1), None] # intraday rows
+        boundaries["EURUSD"] = pd.Timestamp("2024-01-03", tz="UTC").to_pydatetime()
+        self.assertEqual(drop_archived_rows(frame, boundaries).index.tolist(), [1, 2])
@@ -0,0 +1,84 @@
+from django.test import TestCase
+
+from datetime import date, datetime, time, timezone
+
+import numpy as np
+import pandas as pd
+
+from currencies.ingestion import normalize_yfinance_response, attach_currency_ids, frame_to_rate_instances
+from currencies.providers import FrameProvider, RateProvider
+
+class IngestionTestCase(TestCase):
+    def setUp(self):
+        self.tickers = ["EURUSD=X", "USDEUR=X"]
+        columns = pd.MultiIndex.from_product([self.tickers, ["Open", "Close"]], names=["Ticker", "Price"])
+        values = [[1.10, 1.11, 0.90, np.nan],
+                  [np.nan, np.nan, 0.91, 0.92]]
+        self.daily = pd.DataFrame(values, columns=columns,
+                                  index=pd.DatetimeIndex(["2024-01-01", "2024-01-02"], name="Date"))
+        self.hourly = pd.DataFrame(values, columns=columns,
+                                   index=pd.DatetimeIndex(["2024-01-01 10:00", "2024-01-01 11:00"], name="Datetime"))
+
+    def test_close_to_open_fallback(self):
+        """
+        Tests if rows fall back to Open when Close is NaN and rows without any rate are skipped.
+        """
+        frame, skipped = normalize_yfinance_response(self.daily, self.tickers)
+        self.assertEqual(frame["exchange_rate"].tolist(), [1.11, 0.90, 0.92])
+        self.assertEqual(frame["base"].tolist(), ["EUR", "USD", "USD"])
+        self.assertEqual(frame["quote"].tolist(), ["USD", "EUR", "EUR"])
+        self.assertEqual(skipped["ticker"].tolist(), ["EURUSD=X"])
+
+    def test_timestamp_separation(self):
+        """
+        Tests if daily frames get null time and intraday frames keep the time of day.
+        """
+        frame, _ = normalize_yfinance_response(self.daily, self.tickers)
+        self.assertEqual(frame["date"].tolist(), [date(2024, 1, 1), date(2024, 1, 1), date(2024, 1, 2)])
+        self.assertTrue(frame["time"].isna().all())
+        frame, _ = normalize_yfinance_response(self.hourly, self.tickers)
+        self.assertEqual(frame["time"].tolist(), [time(10), time(10), time(11)])
+
+    def test_provider_batch_per_ticker(self):
+        """
+        Tests if a provider normalizes a response ticker by ticker into the same rows as the whole response at once.
+        """
+        provider = FrameProvider(self.hourly)
+        batches = list(provider.normalize(self.hourly, self.tickers + ["PLNUSD=X"])) # tickers not downloaded are missing
+        self.assertEqual([batch["ticker"].unique().tolist() for batch in batches], [["EURUSD=X"], ["USDEUR=X"]])
+        frame, skipped = normalize_yfinance_response(self.hourly, self.tickers)
+        pd.testing.assert_frame_equal(pd.concat(batches, ignore_index=True), frame)
+        self.assertEqual(pd.concat(provider.skipped)["timestamp"].tolist(), skipped["timestamp"].tolist())
+        self.assertEqual(skipped["timestamp"].tolist(), [pd.Timestamp("2024-01-01 11:00")])
+
+    def test_incomplete_provider(self):
+        """
+        Tests if a provider without iter_batches() fails when it is created, not in the middle of an ingest.
+        """
+        class IncompleteProvider(RateProvider):
+            pass
+
+        with self.assertRaises(TypeError):
+            IncompleteProvider()
+
+    def test_rate_instances(self):
+        """
+        Tests if currency codes are mapped to ids on the built instances.
+        """
+        frame, _ = normalize_yfinance_response(self.daily, self.tickers)
+        instances = frame_to_rate_instances(attach_currency_ids(frame, {"EUR": 1, "USD": 2}))
+        self.assertEqual(len(instances), 3)
+        self.assertEqual((instances[0].base_currency_id, instances[0].quote_currency_id), (1, 2))
+        self.assertIsNone(instances[0].time)
+
+    def test_intraday_timestamps_in_utc(self):
+        """
+        Tests if intraday timestamps of an exchange time zone are stored as UTC ts with the interval granularity.
+        """
+        self.hourly.index = self.hourly.index.tz_localize("Europe/London").tz_convert("Europe/Warsaw")
+        frame, _ = normalize_yfinance_response(self.hourly, self.tickers)
+        instances = frame_to_rate_instances(attach_currency_ids(frame, {"EUR": 1, "USD": 2}), interval="1h")
+        self.assertEqual(instances[0].ts, datetime(2024, 1, 1, 10, tzinfo=timezone.utc))
+        self.assertEqual((instances[0].date, instances[0].time, instances[0].granularity), (date(2024, 1, 1), time(10), "hourly"))
+        instances = frame_to_rate_instances(attach_currency_ids(frame, {"EUR": 1, "USD": 2}), interval="30m")
+        self.assertEqual(instances[0].granularity, "minute")
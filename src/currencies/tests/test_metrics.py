@@ -0,0 +1,83 @@
+from django.conf import settings
+from django.test import TestCase, override_settings
+from ninja.testing import TestClient
+
+from datetime import datetime, timedelta
+
+from currencies import metrics
+from currencies.models import Currency, Rate
+from currencies.testing import QueryBudgetMixin
+
+middleware = [name for name in settings.MIDDLEWARE if name != "currencies.middleware.MetricsMiddleware"]
+
+class MetricsTest(TestCase):
+    def setUp(self):
+        usd, eur = Currency.objects.create(code="USD"), Currency.objects.create(code="EUR")
+        Rate.objects.create(base_currency=usd, quote_currency=eur, exchange_rate=1.1, date=datetime(2024, 1, 1).date(), time=None)
+        metrics.reset_metrics()
+        self.addCleanup(metrics.reset_metrics)
+
+    @override_settings(MIDDLEWARE=["currencies.middleware.MetricsMiddleware", *middleware])
+    def test_request_metrics(self):
+        """
+        Test if requests are recorded per URL pattern with their status, query count and rendered for Prometheus.
+        """
+        self.client.get("/api/currency/USD/EUR/")
+        self.client.get("/api/currency/EUR/USD/")
+        self.client.get("/api/currency/rates/?limit=0")
+        self.client.get("/missing/")
+        text = TestClient(metrics.router).get("").content.decode()
+        labels = 'endpoint="api/currency/<BASE>/<QUOTE>/",method="GET"'
+        self.assertIn(f'currency_api_requests_total{{{labels},status="200"}} 2', text)
+        self.assertIn('currency_api_requests_total{endpoint="api/currency/rates/",method="GET",status="400"} 1', text)
+        self.assertIn('currency_api_requests_total{endpoint="unmatched",method="GET",status="404"} 1', text)
+        self.assertIn(f'currency_api_request_duration_seconds_bucket{{{labels},le="+Inf"}} 2', text)
+        self.assertIn(f'currency_api_db_queries_bucket{{{labels},le="0"}} 0', text) # both looked up (cache miss)
+        self.assertIn("# TYPE currency_api_db_duration_seconds_total counter", text)
+
+    @override_settings(MIDDLEWARE=middleware)
+    def test_disabled_by_default(self):
+        """
+        Test if nothing is recorded without the middleware.
+        """
+        self.client.get("/api/currency/USD/EUR/")
+        self.assertNotIn("currency_api_requests_total{", metrics.render_metrics())
+
+class QueryBudgetTest(QueryBudgetMixin, TestCase):
+    # endpoint: most queries it may run, whatever the number of rows
+    budgets = {
+        "/api/currency/": 1,
+        "/api/currency/PLN/EUR/": 1,
+        "/api/currency/PLN/EUR/?at=2024-01-02T00:00:00Z": 4,
+        "/api/currency/rates/?limit=100": 2,
+        "/api/currency/rates/?base=EUR&quote=USD&limit=100": 3,
+        "/api/currency/rates/?base=PLN&quote=EUR&limit=100": 3,
+        "/api/currency/rates/?base=EUR&quote=USD&interval=1wk&start=2024-01-01&end=2024-01-28": 2,
+    }
+
+    def setUp(self):
+        currencies = {code: Currency.objects.create(code=code) for code in ["USD", "EUR", "PLN"]}
+        rates = [Rate(base_currency=currencies[code], quote_currency=currencies["USD"], exchange_rate=1+i/100,
+                      date=datetime(2024, 1, 1).date() + timedelta(days=i), time=None)
+                 for code in ("EUR", "PLN") for i in range(30)]
+        Rate.objects.bulk_create(rates)
+        for code in ("EUR", "PLN"): # refreshes latest rate and rollups
+            Rate.objects.filter(base_currency=currencies[code], quote_currency=currencies["USD"]).order_by("-ts").first().save()
+
+    def test_endpoint_query_budgets(self):
+        """
+        Test if endpoints stay within their query budgets (no query per listed row).
+        """
+        for url, budget in self.budgets.items():
+            with self.subTest(url=url), self.assertQueryBudget(budget):
+                response = self.client.get(url)
+                self.assertEqual(response.status_code, 200)
+
+    def test_budget_exceeded(self):
+        """
+        Test if the helper fails with listed queries when the budget is exceeded.
+        """
+        with self.assertRaisesRegex(AssertionError, r"2 queries executed, budget is 1:\n1\. SELECT"):
+            with self.assertQueryBudget(1):
+                Currency.objects.count()
+                Rate.objects.count()
@@ -1,9 +1,11 @@
 from django.test import TestCase
 from django.utils import timezone
 
-from datetime import datetime, timedelta
+from datetime import date, datetime, time, timedelta
+from decimal import Decimal
 
-from currencies.models import Rate, Currency
+from currencies.cache import get_generation
+from currencies.models import Rate, Currency, LatestRate, RateRollup
 
 # Create your tests here.
 class RateTestCase(TestCase):
@@ -36,6 +38,78 @@ class RateTestCase(TestCase):
         self.assertEqual(self.obj.time, (self.base_time+timedelta(minutes=self.number_of_obj-1)).time())
         self.assertEqual(self.obj.date, self.base_time.date())
 
+    def test_get_latest_by_codes(self):
+        """
+        Tests if code based lookup returns the same latest rate without querying currencies again.
+        """
+        obj = Rate.get_latest_by_codes(self.base_currency_code, self.quote_currency_code)
+        self.assertEqual(obj, self.latest_obj)
+        with self.assertNumQueries(0):
+            self.assertEqual(obj.currency_pair, f"{self.base_currency_code}{self.quote_currency_code}")
+        self.assertIsNone(Rate.get_latest_by_codes(self.base_currency_code, "AAA"))
+
+    def test_latest_rate_follows_rate_save(self):
+        """
+        Tests if LatestRate row of a pair holds the newest saved rate.
+        """
+        latest = LatestRate.objects.get(pk=f"{self.base_currency_code}{self.quote_currency_code}")
+        self.assertEqual((latest.date, latest.time), (self.latest_obj.date, self.latest_obj.time))
+        Rate.objects.create(base_currency=self.base_currency_obj,
+                            quote_currency=self.quote_currency_obj,
+                            exchange_rate=2.5,
+                            time=self.base_time.time(),
+                            date=(self.base_time+timedelta(days=1)).date())
+        latest.refresh_from_db()
+        self.assertEqual(latest.exchange_rate, 2.5)
+
+    def test_latest_rate_follows_rate_delete(self):
+        """
+        Tests if deleting rates (an instance or a queryset) refreshes LatestRate and rollups of the pair and invalidates the cache.
+        """
+        pair = f"{self.base_currency_code}{self.quote_currency_code}"
+        generation = get_generation()
+        self.latest_obj.delete()
+        self.assertGreater(get_generation(), generation)
+        latest = LatestRate.objects.get(pk=pair)
+        self.assertEqual(latest.time, (self.base_time+timedelta(minutes=self.number_of_obj-2)).time())
+        self.assertEqual(RateRollup.objects.get(base_currency=self.base_currency_obj, quote_currency=self.quote_currency_obj,
+                                                interval="1d").count, self.number_of_obj-1)
+        Rate.objects.filter(base_currency=self.base_currency_obj, quote_currency=self.quote_currency_obj,
+                            ts__gte=self.latest_obj.ts-timedelta(minutes=4)).delete()
+        self.assertEqual(LatestRate.objects.get(pk=pair).time, (self.base_time+timedelta(minutes=4)).time())
+        Rate.objects.filter(base_currency=self.base_currency_obj, quote_currency=self.quote_currency_obj).delete()
+        self.assertFalse(LatestRate.objects.filter(pk=pair).exists())
+        self.assertFalse(RateRollup.objects.filter(base_currency=self.base_currency_obj).exists())
+        self.assertTrue(LatestRate.objects.filter(pk=f"{self.base_currency_code}{self.base_currency_code}").exists())
+
+    def test_exchange_rate_fixed_point(self):
+        """
+        Tests if exchange_rate keeps 8 decimal places exactly (stored as a scaled integer) and filters by value.
+        """
+        obj = Rate.objects.create(base_currency=self.base_currency_obj, quote_currency=self.quote_currency_obj,
+                                  exchange_rate=0.006123456789, date=self.base_time.date())
+        obj.refresh_from_db()
+        self.assertEqual(obj.exchange_rate, Decimal("0.00612346"))
+        self.assertEqual(Rate.objects.values_list("exchange_rate", flat=True).get(pk=obj.pk), Decimal("0.00612346"))
+        self.assertEqual(Rate.objects.filter(exchange_rate=Decimal("0.00612346")).get(), obj)
+        self.assertEqual(Rate.objects.filter(exchange_rate__lt=0.01).get(), obj)
+        self.assertEqual(Rate.objects.filter(exchange_rate__gte="1.234").count(), self.number_of_obj)
+
+    def test_timestamp_and_granularity(self):
+        """
+        Tests if date and time are merged into a UTC ts, and a daily rate does not clash with an hourly one at midnight.
+        """
+        daily = Rate.objects.create(base_currency=self.base_currency_obj, quote_currency=self.quote_currency_obj,
+                                    exchange_rate=1.5, date=date(2024, 2, 1), time=None)
+        hourly = Rate.objects.create(base_currency=self.base_currency_obj, quote_currency=self.quote_currency_obj,
+                                     exchange_rate=1.6, date=date(2024, 2, 1), time=time(0, 0))
+        self.assertEqual(daily.ts.isoformat(), "2024-02-01T00:00:00+00:00")
+        self.assertEqual(hourly.ts, daily.ts)
+        self.assertEqual((daily.granularity, hourly.granularity), ("daily", "hourly"))
+        daily.refresh_from_db()
+        self.assertEqual((daily.date, daily.time), (date(2024, 2, 1), None))
+        self.assertEqual(Rate.objects.filter(ts__gte=daily.ts).count(), 2)
+
 class CurrencyTestCase(TestCase):
     def setUp(self):
         self.obj = Currency.objects.create(code="pln")
@@ -54,3 +128,13 @@ class CurrencyTestCase(TestCase):
         Currency.objects.filter(id=self.obj.id).update(code="eur")
         self.updated_obj = Currency.objects.get(id=self.obj.id) 
         self.assertEqual(self.updated_obj.code, "EUR")
+
+    def test_self_exchange_latest_rate(self):
+        """
+        Tests if creating a currency creates its self-exchange LatestRate and renaming it renames the pair.
+        """
+        self.assertEqual(LatestRate.objects.get(pk="PLNPLN").exchange_rate, 1)
+        self.obj.code = "czk"
+        self.obj.save()
+        self.assertFalse(LatestRate.objects.filter(pk="PLNPLN").exists())
+        self.assertTrue(LatestRate.objects.filter(pk="CZKCZK").exists())
@@ -0,0 +1,91 @@
+from django.db import connection
+from django.test import TestCase
+
+from datetime import date, datetime, timezone
+from decimal import Decimal
+from unittest import skipIf, skipUnless
+
+from currencies.ingestion import insert_rates
+from currencies.models import Currency, LatestRate, Rate
+from currencies.partitioning import ensure_rate_partitions, get_partition_name, get_partition_years
+
+postgresql = connection.vendor == "postgresql"
+
+class PartitioningTestCase(TestCase):
+    def setUp(self):
+        self.eur, self.usd = Currency.objects.create(code="EUR"), Currency.objects.create(code="USD")
+
+    def create_rates(self, *days):
+        insert_rates([Rate(base_currency_id=self.eur.id, quote_currency_id=self.usd.id, exchange_rate=1.08451234,
+                           date=day, time=None) for day in days])
+
+    def get_partition(self, rate_id: int) -> str:
+        with connection.cursor() as cursor:
+            cursor.execute(f"SELECT tableoid::regclass::text FROM {Rate._meta.db_table} WHERE id = %s", [rate_id])
+            return cursor.fetchone()[0]
+
+    def test_insert_rates(self):
+        """
+        Test if inserted rates (COPY on PostgreSQL) keep exact values and get ids not colliding with later rows.
+        """
+        self.create_rates(date(2023, 12, 31), date(2024, 1, 1))
+        rates = Rate.objects.filter(base_currency=self.eur, quote_currency=self.usd).order_by("ts")
+        self.assertEqual([rate.date for rate in rates], [date(2023, 12, 31), date(2024, 1, 1)])
+        self.assertEqual({rate.exchange_rate for rate in rates}, {Decimal("1.08451234")})
+        created = Rate.objects.create(base_currency=self.eur, quote_currency=self.usd, exchange_rate=1.1,
+                                      date=date(2024, 1, 2), time=None)
+        self.assertGreater(created.id, max(rate.id for rate in rates))
+        self.assertEqual(LatestRate.objects.get(pk="EURUSD").exchange_rate, Decimal("1.1"))
+
+    def test_insert_rates_on_conflict(self):
+        """
+        Test if inserted rates whose key is already stored are skipped or update the stored rate, instead of failing.
+        """
+        self.create_rates(date(2024, 1, 1))
+        rates = lambda exchange_rate: [Rate(base_currency_id=self.eur.id, quote_currency_id=self.usd.id,
+                                            exchange_rate=exchange_rate, date=day, time=None)
+                                       for day in (date(2024, 1, 1), date(2024, 1, 2))]
+        insert_rates(rates(1.1), on_conflict="ignore")
+        stored = Rate.objects.filter(base_currency=self.eur, quote_currency=self.usd).order_by("ts")
+        self.assertEqual(list(stored.values_list("exchange_rate", flat=True)), [Decimal("1.08451234"), Decimal("1.1")])
+        insert_rates(rates(1.2), on_conflict="update")
+        self.assertEqual(list(stored.values_list("exchange_rate", flat=True)), [Decimal("1.2"), Decimal("1.2")])
+
+    @skipIf(postgresql, "rates are partitioned on PostgreSQL")
+    def test_plain_table(self):
+        """
+        Test if other databases keep a plain rate table.
+        """
+        self.assertIsNone(get_partition_years())
+        self.assertEqual(ensure_rate_partitions([(datetime(2024, 1, 1, tzinfo=timezone.utc),) * 2]), [])
+
+    @skipUnless(postgresql, "needs PostgreSQL")
+    def test_yearly_partitions(self):
+        """
+        Test if partitions are created for every year of ingested ranges, moving rows out of the default partition.
+        """
+        self.create_rates(date(2022, 6, 1)) # no partition yet, lands in the default one
+        default = f"{Rate._meta.db_table}_default"
+        rate_id = Rate.objects.get(ts__year=2022).id
+        self.assertEqual(self.get_partition(rate_id), default)
+        self.assertEqual(self.get_partition(Rate.objects.get(base_currency=self.eur, quote_currency=self.eur).id), default)
+
+        ranges = [(datetime(2022, 6, 1, tzinfo=timezone.utc), datetime(2024, 1, 1, tzinfo=timezone.utc))]
+        self.assertEqual(ensure_rate_partitions(ranges), [2022, 2023, 2024])
+        self.assertEqual(ensure_rate_partitions(ranges), [])
+        self.assertTrue({2022, 2023, 2024} <= get_partition_years())
+        self.assertEqual(self.get_partition(rate_id), get_partition_name(2022))
+        self.assertEqual(Rate.objects.get(ts__year=2022).id, rate_id)
+
+    @skipUnless(postgresql, "needs PostgreSQL")
+    def test_partition_indexes(self):
+        """
+        Test if new partitions get the btree and BRIN indexes of the rate table.
+        """
+        ensure_rate_partitions([(datetime(2024, 1, 1, tzinfo=timezone.utc),) * 2])
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT indexdef FROM pg_indexes WHERE tablename = %s", [get_partition_name(2024)])
+            definitions = [definition for definition, in cursor.fetchall()]
+        self.assertTrue(any("USING brin (ts)" in definition for definition in definitions))
+        self.assertTrue(any("(base_currency_id, quote_currency_id, ts DESC, exchange_rate)" in definition
+                            for definition in definitions))
@@ -0,0 +1,49 @@
+from django.test import SimpleTestCase
+
+from datetime import date, time
+from pathlib import Path
+import tempfile
+
+from currencies.providers import ProviderError, ReplayProvider
+
+class ReplayProviderTestCase(SimpleTestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = Path(self.directory.name)
+        (self.path / "compact.csv").write_text("pair,timestamp,rate\n"
+                                               "EURUSD,2024-01-01 10:00,1.10\n"
+                                               "USDEUR,2024-01-01 10:00,0.91\n"
+                                               "EURUSD,2024-01-02 10:00,\n"
+                                               "EURUSD,2024-01-03 10:00,1.12\n")
+        (self.path / "export.csv").write_text("currency_pair,date,time,exchange_rate\n"
+                                              "EURUSD,2024-01-04,,1.13\n"
+                                              "EURUSD,2024-01-04,12:30:00,1.14\n")
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_replay_layouts(self):
+        """
+        Tests if both file layouts are normalized, filtered by pair and [start, end) and rows without rate dropped.
+        """
+        provider = ReplayProvider(self.path, chunk_size=2)
+        frame = provider.fetch_ticker("EURUSD=X", interval="1h", start="2024-01-02", end="2024-01-05")
+        self.assertEqual(frame["ticker"].unique().tolist(), ["EURUSD=X"])
+        self.assertEqual(frame["date"].tolist(), [date(2024, 1, 3), date(2024, 1, 4), date(2024, 1, 4)])
+        self.assertEqual(frame["time"].tolist(), [time(10), None, time(12, 30)])
+        self.assertEqual(frame["exchange_rate"].tolist(), [1.12, 1.13, 1.14])
+
+    def test_replay_daily_interval(self):
+        """
+        Tests if timestamps of daily replays lose their time of day.
+        """
+        batches = list(ReplayProvider(self.path / "compact.csv").iter_batches(["USDEUR=X"], interval="1d"))
+        self.assertEqual(len(batches), 1)
+        self.assertEqual((batches[0]["base"][0], batches[0]["quote"][0], batches[0]["time"][0]), ("USD", "EUR", None))
+
+    def test_missing_replay_source(self):
+        """
+        Tests if a missing file is reported as ProviderError.
+        """
+        with self.assertRaises(ProviderError):
+            ReplayProvider(self.path / "missing.csv")
@@ -0,0 +1,62 @@
+"""
+Rates are keyed by a single UTC timestamp (ts) and its granularity.
+Daily rates are stored at midnight UTC of their date; the date and time of API rows are derived from both
+(time is None for daily rates), the same way they were stored before ts replaced the date and time columns.
+"""
+from datetime import date, datetime, time, timedelta, timezone
+from typing import Optional, Tuple
+
+from django.db import models
+
+
+class Granularity(models.TextChoices):
+    DAILY = "daily", "Daily"
+    HOURLY = "hourly", "Hourly"
+    MINUTE = "minute", "Minute"
+
+
+# granularity of rates downloaded with a fetch_data interval, intervals not listed are daily
+INTERVAL_GRANULARITY = {
+    "1m": Granularity.MINUTE,
+    "2m": Granularity.MINUTE,
+    "5m": Granularity.MINUTE,
+    "15m": Granularity.MINUTE,
+    "30m": Granularity.MINUTE,
+    "60m": Granularity.HOURLY,
+    "90m": Granularity.MINUTE,
+    "1h": Granularity.HOURLY,
+}
+
+
+def to_timestamp(_date_: Optional[date], _time_: Optional[time] = None) -> Optional[datetime]:
+    """Aware UTC timestamp of a date and an optional time of day (midnight for daily rates)."""
+    if _date_ is None:
+        return None
+    return datetime.combine(_date_, _time_ or time.min, tzinfo=timezone.utc)
+
+
+def split_timestamp(ts: Optional[datetime], granularity: str) -> Tuple[Optional[date], Optional[time]]:
+    """Inverse of to_timestamp(): (date, time) of a timestamp, time is None for daily rates."""
+    if ts is None:
+        return (None, None)
+    ts = ts.astimezone(timezone.utc)
+    return (ts.date(), None if granularity == Granularity.DAILY else ts.time())
+
+
+def get_granularity(_time_: Optional[time], interval: Optional[str] = None) -> str:
+    """Granularity of a rate: daily without time, otherwise the one of its interval (guessed from time without it)."""
+    if _time_ is None:
+        return Granularity.DAILY
+    if interval in INTERVAL_GRANULARITY:
+        return INTERVAL_GRANULARITY[interval]
+    return Granularity.HOURLY if (_time_.minute == 0) and (_time_.second == 0) else Granularity.MINUTE
+
+
+def get_ts_range_filters(start: Optional[date] = None, end: Optional[date] = None) -> dict:
+    """filter() arguments of rates dated within [start, end] (both inclusive), as a range scan on ts."""
+    filters = {}
+    if start:
+        filters["ts__gte"] = to_timestamp(start)
+    if end:
+        filters["ts__lt"] = to_timestamp(end + timedelta(days=1))
+    return filters
@@ -0,0 +1,189 @@
+"""
+Cross rates of pairs which are not stored directly, computed through a pivot currency (settings.CURRENCY_PIVOT).
+With every currency stored against the pivot (i.e.: EURUSD, PLNUSD) any pair can be served as:
+    BASE/QUOTE = (BASE/PIVOT) / (QUOTE/PIVOT)
+A stored inverse leg (USDEUR) is used as 1 / (USDEUR) when the direct one (EURUSD) is missing.
+"""
+import numpy as np
+import pandas as pd
+
+from decimal import Decimal
+from typing import Dict, List, Optional
+
+from django.conf import settings
+from django.db.models import Q
+
+from .archive import has_archive, read_archive_frame
+from .fields import RATE_SCALE, scaled
+from .models import Currency, LatestRate, Rate
+from .timestamps import Granularity, split_timestamp
+
+# triangulated rows are not stored, their keyset id (see currencies.pagination) is the ordinal of their granularity,
+# rows of one pair are unique per (ts, granularity) so daily and intraday rows sharing a ts still differ
+GRANULARITY_IDS = {granularity.value: ordinal for ordinal, granularity in enumerate(Granularity)}
+
+
+def get_pivot_code() -> str:
+    return getattr(settings, "CURRENCY_PIVOT", "USD").upper()
+
+
+def get_leg_pairs(code: str, pivot: str) -> List[str]:
+    """Pair codes which can express code in pivot: direct ("EURUSD") and inverse ("USDEUR")."""
+    return [f"{code}{pivot}", f"{pivot}{code}"]
+
+
+def get_leg_value(code: str, pivot: str, rates: Dict[str, Decimal]) -> Optional[Decimal]:
+    """
+    Returns value of one unit of code expressed in pivot currency.
+    Parameters:
+        rates (dict): pair code to rate, in format of {"EURUSD": Decimal("1.08"), ...}
+    """
+    if code == pivot:
+        return Decimal(1)
+    direct, inverse = get_leg_pairs(code, pivot)
+    if direct in rates:
+        return rates[direct]
+    if rates.get(inverse):
+        return 1 / rates[inverse]
+    return None
+
+
+def get_latest_cross_rate(base: str, quote: str) -> Optional[Decimal]:
+    """
+    Returns latest base/quote rate, stored directly or triangulated through the pivot (None if impossible).
+    All candidate rows are read from LatestRate with a single query.
+    """
+    pivot = get_pivot_code()
+    rates = dict(LatestRate.objects.filter(pk__in=get_cross_rate_candidates(base, quote, pivot))
+                 .values_list("pair", "exchange_rate"))
+    return resolve_cross_rate(base, quote, pivot, rates)
+
+
+async def aget_latest_cross_rate(base: str, quote: str) -> Optional[Decimal]:
+    """Async version of get_latest_cross_rate()."""
+    pivot = get_pivot_code()
+    rates = {pair: exchange_rate async for pair, exchange_rate in
+             LatestRate.objects.filter(pk__in=get_cross_rate_candidates(base, quote, pivot))
+             .values_list("pair", "exchange_rate")}
+    return resolve_cross_rate(base, quote, pivot, rates)
+
+
+def get_cross_rate_candidates(base: str, quote: str, pivot: str) -> set:
+    """Pair codes needed to serve base/quote: the pair itself and pivot legs of both currencies."""
+    return {f"{base}{quote}", *get_leg_pairs(base, pivot), *get_leg_pairs(quote, pivot)}
+
+
+def resolve_cross_rate(base: str, quote: str, pivot: str, rates: Dict[str, Decimal]) -> Optional[Decimal]:
+    """Picks the stored base/quote rate out of rates or triangulates it (None if impossible)."""
+    if f"{base}{quote}" in rates:
+        return rates[f"{base}{quote}"]
+    base_value = get_leg_value(base, pivot, rates)
+    quote_value = get_leg_value(quote, pivot, rates)
+    if (base_value is None) or (not quote_value):
+        return None
+    return base_value / quote_value
+
+
+def get_pivot_series(codes: List[str], **filters) -> pd.DataFrame:
+    """
+    Loads history of codes against the pivot from Rate table (and the rate archive, if there is one).
+    Parameters:
+        codes (list): currency codes, in format of ["EUR", "PLN", ...]
+        filters: ts range of Rate.objects.filter() (i.e.: ts__gte=..., ts__lt=..., see get_ts_range_filters())
+    Returns:
+        frame (pd.DataFrame): (ts, granularity) indexed frame with a column of pivot values per code (NaN where missing)
+    """
+    pivot = get_pivot_code()
+    ids = dict(Currency.objects.filter(code__in=[*codes, pivot]).values_list("code", "id"))
+    frame = pd.DataFrame(index=pd.MultiIndex.from_tuples([], names=["ts", "granularity"]),
+                         columns=codes, dtype="float64")
+    if pivot not in ids:
+        return frame
+    leg_ids = [ids[code] for code in codes if (code in ids) and (code != pivot)]
+    rows = (Rate.objects.filter(Q(base_currency_id__in=leg_ids, quote_currency_id=ids[pivot]) |
+                                Q(base_currency_id=ids[pivot], quote_currency_id__in=leg_ids))
+            .filter(**filters)
+            .values_list("base_currency_id", "quote_currency_id", "ts", "granularity", scaled("exchange_rate")))
+    legs = pd.DataFrame.from_records(list(rows), columns=["base_id", "quote_id", "ts", "granularity", "exchange_rate"])
+    if has_archive():
+        legs = pd.concat([get_archived_legs(ids, pivot, leg_ids, **filters), legs], ignore_index=True)
+    if not legs.empty:
+        legs["exchange_rate"] = legs["exchange_rate"].to_numpy(dtype="float64") / RATE_SCALE
+        direct = legs["quote_id"] == ids[pivot]
+        legs["code_id"] = legs["base_id"].where(direct, legs["quote_id"])
+        legs["value"] = legs["exchange_rate"].where(direct, 1 / legs["exchange_rate"])
+        legs["direct"] = direct
+        # direct leg wins when both directions are stored for a timestamp
+        legs = legs.sort_values("direct")
+        codes_by_id = {currency_id: code for code, currency_id in ids.items()}
+        legs["code"] = legs["code_id"].map(codes_by_id)
+        frame = (legs.groupby(["ts", "granularity", "code"], dropna=False)["value"].last()
+                 .unstack("code")
+                 .reindex(columns=codes))
+    if pivot in codes:
+        frame[pivot] = 1.0
+    return frame
+
+
+def get_archived_legs(ids: Dict[str, int], pivot: str, leg_ids: List[int], **filters) -> pd.DataFrame:
+    """Archived pivot legs of get_pivot_series(), in the same columns as the legs read from Rate table."""
+    codes_by_id = {currency_id: code for code, currency_id in ids.items()}
+    pairs = {}
+    for leg_id in leg_ids:
+        pairs[f"{codes_by_id[leg_id]}{pivot}"] = (leg_id, ids[pivot])
+        pairs[f"{pivot}{codes_by_id[leg_id]}"] = (ids[pivot], leg_id)
+    archived = read_archive_frame(pairs, **filters)
+    return pd.DataFrame({"base_id": archived["pair"].map(lambda pair: pairs[pair][0]),
+                         "quote_id": archived["pair"].map(lambda pair: pairs[pair][1]),
+                         "ts": archived["ts"],
+                         "granularity": archived["granularity"].astype(str),
+                         "exchange_rate": archived["exchange_rate"]})
+
+
+def get_cross_rate_series(base: str, quote: str, **filters) -> List[dict]:
+    """
+    Returns base/quote history triangulated through the pivot, for timestamps present in both legs.
+    Returns:
+        rates (list): in format of [{"id": 0, "currency_pair": "EURPLN", "ts": ..., "date": ..., "time": ..., "exchange_rate": 4.3}, ...]
+                      (id is the GRANULARITY_IDS ordinal, the rows are not stored)
+    """
+    frame = get_pivot_series([base, quote], **filters)
+    series = (frame[base] / frame[quote]).dropna()
+    rows = []
+    for (ts, granularity), _exchange_rate_ in series.items():
+        ts = None if pd.isna(ts) else ts.to_pydatetime()
+        _date_, _time_ = split_timestamp(ts, granularity)
+        rows.append({"id": GRANULARITY_IDS[granularity],
+                     "currency_pair": f"{base}{quote}",
+                     "ts": ts,
+                     "date": _date_,
+                     "time": _time_,
+                     "exchange_rate": _exchange_rate_})
+    return rows
+
+
+def cross_rate_matrices(frame: pd.DataFrame) -> np.ndarray:
+    """
+    Builds an N x N cross rate matrix for every timestamp of a get_pivot_series() frame.
+    Returns:
+        matrices (np.ndarray): (timestamps, N, N) array where matrices[t, i, j] is rate of codes[i] to codes[j]
+    """
+    values = frame.to_numpy(dtype="float64")
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return values[:, :, None] / values[:, None, :]
+
+
+def get_latest_rate_matrix(codes: Optional[List[str]] = None):
+    """
+    Builds the N x N matrix of latest cross rates from pivot legs in LatestRate.
+    Returns:
+        (codes, matrix) (tuple): codes of rows/columns and matrix where matrix[i, j] is rate of codes[i] to codes[j]
+    """
+    pivot = get_pivot_code()
+    if codes is None:
+        codes = list(Currency.objects.order_by("code").values_list("code", flat=True))
+    wanted = {pair for code in codes for pair in get_leg_pairs(code, pivot)}
+    rates = dict(LatestRate.objects.filter(pk__in=wanted).values_list("pair", "exchange_rate"))
+    values = np.array([get_leg_value(code, pivot, rates) or np.nan for code in codes], dtype="float64")
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return codes, values[:, None] / values[None, :]
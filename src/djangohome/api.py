@@ -1,4 +1,10 @@
+from django.conf import settings
 from ninja import NinjaAPI
 
 api = NinjaAPI()
-api.add_router("/currency/", "currencies.api.router")
+if settings.CURRENCY_API_ASYNC:
+    api.add_router("/currency/", "currencies.api_async.router")
+else:
+    api.add_router("/currency/", "currencies.api.router")
+if settings.CURRENCY_METRICS:
+    api.add_router("/metrics", "currencies.metrics.router")
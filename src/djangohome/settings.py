@@ -77,14 +77,69 @@ WSGI_APPLICATION = "djangohome.wsgi.application"
 # Database
 # https://docs.djangoproject.com/en/5.1/ref/settings/#databases
 
+# SQLite by default, PostgreSQL (DATABASE_ENGINE="django.db.backends.postgresql", needs psycopg) stores rates
+# in a table partitioned by year, loaded with COPY (see currencies.partitioning).
+
 DATABASES = {
     "default": {
-        "ENGINE": "django.db.backends.sqlite3",
-        "NAME": BASE_DIR / "db.sqlite3",
+        "ENGINE": config("DATABASE_ENGINE", cast=str, default="django.db.backends.sqlite3"),
+        "NAME": config("DATABASE_NAME", cast=str, default="") or str(BASE_DIR / "db.sqlite3"),
+        "USER": config("DATABASE_USER", cast=str, default=""),
+        "PASSWORD": config("DATABASE_PASSWORD", cast=str, default=""),
+        "HOST": config("DATABASE_HOST", cast=str, default=""),
+        "PORT": config("DATABASE_PORT", cast=str, default=""),
+        "CONN_MAX_AGE": config("DATABASE_CONN_MAX_AGE", cast=int, default=0),
+        "CONN_HEALTH_CHECKS": config("DATABASE_CONN_HEALTH_CHECKS", cast=bool, default=False),
+    }
+}
+
+
+# Cache
+# https://docs.djangoproject.com/en/5.1/topics/cache/
+# LocMemCache evicts least recently used entries above MAX_ENTRIES.
+
+CACHES = {
+    "default": {
+        "BACKEND": config("CACHE_BACKEND", cast=str, default="django.core.cache.backends.locmem.LocMemCache"),
+        "LOCATION": config("CACHE_LOCATION", cast=str, default="currency-api"),
+        "TIMEOUT": config("CACHE_TIMEOUT", cast=int, default=300),
+        "OPTIONS": {
+            "MAX_ENTRIES": config("CACHE_MAX_ENTRIES", cast=int, default=1000),
+        },
     }
 }
 
 
+# Currencies
+# Pairs not stored directly are triangulated through this currency.
+
+CURRENCY_PIVOT = config("CURRENCY_PIVOT", cast=str, default="USD")
+
+# Serve /api/currency/ with async views (currencies.api_async), pair it with an ASGI server.
+CURRENCY_API_ASYNC = config("CURRENCY_API_ASYNC", cast=bool, default=False)
+
+# Directory of the historical rate archive (Parquet files, needs pyarrow), relative to BASE_DIR unless absolute.
+# See currencies.archive and archive_rates command.
+CURRENCY_ARCHIVE_DIR = BASE_DIR / config("CURRENCY_ARCHIVE_DIR", cast=str, default="archive")
+# archive_rates moves rates older than this many days by default
+CURRENCY_ARCHIVE_AFTER_DAYS = config("CURRENCY_ARCHIVE_AFTER_DAYS", cast=int, default=365)
+
+# Cache-Control max-age (seconds) of rate endpoints, roughly how often fetch_data runs.
+# Clients and CDNs reuse responses that long, then revalidate them with ETag (see currencies.conditional).
+CURRENCY_HTTP_MAX_AGE = config("CURRENCY_HTTP_MAX_AGE", cast=int, default=300)
+
+# Backend pushing new latest rates to /api/currency/stream/ clients (see currencies.broadcast).
+# LocalBroadcaster reaches clients of the same process only, CacheBroadcaster every process sharing the cache
+# (fetch_data included), pair it with a shared CACHE_BACKEND (Redis, Memcached or database).
+CURRENCY_BROADCAST_BACKEND = config("CURRENCY_BROADCAST_BACKEND", cast=str, default="currencies.broadcast.LocalBroadcaster")
+
+# Latency, database query count and time per endpoint, served on /api/metrics in Prometheus text format
+# (see currencies.metrics). Every worker process counts separately.
+CURRENCY_METRICS = config("CURRENCY_METRICS", cast=bool, default=False)
+if CURRENCY_METRICS:
+    MIDDLEWARE.insert(0, "currencies.middleware.MetricsMiddleware")
+
+
 # Password validation
 # https://docs.djangoproject.com/en/5.1/ref/settings/#auth-password-validators
 